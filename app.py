@@ -1,12 +1,16 @@
+import threading
+
 import dash
+import flask
+from flask_compress import Compress
 from dash import dcc # dash core components
 from dash import html
 from dash.dependencies import Input, Output, State
 
-import plotly.express as px
-
-import numpy as np
-import pandas as pd
+from figure_cache import FigureCache, FigureDiskCache, build_static_figure, build_weekly_figure
+from figure_precompute import figures_dir, precompute_in_background
+from results_store import ResultsStore, default_results_dir, version_key
+from weekly_query import default_max_points, query_weekly, resolutions
 
 #https://www.w3schools.com/colors/colors_picker.asp?color=23272c
 
@@ -100,40 +104,7 @@ def static_figure():
     Returns the static ghg vs gdp scatter plot
     """
     
-    df_static = pd.read_parquet("results/df_static.parquet")  
-    fig_scatter = px.scatter(df_static, 
-                             x = "GDP", 
-                             y = "GHG", 
-                             color = "Country",
-                             hover_data = ["Year"], 
-                             log_x = True, 
-                             log_y = True,
-                             #title = "GH Gas Emission vs GDP",
-                             labels={'GDP':'GDP, Billion USD', 
-                                     'GHG':'GHG, Tonnes of CO2 Equivalent'}, 
-                             height = 700
-                            )
-                            
-    fig_scatter.update_layout(legend=dict(
-                              orientation="h",
-                              yanchor="bottom",
-                              y=1.02,
-                              xanchor="right",
-                              x=1))
-                              
-    fig_scatter.update_layout(font=dict(size = 20))
-                              
-    fig_scatter.update_layout(template='plotly_dark',
-                              plot_bgcolor='#2d3339',
-                              paper_bgcolor='#5b6571')
-    
-    fig_scatter.update_xaxes(gridcolor='#717e8e')
-    fig_scatter.update_yaxes(gridcolor='#717e8e')
-    
-    return html.Div(children=[dcc.Graph(figure = fig_scatter, 
-                                        className = 'offset-by-one nine columns', 
-                                        style={'paddingLeft': '5%'})], 
-                    className="row")
+    return static_figure_responsive('GHG')
 
 def weekly_section():
     """
@@ -172,6 +143,29 @@ def weekly_radio_button():
                 labelStyle={'font-size': '2rem'}, 
                 className="offset-by-two seven columns"
             ),
+            html.Div(id = 'weekly_query_controls', children = [
+                dcc.Markdown('''
+                    Choose the weeks and how to group them
+                    ''', 
+                    className='offset-by-one nine columns', 
+                    style={'paddingLeft': '5%'}),
+                html.Div(children = [
+                    dcc.DatePickerRange(
+                        id = 'weekly_range',
+                        display_format = 'YYYY-MM-DD',
+                        clearable = True,
+                    ),
+                    dcc.RadioItems(
+                        id = 'weekly_resolution',
+                        options = [{'label': 'Auto', 'value': 'auto'}] +
+                                  [{'label': each.capitalize(), 'value': each}
+                                   for each in resolutions],
+                        value = 'auto',
+                        labelStyle = {'font-size': '2rem', 'display': 'inline-block',
+                                      'paddingRight': '2rem'},
+                    ),
+                ], className="offset-by-two seven columns"),
+            ]),
             dcc.Markdown('''
             
                 Also, you can click on the country name on the graph to include/exclude it.
@@ -184,42 +178,10 @@ def weekly_radio_button():
 
 def weekly_figure():
     """
-    Returns the static ghg vs gdp scatter plot
+    Returns the weekly ghg estimation bar plot
     """
     
-    df_weekly = pd.read_parquet("results/df_weekly.parquet")  
-    fig_bar = px.bar(df_weekly, 
-               x = "Week", 
-               y = "GHG_weekly", 
-               color = "Country",
-               #title = "Weekly GH Gas Emission Prediction", 
-               labels={'GHG_weekly':'GHG, Tonnes of CO2 Equivalent'},
-               height = 700
-              )
-
-    fig_bar.update_layout(xaxis_type='category')
-    
-    fig_bar.update_layout(legend=dict(
-                            orientation="h",
-                            yanchor="bottom",
-                            y=1.02,
-                            xanchor="right",
-                            x=1)) 
-    
-    fig_bar.update_layout(font=dict(size = 20))
-    
-    fig_bar.update_layout(template='plotly_dark',
-                          plot_bgcolor='#2d3339',
-                          paper_bgcolor='#5b6571')
-    
-    fig_bar.update_xaxes(showgrid = False)
-    fig_bar.update_yaxes(gridcolor='#717e8e', 
-                         layer = 'above traces')
-    
-    return html.Div(children=[dcc.Graph(figure = fig_bar, 
-                                        className = 'offset-by-one nine columns', 
-                                        style={'paddingLeft': '5%'})], 
-                    className="row")
+    return weekly_figure_responsive('GHG')
 
 def inforgraphic():
     """
@@ -274,6 +236,69 @@ def references():
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 server = app.server
 
+# Brotli for the browsers that accept it, gzip for the others. 
+# Callback responses are JSON and compress several times over.
+server.config.update(COMPRESS_ALGORITHM = ['br', 'gzip'],
+                     COMPRESS_LEVEL = 6,
+                     COMPRESS_BR_LEVEL = 4)
+Compress(server)
+
+# One results store and one figure cache per worker process; 
+# both are refreshed as soon as the pipeline publishes new results.
+# The default figures are prepared once on disk for all workers, 
+# by the pipeline after each update, or by the first worker to serve 
+# a request. Importing this module starts nothing, so `static_export.py`
+# and the benchmarks can use the layout and the callbacks directly.
+results_store = ResultsStore(default_results_dir)
+figure_cache = FigureCache(disk_cache = FigureDiskCache(figures_dir(default_results_dir)),
+                           fingerprint_key = version_key)
+figure_precompute_thread = None
+figure_precompute_started = False
+figure_precompute_lock = threading.Lock()
+
+@server.before_request
+def start_figure_precompute():
+    """
+    Starts preparing the default figures on the first request of this worker
+    """
+    global figure_precompute_thread, figure_precompute_started
+    if figure_precompute_started:
+        return
+    with figure_precompute_lock:
+        if not figure_precompute_started:
+            figure_precompute_started = True
+            figure_precompute_thread = precompute_in_background(default_results_dir)
+
+@server.route('/results-stats')
+def results_stats():
+    """
+    Returns the results store counters as JSON
+    """
+    return {**results_store.stats(),
+            'figure_disk_hits': figure_cache.disk_hits,
+            'figure_renders': figure_cache.renders}
+
+@server.route('/api/weekly')
+def weekly_api():
+    """
+    Returns the weekly estimates of one gas as JSON records,
+    e.g. /api/weekly?ghg=CO2&start=2021-01-01&resolution=month
+    """
+    args = flask.request.args
+    resolution = args.get('resolution', 'auto')
+    if resolution != 'auto' and resolution not in resolutions:
+        flask.abort(400, f'resolution must be auto or one of {resolutions}')
+    ghg = args.get('ghg', 'GHG')
+    if f'{ghg}_weekly' not in results_store.get('df_weekly').columns:
+        flask.abort(400, f'unknown gas {ghg}')
+
+    df_query = query_weekly(results_store.get('df_weekly'), ghg,
+                            start = args.get('start'),
+                            end = args.get('end'),
+                            resolution = resolution,
+                            max_points = args.get('max_points', default_max_points, type = int))
+    return flask.jsonify(df_query.to_dict(orient = 'records'))
+
 app.layout = html.Div(children=[
     html.Div([
         page_header(),
@@ -308,37 +333,11 @@ def static_figure_responsive(ghg):
     
     ghg = str(ghg)
     
-    df_static = pd.read_parquet("results/df_static.parquet")  
-    fig_scatter = px.scatter(df_static, 
-                             x = "GDP", 
-                             y = ghg, 
-                             color = "Country",
-                             hover_data = ["Year"], 
-                             log_x = True, 
-                             log_y = True,
-                             #title = "GH Gas Emission vs GDP",
-                             labels={'GDP':'GDP, Billion USD', 
-                                     f'{ghg}':f'{ghg}, Tonnes of CO2 Equivalent'}, 
-                             height = 700
-                            )
-                            
-    fig_scatter.update_layout(legend=dict(
-                              orientation="h",
-                              yanchor="bottom",
-                              y=1.02,
-                              xanchor="right",
-                              x=1))
-                              
-    fig_scatter.update_layout(font=dict(size = 20))
-                              
-    fig_scatter.update_layout(template='plotly_dark',
-                              plot_bgcolor='#2d3339',
-                              paper_bgcolor='#5b6571')
+    version, frames = results_store.snapshot()
+    figure = figure_cache.get('static', ghg, version, 
+                              lambda: build_static_figure(frames['df_static'], ghg))
     
-    fig_scatter.update_xaxes(gridcolor='#717e8e')
-    fig_scatter.update_yaxes(gridcolor='#717e8e')
-    
-    return html.Div(children=[dcc.Graph(figure = fig_scatter, 
+    return html.Div(children=[dcc.Graph(figure = figure, 
                                         className = 'offset-by-one nine columns', 
                                         style={'paddingLeft': '5%'})], 
                     className="row")
@@ -346,44 +345,31 @@ def static_figure_responsive(ghg):
 @app.callback(
     Output(component_id='weekly_fig', component_property='children'),
     Input(component_id='weekly_ghg', component_property='value'),
+    Input(component_id='weekly_range', component_property='start_date'),
+    Input(component_id='weekly_range', component_property='end_date'),
+    Input(component_id='weekly_resolution', component_property='value'),
 )
-def weekly_figure_responsive(ghg):
+def weekly_figure_responsive(ghg, start_date = None, end_date = None, resolution = 'auto'):
     """
-    Returns the static ghg vs gdp scatter plot
+    Returns the weekly ghg estimation bar plot
+    for the selected weeks, aggregated to at most `default_max_points` bars per country
     """
     
     ghg = str(ghg)
+    # The default view is keyed by the gas alone, like the prepared figures
+    query = (ghg, start_date, end_date, resolution)
+    if query[1:] == (None, None, 'auto'):
+        query = ghg
     
-    df_weekly = pd.read_parquet("results/df_weekly.parquet")  
-    fig_bar = px.bar(df_weekly, 
-               x = "Week", 
-               y = f"{ghg}_weekly", 
-               color = "Country",
-               #title = "Weekly GH Gas Emission Prediction", 
-               labels={f'{ghg}_weekly':f'{ghg}, Tonnes of CO2 Equivalent'},
-               height = 700
-              )
-
-    fig_bar.update_layout(xaxis_type='category')
-    
-    fig_bar.update_layout(legend=dict(
-                            orientation="h",
-                            yanchor="bottom",
-                            y=1.02,
-                            xanchor="right",
-                            x=1)) 
-    
-    fig_bar.update_layout(font=dict(size = 20))
-    
-    fig_bar.update_layout(template='plotly_dark',
-                          plot_bgcolor='#2d3339',
-                          paper_bgcolor='#5b6571')
-    
-    fig_bar.update_xaxes(showgrid = False)
-    fig_bar.update_yaxes(gridcolor='#717e8e', 
-                         layer = 'above traces')
+    version, frames = results_store.snapshot()
+    figure = figure_cache.get('weekly', query, version, 
+                              lambda: build_weekly_figure(query_weekly(frames['df_weekly'], ghg,
+                                                                       start = start_date,
+                                                                       end = end_date,
+                                                                       resolution = resolution),
+                                                          ghg))
     
-    return html.Div(children=[dcc.Graph(figure = fig_bar, 
+    return html.Div(children=[dcc.Graph(figure = figure, 
                                         className = 'offset-by-one nine columns', 
                                         style={'paddingLeft': '5%'})], 
                     className="row")
@@ -0,0 +1,272 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import brotli
+import numpy as np
+import plotly
+import plotly.express as px
+
+#####################################################################
+#
+# compact figure data
+#
+#####################################################################
+
+# Significant digits kept for plotted values; the hover labels show
+# fewer than that and the bars and markers cannot show the difference.
+plot_digits = 5
+
+# Rounding only shrinks the payload when the figure JSON writes arrays
+# as lists of decimal numbers, as plotly < 6 does (5.4 is pinned).
+# From plotly 6 on, numeric arrays are written as base64 typed arrays
+# of 8 bytes per value whatever the digits, so the values are left as
+# they are.
+rounds_plot_values = int(plotly.__version__.split('.')[0]) < 6
+
+def round_significant(values, digits = plot_digits):
+    """
+    Returns `values` rounded to `digits` significant digits.
+    The rounded numbers have short decimal representations,
+    which is what shrinks the figure JSON.
+    """
+    values = np.asarray(values, dtype = np.float64)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        exponent = digits - 1 - np.floor(np.log10(np.abs(values)))
+    exponent = np.where(np.isfinite(exponent), exponent, 0).astype(int)
+
+    # Dividing or multiplying by an exact power of ten keeps the
+    # result the closest float to the rounded decimal number.
+    scale = 10.0**np.abs(exponent)
+    return np.where(exponent >= 0,
+                    np.round(values*scale)/scale,
+                    np.round(values/scale)*scale)
+
+def compact_frame(df, value_columns):
+    """
+    Returns the columns of `df` to plot with the values rounded
+    to `plot_digits` significant digits, where that shrinks the JSON
+    """
+    df = df.copy()
+    if not rounds_plot_values:
+        return df
+    for each_column in value_columns:
+        df[each_column] = round_significant(df[each_column].to_numpy())
+    return df
+
+def payload_sizes(fig_json):
+    """
+    Returns the size in bytes of a serialized figure, raw and compressed
+    as Flask-Compress would send it
+    """
+    data = fig_json.encode()
+    return {'json': len(data),
+            'gzip': len(gzip.compress(data, compresslevel = 6)),
+            'br': len(brotli.compress(data, quality = 4))}
+
+#####################################################################
+#
+# figure builders
+#
+#####################################################################
+
+def build_static_figure(df_static, ghg, compact = True):
+    """
+    Returns the static ghg vs gdp scatter plot as a plotly figure
+    """
+
+    if compact:
+        df_static = compact_frame(df_static[['Country', 'Year', 'GDP', ghg]], ['GDP', ghg])
+
+    fig_scatter = px.scatter(df_static,
+                             x = "GDP",
+                             y = ghg,
+                             color = "Country",
+                             hover_data = ["Year"],
+                             log_x = True,
+                             log_y = True,
+                             #title = "GH Gas Emission vs GDP",
+                             labels={'GDP':'GDP, Billion USD',
+                                     f'{ghg}':f'{ghg}, Tonnes of CO2 Equivalent'},
+                             height = 700
+                            )
+
+    fig_scatter.update_layout(legend=dict(
+                              orientation="h",
+                              yanchor="bottom",
+                              y=1.02,
+                              xanchor="right",
+                              x=1))
+
+    fig_scatter.update_layout(font=dict(size = 20))
+
+    fig_scatter.update_layout(template='plotly_dark',
+                              plot_bgcolor='#2d3339',
+                              paper_bgcolor='#5b6571')
+
+    fig_scatter.update_xaxes(gridcolor='#717e8e')
+    fig_scatter.update_yaxes(gridcolor='#717e8e')
+
+    return fig_scatter
+
+def build_weekly_figure(df_weekly, ghg, compact = True):
+    """
+    Returns the weekly ghg estimation bar plot as a plotly figure
+    """
+
+    if compact:
+        df_weekly = compact_frame(df_weekly[['Country', 'Week', f'{ghg}_weekly']],
+                                  [f'{ghg}_weekly'])
+
+    fig_bar = px.bar(df_weekly,
+               x = "Week",
+               y = f"{ghg}_weekly",
+               color = "Country",
+               #title = "Weekly GH Gas Emission Prediction",
+               labels={f'{ghg}_weekly':f'{ghg}, Tonnes of CO2 Equivalent'},
+               height = 700
+              )
+
+    fig_bar.update_layout(xaxis_type='category')
+
+    fig_bar.update_layout(legend=dict(
+                            orientation="h",
+                            yanchor="bottom",
+                            y=1.02,
+                            xanchor="right",
+                            x=1))
+
+    fig_bar.update_layout(font=dict(size = 20))
+
+    fig_bar.update_layout(template='plotly_dark',
+                          plot_bgcolor='#2d3339',
+                          paper_bgcolor='#5b6571')
+
+    fig_bar.update_xaxes(showgrid = False)
+    fig_bar.update_yaxes(gridcolor='#717e8e',
+                         layer = 'above traces')
+
+    return fig_bar
+
+#####################################################################
+#
+# figure cache
+#
+#####################################################################
+
+class FigureDiskCache:
+    """
+    Prepared figure JSON shared by all worker processes, written by
+    `figure_precompute.py` into one directory per results version:
+    `<cache_dir>/<version key>/<kind>-<gas>.json`
+
+    A version directory is written under a temporary name and renamed
+    into place when complete, so a reader sees all of its figures or none.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def filename(kind, ghg):
+        return f'{kind}-{ghg}.json'
+
+    def version_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def has(self, key):
+        return os.path.isdir(self.version_dir(key))
+
+    def load(self, key, kind, ghg):
+        """
+        Returns the prepared JSON of (kind, ghg) for the version `key`, or None
+        """
+        if not isinstance(ghg, str):
+            return None
+        try:
+            with open(os.path.join(self.version_dir(key), self.filename(kind, ghg))) as fig_file:
+                return fig_file.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, key, figures):
+        """
+        Writes `figures`, a dict of (kind, ghg) -> JSON, as the version `key`
+        and removes the other versions
+        """
+        os.makedirs(self.cache_dir, exist_ok = True)
+        tmp_dir = tempfile.mkdtemp(prefix = f'.{key}-', dir = self.cache_dir)
+        for (kind, ghg), fig_json in figures.items():
+            with open(os.path.join(tmp_dir, self.filename(kind, ghg)), 'w') as fig_file:
+                fig_file.write(fig_json)
+        try:
+            os.rename(tmp_dir, self.version_dir(key))
+        except OSError:
+            # Another process prepared the same version first
+            shutil.rmtree(tmp_dir, ignore_errors = True)
+
+        for each in os.listdir(self.cache_dir):
+            if each != key and not each.startswith('.'):
+                shutil.rmtree(os.path.join(self.cache_dir, each), ignore_errors = True)
+
+class FigureCache:
+    """
+    Figure dicts keyed by (figure kind, gas, source fingerprint)
+
+    Only the entry for the latest fingerprint of each (kind, gas) pair
+    is kept, so an entry is dropped as soon as its source file changes.
+    `ghg` may also be a tuple of query parameters, such as a date range;
+    at most `max_entries` figures are kept, the oldest being dropped first.
+
+    With a `disk_cache`, a miss first looks for the figure prepared for
+    the version key `fingerprint_key(fingerprint)`, and only renders it
+    when it has not been prepared.
+    """
+
+    def __init__(self, max_entries = 256, disk_cache = None, fingerprint_key = None):
+        self.max_entries = max_entries
+        self.disk_cache = disk_cache
+        self.fingerprint_key = fingerprint_key or str
+        self._lock = threading.Lock()
+        self._entries = {}
+
+        self.disk_hits = 0
+        self.renders = 0
+
+    def get(self, kind, ghg, fingerprint, render):
+        """
+        Returns the figure dict for (kind, ghg, fingerprint),
+        calling `render()` to build the plotly figure on a miss
+        """
+        key = (kind, ghg, fingerprint)
+        figure = self._entries.get(key)
+        if figure is None:
+            figure = self._render(key, render)
+        return figure
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _render(self, key, render):
+        kind, ghg, fingerprint = key
+        fig_json = None
+        if self.disk_cache is not None:
+            fig_json = self.disk_cache.load(self.fingerprint_key(fingerprint), kind, ghg)
+        if fig_json is not None:
+            self.disk_hits += 1
+        else:
+            fig_json = render().to_json()
+            self.renders += 1
+        figure = json.loads(fig_json)
+        with self._lock:
+            for stale in [each for each in self._entries
+                          if each[:2] == (kind, ghg)]:
+                del self._entries[stale]
+            self._entries[key] = figure
+            while len(self._entries) > self.max_entries:
+                del self._entries[next(iter(self._entries))]
+        return figure
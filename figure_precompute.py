@@ -0,0 +1,99 @@
+import argparse
+import os
+import threading
+import time
+
+from figure_cache import FigureDiskCache, build_static_figure, build_weekly_figure
+from results_store import ResultsStore, default_results_dir, gh_gases, version_key
+from weekly_query import query_weekly
+
+#####################################################################
+#
+# figure precompute
+#
+#####################################################################
+
+# The figures shown before any user input: both charts for every gas.
+figure_kinds = ['static', 'weekly']
+
+# A lock older than this is left over from a process that died.
+stale_lock_seconds = 600
+
+def figures_dir(results_dir):
+    return os.path.join(results_dir, 'figures')
+
+def render_figure(frames, kind, ghg):
+    """
+    Returns the default figure of `kind` for `ghg`, as the callbacks render it
+    """
+    if kind == 'static':
+        return build_static_figure(frames['df_static'], ghg)
+    return build_weekly_figure(query_weekly(frames['df_weekly'], ghg), ghg)
+
+def precompute_figures(results_dir = default_results_dir, cache_dir = None):
+    """
+    Renders every (kind, gas) figure of the current results into the
+    shared disk cache, unless it is already there.
+    Returns the version key and whether the figures were rendered.
+    """
+    version, frames = ResultsStore(results_dir, check_interval = 0).snapshot()
+    key = version_key(version)
+
+    disk_cache = FigureDiskCache(cache_dir or figures_dir(results_dir))
+    if disk_cache.has(key):
+        return key, False
+
+    figures = {(kind, ghg): render_figure(frames, kind, ghg).to_json()
+               for kind in figure_kinds
+               for ghg in gh_gases}
+    disk_cache.write(key, figures)
+    return key, True
+
+def precompute_in_background(results_dir = default_results_dir, cache_dir = None):
+    """
+    Starts `precompute_figures` in a daemon thread, unless another process
+    holds the precompute lock. Returns the thread, or None.
+    """
+    results_dir = os.path.abspath(results_dir)
+    cache_dir = os.path.abspath(cache_dir or figures_dir(results_dir))
+    lock_path = os.path.join(cache_dir, '.lock')
+    os.makedirs(cache_dir, exist_ok = True)
+
+    try:
+        if time.time() - os.path.getmtime(lock_path) > stale_lock_seconds:
+            os.remove(lock_path)
+    except FileNotFoundError:
+        pass
+
+    try:
+        os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return None
+
+    def run():
+        try:
+            precompute_figures(results_dir, cache_dir)
+        finally:
+            os.remove(lock_path)
+
+    thread = threading.Thread(target = run, name = 'figure-precompute', daemon = True)
+    thread.start()
+    return thread
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Prepare the dashboard figures of the current results')
+    parser.add_argument('--results-dir', default = default_results_dir)
+    parser.add_argument('--export', default = None, metavar = 'DIR',
+                        help = 'then write the static site of the results to DIR')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    key, rendered = precompute_figures(args.results_dir)
+    print(f"{'rendered' if rendered else 'already prepared'} {key} "
+          f"in {time.perf_counter() - start:.2f}s")
+
+    if args.export:
+        from static_export import export_site
+
+        export_site(args.export, args.results_dir)
+        print(f"exported {key} to {args.export} in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,195 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+
+import pandas as pd
+
+# The only place where the web tier puts the pipeline modules of `src/`
+# on the path. The other modules at the root import the pipeline names
+# they need, such as `gh_gases`, from this module.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+# The results next to this file, whatever the working directory
+default_results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+from Results_Arrow import arrow_path, read_arrow
+from Results_Dataset import WeeklyDataset
+from Weekly_Estimator import gh_gases
+
+#####################################################################
+#
+# results store
+#
+#####################################################################
+
+results_files = {
+    'df_static': 'df_static.parquet',
+    'df_weekly': 'df_weekly.parquet',
+    'df_estimate': 'df_estimate.parquet',
+}
+
+# Results published as week-partitioned datasets by the pipeline.
+#     They are read through their manifest, and the single parquet file
+#     above is only used until the dataset has been created.
+results_datasets = {
+    'df_weekly': 'df_weekly',
+}
+
+# Results also published by the pipeline as Arrow IPC files in `arrow/`.
+#     When present they are memory-mapped instead of reading the parquet,
+#     so the workers share one copy of their numeric columns.
+results_arrow = ['df_static', 'df_weekly', 'df_estimate']
+
+# Written by `src/Dynamic_Update.py` after each run that changes the results
+version_marker = 'VERSION'
+
+def version_key(version):
+    """
+    Returns a short, path-independent text key for a results version,
+    the same in every process that reads the same results
+    """
+    marker, fingerprints = version
+    fingerprints = [(os.path.basename(path), mtime, size) for path, mtime, size in fingerprints]
+    return hashlib.sha1(repr((marker, fingerprints)).encode()).hexdigest()[:16]
+
+class ResultsStore:
+    """
+    In-memory copy of the results frames, loaded once per process
+
+    The store checks the results version at most once every
+    `check_interval` seconds. The version is the content of the
+    `VERSION` marker written by the pipeline, if any, together with the
+    (mtime, size) of every results file, Arrow file and dataset manifest,
+    so results rewritten outside the pipeline are reloaded too.
+    When the version changes, all frames are read into a new snapshot
+    which then replaces the old one in a single assignment, so readers
+    always see a consistent set of frames.
+    """
+
+    def __init__(self, results_dir = default_results_dir, check_interval = 1.0):
+        self.results_dir = results_dir
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.disk_reads = 0
+
+    def get(self, name):
+        """
+        Returns the results frame `name`, e.g. 'df_weekly'
+        """
+        return self.snapshot()[1][name]
+
+    @property
+    def version(self):
+        """
+        Returns the version of the frames currently served
+        """
+        return self.snapshot()[0]
+
+    def snapshot(self):
+        """
+        Returns the current (version, frames) pair
+        """
+        snapshot = self._snapshot
+        now = time.monotonic()
+
+        if snapshot is not None and now - self._checked_at < self.check_interval:
+            self.hits += 1
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            version = self.read_version()
+            self._checked_at = time.monotonic()
+
+            if snapshot is not None and snapshot[0] == version:
+                self.hits += 1
+                return snapshot
+
+            frames = {name: self._read(name) for name in results_files}
+
+            if snapshot is None:
+                self.misses += 1
+            else:
+                self.reloads += 1
+            self._snapshot = (version, frames)
+
+            return self._snapshot
+
+    def read_version(self):
+        """
+        Returns the version marker content, None without a marker,
+        and the results file fingerprints
+        """
+        marker_path = os.path.join(self.results_dir, version_marker)
+        try:
+            with open(marker_path) as marker_file:
+                marker = marker_file.read().strip()
+        except FileNotFoundError:
+            marker = None
+
+        fingerprints = []
+        for name in results_files:
+            for path in (self._source_path(name), arrow_path(self.results_dir, name)):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                fingerprints.append((path, stat.st_mtime_ns, stat.st_size))
+        return (marker, tuple(fingerprints))
+
+    def stats(self):
+        """
+        Returns the hit/miss/reload counters as a dict
+        """
+        snapshot = self._snapshot
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'reloads': self.reloads,
+                'disk_reads': self.disk_reads,
+                'version': None if snapshot is None else repr(snapshot[0])}
+
+    def _dataset(self, name):
+        if name not in results_datasets:
+            return None
+        dataset = WeeklyDataset(os.path.join(self.results_dir, results_datasets[name]))
+        return dataset if dataset.exists() else None
+
+    def _arrow_path(self, name):
+        if name not in results_arrow:
+            return None
+        path = arrow_path(self.results_dir, name)
+        try:
+            arrow_mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        # An Arrow copy older than its source, e.g. after the parquet file
+        # was rewritten outside the pipeline, is stale
+        source_path = self._source_path(name)
+        if os.path.exists(source_path) and os.stat(source_path).st_mtime_ns > arrow_mtime:
+            return None
+        return path
+
+    def _source_path(self, name):
+        dataset = self._dataset(name)
+        if dataset is not None:
+            return dataset.manifest_path
+        return os.path.join(self.results_dir, results_files[name])
+
+    def _read(self, name):
+        self.disk_reads += 1
+        path = self._arrow_path(name)
+        if path is not None:
+            return read_arrow(path)
+        dataset = self._dataset(name)
+        if dataset is not None:
+            return dataset.read()
+        return pd.read_parquet(os.path.join(self.results_dir, results_files[name]))
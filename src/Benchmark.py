@@ -0,0 +1,383 @@
+## Benchmarks
+
+# A reproducible benchmark suite for the pipeline and the dashboard.
+#     Everything runs offline against the checked-in fixtures
+#     (`data/*.parquet`, `results/*.parquet`) and synthetic versions of
+#     them scaled up in regions and in weeks. A scale of "10x100" means
+#     10 times the regions and 100 times the weeks of the fixture.
+#
+# Every measurement is the best of `--repeat` runs, and the whole suite
+#     is written as JSON, so a run can be compared against a baseline.
+#
+# Usage, from the `src` directory:
+#     python Benchmark.py --output bench.json
+#     python Benchmark.py --only estimate append --scales 1x1 10x10 --baseline bench.json
+#     python Benchmark.py --list
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+results_dir = os.path.join(repo_dir, "results")
+data_dir = os.path.join(repo_dir, "data")
+
+tracker_fixture = os.path.join(data_dir, "2021-11-21.parquet")
+
+default_scales = ["1x1", "10x1", "1x10", "10x10", "10x100"]
+
+# A helper function to time `func` and return the best of `repeat` runs
+#     in seconds, together with the value of the last run.
+
+def best_time(func, repeat = 3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), value
+
+def parse_scale(scale):
+    region_factor, week_factor = scale.lower().split("x")
+    return int(region_factor), int(week_factor)
+
+### Synthetic data
+
+# Copies of every region get a " #k" suffix, and copies of the history
+#     are shifted back in time by the span of the fixture, so the newest
+#     weeks of the scaled data are those of the fixture.
+
+def scaled_regions(names, region_factor):
+    return [name if k == 0 else f"{name} #{k}"
+            for k in range(region_factor)
+            for name in names]
+
+def scaled_tracker_frame(df_tracker, region_factor, week_factor):
+    df_tracker = df_tracker[["region", "date", "Tracker (yo2y)"]]
+    span = df_tracker["date"].max() - df_tracker["date"].min() + pd.Timedelta(days = 7)
+
+    frames = []
+    for k in range(region_factor):
+        suffix = "" if k == 0 else f" #{k}"
+        for w in range(week_factor):
+            frames.append(df_tracker.assign(region = df_tracker["region"] + suffix,
+                                            date = df_tracker["date"] - w*span))
+    return pd.concat(frames, ignore_index = True)
+
+def scaled_estimate_frame(df_estimate, region_factor):
+    frames = [df_estimate.rename(index = lambda name: name if k == 0 else f"{name} #{k}")
+              for k in range(region_factor)]
+    return pd.concat(frames)
+
+def scaled_weekly_frame(df_weekly, region_factor, week_factor):
+    weeks = pd.to_datetime(df_weekly["Week"])
+    span = weeks.max() - weeks.min() + pd.Timedelta(days = 7)
+
+    frames = []
+    for k in range(region_factor):
+        suffix = "" if k == 0 else f" #{k}"
+        for w in range(week_factor):
+            frames.append(df_weekly.assign(Country = df_weekly["Country"] + suffix,
+                                           Week = (weeks - w*span).dt.strftime("%Y-%m-%d")))
+    return pd.concat(frames, ignore_index = True)
+
+def scaled_static_frame(df_static, region_factor, week_factor):
+    frames = []
+    for k in range(region_factor):
+        suffix = "" if k == 0 else f" #{k}"
+        for w in range(week_factor):
+            frames.append(df_static.assign(Country = df_static["Country"] + suffix,
+                                           Year = df_static["Year"] - 5*w))
+    return pd.concat(frames, ignore_index = True)
+
+# The weeks of the fixture are moved so that its latest week is the most
+#     recent Sunday the pipeline asks for, so the week filter keeps rows.
+
+def recent_tracker_fixture():
+    from Dynamic_Update import get_past_n_sundays
+
+    df_tracker = pd.read_parquet(tracker_fixture)
+    shift = pd.Timestamp(get_past_n_sundays(1)[0]) - df_tracker["date"].max()
+    return df_tracker.assign(date = df_tracker["date"] + shift)
+
+### Benchmarks
+
+# Each benchmark takes (region_factor, week_factor, repeat) and returns
+#     a list of records with at least "case", "rows" and "seconds".
+
+def bench_filter(region_factor, week_factor, repeat):
+    from Dynamic_Update import dynamic_data_filter
+
+    df_raw = scaled_tracker_frame(recent_tracker_fixture(), region_factor, week_factor)
+    seconds, df_weekly = best_time(lambda: dynamic_data_filter(df_raw), repeat)
+
+    return [{"case": "dynamic_data_filter", "rows": len(df_raw),
+             "rows_out": len(df_weekly), "seconds": seconds}]
+
+def bench_estimate(region_factor, week_factor, repeat, max_loop_rows = 3500):
+    from Weekly_Estimator import (gh_gases,
+                                  estimate_weekly_emission_batch,
+                                  estimate_weekly_emission_loop)
+
+    df_estimate = scaled_estimate_frame(
+        pd.read_parquet(os.path.join(results_dir, "df_estimate.parquet")), region_factor)
+    df_weekly = scaled_weekly_frame(
+        pd.read_parquet(os.path.join(results_dir, "df_weekly.parquet")),
+        region_factor, week_factor)[["Country", "Week", "GDP_Change"]]
+
+    batch_seconds, df_batch = best_time(
+        lambda: estimate_weekly_emission_batch(df_estimate, df_weekly, gh_gases), repeat)
+    records = [{"case": "estimate_batch", "rows": len(df_weekly),
+                "seconds": batch_seconds}]
+
+    if len(df_weekly) <= max_loop_rows:
+        loop_seconds, df_loop = best_time(
+            lambda: estimate_weekly_emission_loop(df_estimate, df_weekly, gh_gases), 1)
+        identical = all(np.array_equal(df_loop[col].to_numpy(), df_batch[col].to_numpy())
+                        for col in df_loop.columns
+                        if col.endswith(("_weekly", "_change")))
+        records.append({"case": "estimate_loop", "rows": len(df_weekly),
+                        "seconds": loop_seconds, "identical": identical})
+
+    return records
+
+# Appending one new week to a history of the scaled size, with the
+#     week-partitioned dataset and with the former read-concat-rewrite.
+
+def bench_append(region_factor, week_factor, repeat):
+    from Results_Dataset import WeeklyDataset
+
+    df_history = scaled_weekly_frame(
+        pd.read_parquet(os.path.join(results_dir, "df_weekly.parquet")),
+        region_factor, week_factor)
+    latest = pd.Timestamp(df_history["Week"].max())
+    df_new = df_history[df_history["Week"] == df_history["Week"].max()].assign(
+        Week = (latest + pd.Timedelta(days = 7)).strftime("%Y-%m-%d"))
+
+    work_dir = tempfile.mkdtemp(prefix = "ghg-bench-")
+    try:
+        dataset = WeeklyDataset(os.path.join(work_dir, "df_weekly"))
+        dataset.append(df_history)
+        dataset_seconds, _ = best_time(lambda: dataset.append(df_new), repeat)
+
+        legacy_path = os.path.join(work_dir, "df_weekly.parquet")
+        df_history.to_parquet(legacy_path)
+
+        def legacy_append():
+            df_previous = pd.read_parquet(legacy_path)
+            pd.concat([df_previous, df_new], ignore_index = True).to_parquet(legacy_path)
+
+        legacy_seconds, _ = best_time(legacy_append, repeat)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors = True)
+
+    return [{"case": "append_partition", "rows": len(df_history), "seconds": dataset_seconds},
+            {"case": "append_rewrite", "rows": len(df_history), "seconds": legacy_seconds}]
+
+def bench_static_fit(region_factor, week_factor, repeat):
+    from Static_Fit import fit_static_model
+
+    df_static = scaled_static_frame(
+        pd.read_parquet(os.path.join(results_dir, "df_static.parquet")),
+        region_factor, week_factor)
+    seconds, _ = best_time(lambda: fit_static_model(df_static), repeat)
+
+    return [{"case": "fit_static_model", "rows": len(df_static), "seconds": seconds}]
+
+# Both dashboard callbacks, called directly on a results directory with
+#     scaled results. "cold" clears the results store and the figure cache
+#     first, "warm" is a repeated click.
+
+def bench_callbacks(region_factor, week_factor, repeat):
+    sys.path.insert(0, repo_dir)
+    import app
+    from results_store import ResultsStore
+
+    # The figures are rendered here, not loaded from the prepared ones
+    saved_disk_cache = app.figure_cache.disk_cache
+    app.figure_cache.disk_cache = None
+
+    work_dir = tempfile.mkdtemp(prefix = "ghg-bench-")
+    try:
+        for name, scale in (("df_static", scaled_static_frame),
+                            ("df_weekly", scaled_weekly_frame)):
+            df_fixture = pd.read_parquet(os.path.join(results_dir, f"{name}.parquet"))
+            scale(df_fixture, region_factor, week_factor).to_parquet(
+                os.path.join(work_dir, f"{name}.parquet"))
+        shutil.copy(os.path.join(results_dir, "df_estimate.parquet"), work_dir)
+
+        saved_store = app.results_store
+        app.results_store = ResultsStore(work_dir)
+
+        records = []
+        for case, callback in (("static_callback", app.static_figure_responsive),
+                               ("weekly_callback", app.weekly_figure_responsive)):
+            def cold():
+                app.results_store = ResultsStore(work_dir)
+                app.figure_cache.clear()
+                return callback("CO2")
+
+            cold_seconds, _ = best_time(cold, repeat)
+            warm_seconds, _ = best_time(lambda: callback("CO2"), repeat)
+            rows = len(app.results_store.get("df_static" if case.startswith("static")
+                                             else "df_weekly"))
+            records += [{"case": f"{case}_cold", "rows": rows, "seconds": cold_seconds},
+                        {"case": f"{case}_warm", "rows": rows, "seconds": warm_seconds}]
+
+        app.results_store = saved_store
+        app.figure_cache.disk_cache = saved_disk_cache
+        app.figure_cache.clear()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors = True)
+
+    return records
+
+# Size of the serialized figures, with and without the compact encoding,
+#     raw and as the compressed bytes sent by the server.
+
+def bench_payload(region_factor, week_factor, repeat):
+    sys.path.insert(0, repo_dir)
+    from figure_cache import build_static_figure, build_weekly_figure, payload_sizes
+
+    records = []
+    for name, build, scale in (("static", build_static_figure, scaled_static_frame),
+                               ("weekly", build_weekly_figure, scaled_weekly_frame)):
+        df_fixture = pd.read_parquet(os.path.join(results_dir, f"df_{name}.parquet"))
+        df_scaled = scale(df_fixture, region_factor, week_factor)
+        for compact in (False, True):
+            seconds, fig_json = best_time(
+                lambda: build(df_scaled, "CO2", compact = compact).to_json(), repeat)
+            sizes = payload_sizes(fig_json)
+            records.append({"case": f"{name}_{'compact' if compact else 'raw'}",
+                            "rows": len(df_scaled), "seconds": seconds,
+                            **{f"{each}_bytes": size for each, size in sizes.items()}})
+
+    return records
+
+# The sparse coefficient store against the dense `df_estimate`: the same
+#     weekly estimates through `estimate_weekly_sector`, and the long
+#     per-cell estimates of `estimate_weekly_cells`.
+
+def bench_sparse(region_factor, week_factor, repeat):
+    from Sparse_Coefficients import (CoefficientStore, estimate_weekly_cells,
+                                     estimate_weekly_sector)
+    from Weekly_Estimator import gh_gases, estimate_weekly_emission_batch
+
+    df_estimate = scaled_estimate_frame(
+        pd.read_parquet(os.path.join(results_dir, "df_estimate.parquet")), region_factor)
+    df_weekly = scaled_weekly_frame(
+        pd.read_parquet(os.path.join(results_dir, "df_weekly.parquet")),
+        region_factor, week_factor)[["Country", "Week", "GDP_Change"]]
+
+    build_seconds, store = best_time(lambda: CoefficientStore.from_estimate(df_estimate), repeat)
+    _, df_batch = best_time(
+        lambda: estimate_weekly_emission_batch(df_estimate, df_weekly, gh_gases), 1)
+    sector_seconds, df_sector = best_time(lambda: estimate_weekly_sector(store, df_weekly), repeat)
+    identical = all(np.array_equal(df_batch[col].to_numpy(), df_sector[col].to_numpy())
+                    for col in df_batch.columns
+                    if col.endswith(("_weekly", "_change")))
+    cells_seconds, df_cells = best_time(lambda: estimate_weekly_cells(store, df_weekly), repeat)
+
+    return [{"case": "sparse_build", "rows": store.n_cells, "seconds": build_seconds,
+             "store_bytes": store.nbytes,
+             "dense_bytes": int(df_estimate.memory_usage(deep = True).sum())},
+            {"case": "sparse_estimate_sector", "rows": len(df_weekly),
+             "seconds": sector_seconds, "identical": identical},
+            {"case": "sparse_estimate_cells", "rows": len(df_weekly),
+             "rows_out": len(df_cells), "seconds": cells_seconds}]
+
+benchmarks = {
+    "filter": bench_filter,
+    "estimate": bench_estimate,
+    "append": bench_append,
+    "static_fit": bench_static_fit,
+    "callbacks": bench_callbacks,
+    "payload": bench_payload,
+    "sparse": bench_sparse,
+}
+
+### Suite
+
+def run_suite(names = None, scales = default_scales, repeat = 3, verbose = True):
+    names = list(benchmarks) if names is None else names
+    records = []
+
+    for name in names:
+        for scale in scales:
+            region_factor, week_factor = parse_scale(scale)
+            for record in benchmarks[name](region_factor, week_factor, repeat):
+                record = {"benchmark": name, "scale": scale, **record}
+                records.append(record)
+                if verbose:
+                    sizes = "".join(f" {record[key]:>9} {key[:-6]}"
+                                    for key in ("json_bytes", "gzip_bytes", "br_bytes")
+                                    if key in record)
+                    print(f"{name:<10} {scale:>7} {record['case']:<22} "
+                          f"{record['rows']:>9} rows {record['seconds']:>10.4f} s{sizes}")
+
+    return {"started": datetime.datetime.now().isoformat(timespec = "seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "machine": platform.platform(),
+            "repeat": repeat,
+            "records": records}
+
+# Compares every record with the baseline record of the same
+#     benchmark, scale and case. Returns the number of regressions,
+#     i.e. records slower than `threshold` times the baseline.
+
+def compare_to_baseline(suite, baseline, threshold = 1.25):
+    baseline_seconds = {(each["benchmark"], each["scale"], each["case"]): each["seconds"]
+                        for each in baseline["records"]}
+
+    n_regressions = 0
+    print(f"{'benchmark':<10} {'scale':>7} {'case':<22} {'baseline':>10} {'now':>10} {'ratio':>7}")
+    for record in suite["records"]:
+        key = (record["benchmark"], record["scale"], record["case"])
+        if key not in baseline_seconds:
+            continue
+        ratio = record["seconds"]/baseline_seconds[key] if baseline_seconds[key] else float("inf")
+        flagged = ratio > threshold
+        n_regressions += flagged
+        print(f"{key[0]:<10} {key[1]:>7} {key[2]:<22} {baseline_seconds[key]:>10.4f} "
+              f"{record['seconds']:>10.4f} {ratio:>7.2f}{'  REGRESSION' if flagged else ''}")
+
+    return n_regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Run the benchmark suite")
+    parser.add_argument("--only", nargs = "+", choices = list(benchmarks), default = None)
+    parser.add_argument("--scales", nargs = "+", default = default_scales,
+                        help = "REGIONSxWEEKS scale factors, e.g. 1x1 10x100")
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--output", default = None, help = "write the results as JSON")
+    parser.add_argument("--baseline", default = None, help = "compare with a previous JSON")
+    parser.add_argument("--threshold", type = float, default = 1.25)
+    parser.add_argument("--list", action = "store_true", help = "list the benchmarks")
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(benchmarks))
+        sys.exit(0)
+
+    suite = run_suite(args.only, args.scales, args.repeat)
+
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(suite, output_file, indent = 2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        print()
+        sys.exit(1 if compare_to_baseline(suite, baseline, args.threshold) else 0)
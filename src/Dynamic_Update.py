@@ -1,20 +1,30 @@
 ## Weekly Greenhouse Gas Estimation
 
-import numpy as np
-import pandas as pd
+# The daily update pipeline, as a set of importable stage functions.
+#     Nothing runs at import time, and pandas and the other heavy
+#     dependencies are only imported by the stages that need them,
+#     so a long-lived scheduler can import this module once and call
+#     `run_update` every day.
+#
+# Usage:
+#     python Dynamic_Update.py [--data-dir DIR] [--results-dir DIR]
+
+import argparse
+import datetime
+import hashlib
+import json
 import os
-import datetime 
 
 # ### Dynamic Data: Weekly GDP tracker
 
-# Weekly Updated GDP change estimate by OECD: 
+# Weekly Updated GDP change estimate by OECD:
 #     https://www.oecd.org/economy/weekly-tracker-of-gdp-growth/
 
-# The variable **Change** is defined as 
-#     the percent change of last week's GDP 
-#     compared to the same week of the pre-pandemic year. 
+# The variable **Change** is defined as
+#     the percent change of last week's GDP
+#     compared to the same week of the pre-pandemic year.
 
-# It is conceptually equivalent to the following, 
+# It is conceptually equivalent to the following,
 #     although the actual calculation is far more complicated:
 
 # \begin{align*}
@@ -23,128 +33,527 @@ import datetime
 # \textrm{Change} &= \frac{y_{i,} - y_{i,pre}}{y_{i,pre}} \quad (\textrm{in percentage})
 # \end{align*}
 
-# Under the hood, the OECD tracker is trained with the real-GDP changes, 
+# Under the hood, the OECD tracker is trained with the real-GDP changes,
 # and thus it returns the real change, not the nominal change.
 
 dynamic_data_link = \
-    ("https://github.com/NicolasWoloszko" + 
+    ("https://github.com/NicolasWoloszko" +
      "/OECD-Weekly-Tracker/raw/main/Data/weekly_tracker.xlsx")
-df_weekly_raw = pd.read_excel(dynamic_data_link)
 
-# A helper function to return the `n_sundays` number of date strings 
-#     of the beginning of the most recent weeks 
-#     for which the data is available. 
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+default_data_dir = os.path.join(repo_dir, "data")
+default_results_dir = os.path.join(repo_dir, "results")
+default_export_dir = os.path.join(repo_dir, "static_site")
+
+def tracker_cache_path(data_dir):
+    return os.path.join(data_dir, "tracker_cache", "weekly_tracker.parquet")
+
+def run_log_path(data_dir):
+    return os.path.join(data_dir, "logs", "update_runs.jsonl")
+
+# A helper function to return the `n_sundays` number of date strings
+#     of the beginning of the most recent weeks
+#     for which the data is available.
 
 def get_past_n_sundays(n_sundays = 5):
-    date_today = datetime.datetime.now() 
+    date_today = datetime.datetime.now()
 
     days_delta_list =  [1 + 7*(i+1) for i in range(n_sundays)]
 
-    date_sunday_list = [(date_today - 
+    date_sunday_list = [(date_today -
                          datetime.timedelta(
                              days = (each_delta + date_today.weekday())
                          )
                         )
-                        for each_delta 
+                        for each_delta
                         in days_delta_list]
 
-    sunday_string_list = [each_sunday.strftime("%Y-%m-%d") 
-                          for each_sunday 
+    sunday_string_list = [each_sunday.strftime("%Y-%m-%d")
+                          for each_sunday
                           in date_sunday_list]
 
     return sunday_string_list
 
-# We have to filter only the relevant portion 
-# of the original raw excel file, which is huge.
-
-def dynamic_data_filter(n_sundays = 5):
-    countries_list = ['Canada', 'France', 'Germany','Italy',
-                      'Japan','United Kingdom','United States']
-    weeks_list = get_past_n_sundays(n_sundays = n_sundays)
-    
-    df_weekly = df_weekly_raw[['region', 'date', 'Tracker (yo2y)']].copy()
-    df_weekly = df_weekly.rename(columns = {"region": "Country", 
-                                            "date": "Week", 
-                                            "Tracker (yo2y)": "GDP_Change"})
-    
-    df_weekly = df_weekly[df_weekly["Week"] > '2021-10-01']
-    df_weekly["Week"] = df_weekly["Week"].astype(str)
-    
-    df_weekly = df_weekly[df_weekly["Country"].apply(lambda x: x in countries_list)]
-    df_weekly = df_weekly[df_weekly["Week"].apply(lambda x: x in weeks_list)]
-
-    df_weekly = df_weekly.reset_index(drop = True)
-
-    return df_weekly
+### Stages
 
-df_weekly = dynamic_data_filter()
-print(df_weekly.tail(8))
+# The workbook is fetched into the local mirror in `data/mirror/`
+#     with a conditional request, so an unchanged workbook is not
+#     downloaded again, and with `offline = True` the mirror copy is used.
+#     It is then converted once into a parquet cache, and only parsed
+#     again when its content changes. Returns True when it changed.
 
-most_recent_week = np.flip(np.sort(df_weekly["Week"].unique()))[0]
-filename_to_check = f"{most_recent_week}.parquet"
-print(filename_to_check)
+def fetch_tracker(source = dynamic_data_link, data_dir = default_data_dir,
+                  offline = False):
+    from Source_Fetch import fetch_to_mirror, mirror_dir_for
 
+    return fetch_to_mirror("tracker", source, mirror_dir_for(data_dir), offline)
 
-with os.scandir("../data") as entries:
-    entry_list = list(entries)
+def download_tracker(source = dynamic_data_link, data_dir = default_data_dir,
+                     offline = False):
+    mirror_path, _ = fetch_tracker(source, data_dir, offline)
+    with open(mirror_path, "rb") as mirror_file:
+        return mirror_file.read()
 
-filename_list = [each_file.name for each_file in entry_list]
-print(filename_list)
+def convert_tracker(workbook_bytes, data_dir):
+    from Tracker_Ingest import refresh_tracker_cache
 
-if filename_to_check not in filename_list:
-    df_weekly_raw.to_parquet(f"../data/{filename_to_check}")
+    return refresh_tracker_cache(workbook_bytes, tracker_cache_path(data_dir))
 
-### Dynamic Prediction 
+# We then read only the columns we use
+#     and the weeks newer than the last week already in the results.
 
-df_estimate = pd.read_parquet("../results/df_estimate.parquet")
-print('df_estimate')
-print(df_estimate)
+def read_new_tracker_rows(data_dir, since):
+    from Tracker_Ingest import read_tracker
 
-def estimate_weekly_emission(country_name, gas_name, change):
-    amount = df_estimate.loc[country_name, gas_name]
-    amount_week = amount*7/365
-    
-    coef = df_estimate.loc[country_name, f"{gas_name}_coef"]
-    change_gh = change*coef
+    return read_tracker(tracker_cache_path(data_dir), since = since)
 
-    amount_week = amount_week*(1 + change_gh/100)
-    
-    return amount_week, change_gh
+# We have to filter only the relevant portion
+# of the original raw excel file, which is huge.
+#     The filters are vectorized `isin` tests, which also work directly
+#     on the categorical region column of the streaming reader.
 
-gh_gases = ['GHG', 'CO2', 'CH4', 'N2O', 'HFC', 'PFC', 'SF6']
+countries_list = ['Canada', 'France', 'Germany','Italy',
+                  'Japan','United Kingdom','United States']
 
-df_weekly = dynamic_data_filter()
+def select_tracker_rows(df_weekly_raw, countries_list, weeks_list = None,
+                        start_week = '2021-10-01'):
+    import pandas as pd
 
-for each_gas in gh_gases:
-    df_weekly[f"{each_gas}_weekly"] = 0
-    df_weekly[f"{each_gas}_change"] = 0
+    df_weekly = df_weekly_raw[['region', 'date', 'Tracker (yo2y)']]
 
+    keep = df_weekly["region"].isin(countries_list).to_numpy()
+    if start_week is not None:
+        keep = keep & (df_weekly["date"] > pd.Timestamp(start_week)).to_numpy()
 
-for each_gas in gh_gases:
-    for index, row in df_weekly.iterrows():
-        amount_week, change_gh = estimate_weekly_emission(row["Country"],
-                                                          each_gas,
-                                                          row["GDP_Change"])
-        df_weekly.loc[index, f"{each_gas}_weekly"] = amount_week
-        df_weekly.loc[index, f"{each_gas}_change"] = change_gh
+    df_weekly = df_weekly[keep].rename(columns = {"region": "Country",
+                                                  "date": "Week",
+                                                  "Tracker (yo2y)": "GDP_Change"})
+    df_weekly["Country"] = df_weekly["Country"].astype(str)
+    df_weekly["Week"] = df_weekly["Week"].dt.strftime("%Y-%m-%d")
 
-print('df_weekly.tail(8)')
-print(df_weekly.tail(8))
+    if weeks_list is not None:
+        df_weekly = df_weekly[df_weekly["Week"].isin(weeks_list).to_numpy()]
 
-df_weekly_previous = pd.read_parquet("../results/df_weekly.parquet")
-print('df_weekly_previous.tail(8)')
-print(df_weekly_previous.tail(8))
+    df_weekly = df_weekly.reset_index(drop = True)
 
-most_recent_week_in_df = np.flip(np.sort(df_weekly_previous["Week"]))[0]
-print('most_recent_week_in_df')
-print(most_recent_week_in_df)
+    return df_weekly
 
-df_update = df_weekly[df_weekly["Week"] > most_recent_week_in_df].copy()
-print('df_update')
-print(df_update)
+def dynamic_data_filter(df_weekly_raw, n_sundays = 5):
+    weeks_list = get_past_n_sundays(n_sundays = n_sundays)
 
-if not df_update.empty:
-    df_weekly_new = pd.concat([df_weekly_previous, df_update], ignore_index = True)
-    df_weekly_new.to_parquet("../results/df_weekly.parquet")
-    
-print('all done')
\ No newline at end of file
+    return select_tracker_rows(df_weekly_raw, countries_list, weeks_list)
+
+# The raw tracker of every week is kept in a deduplicated snapshot store,
+#     which only writes the rows that are new since the previous snapshots.
+#     Returns the stored snapshot entry, or None if there was nothing to store.
+
+def store_snapshot(df_weekly, data_dir):
+    if df_weekly.empty:
+        return None
+
+    from Snapshot_Store import SnapshotStore
+    from Tracker_Ingest import read_tracker
+
+    snapshot_store = SnapshotStore(os.path.join(data_dir, "snapshots"))
+    most_recent_week = df_weekly["Week"].max()
+    if snapshot_store.has(most_recent_week):
+        return None
+
+    return snapshot_store.put(most_recent_week,
+                              read_tracker(tracker_cache_path(data_dir),
+                                           columns = None))
+
+### Change detection
+
+# The inputs of a run are fingerprinted by the content hash of the
+#     workbook, a hash of every row of `df_estimate` and the target weeks.
+#     When all of them match the fingerprint saved by the previous run,
+#     the results cannot change, and the run stops right after the
+#     conditional download, which is a 304 on most days.
+
+def fingerprint_path(data_dir):
+    return os.path.join(data_dir, "tracker_cache", "update_fingerprint.json")
+
+def read_fingerprint(data_dir):
+    try:
+        with open(fingerprint_path(data_dir)) as fingerprint_file:
+            return json.load(fingerprint_file)
+    except FileNotFoundError:
+        return None
+
+def write_fingerprint(data_dir, fingerprint):
+    path = fingerprint_path(data_dir)
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(f"{path}.tmp", "w") as fingerprint_file:
+        json.dump(fingerprint, fingerprint_file, indent = 2, sort_keys = True)
+    os.replace(f"{path}.tmp", path)
+
+def estimate_row_hashes(results_dir):
+    import pandas as pd
+
+    df_estimate = pd.read_parquet(os.path.join(results_dir, "df_estimate.parquet"))
+    hashes = pd.util.hash_pandas_object(df_estimate, index = True).to_numpy()
+    row_hashes = {country: format(int(each_hash), "016x")
+                  for country, each_hash in zip(df_estimate.index, hashes)}
+
+    # The time-varying coefficients of a country change its estimates too
+    df_elasticity = read_elasticities(results_dir)
+    if df_elasticity is not None:
+        df_hashes = pd.DataFrame({
+            "Country": df_elasticity["Country"].to_numpy(),
+            "hash": pd.util.hash_pandas_object(df_elasticity, index = False).to_numpy(),
+        })
+        for country, df_country in df_hashes.groupby("Country"):
+            if country in row_hashes:
+                combined = pd.util.hash_array(df_country["hash"].to_numpy()).sum()
+                row_hashes[country] += format(int(combined) % 2**64, "016x")
+
+    return row_hashes
+
+def input_fingerprint(tracker_sha256, estimate_rows, weeks_list):
+    estimate_text = json.dumps(estimate_rows, sort_keys = True).encode()
+    return {"tracker": tracker_sha256,
+            "estimate": hashlib.sha256(estimate_text).hexdigest(),
+            "weeks": sorted(weeks_list),
+            "estimate_rows": estimate_rows}
+
+def inputs_unchanged(fingerprint, previous):
+    return (previous is not None and
+            all(previous.get(key) == fingerprint[key]
+                for key in ("tracker", "estimate", "weeks")))
+
+# The regions whose coefficients or baselines changed since the previous run.
+
+def changed_regions(fingerprint, previous):
+    if previous is None:
+        return []
+    previous_rows = previous.get("estimate_rows", {})
+    return sorted(country
+                  for country, each_hash in fingerprint["estimate_rows"].items()
+                  if country in previous_rows and previous_rows[country] != each_hash)
+
+# Rows of the target weeks that are already in the results,
+#     but whose GDP change has been revised in the tracker since.
+
+def revised_rows(df_weekly, weekly_cube):
+    df_stored = df_weekly[df_weekly["Week"].isin(weekly_cube.week_position).to_numpy()]
+    if df_stored.empty:
+        return df_stored
+
+    df_cube = weekly_cube.to_frame(df_stored["Week"].min(), df_stored["Week"].max())
+    df_merged = df_stored.merge(df_cube[["Country", "Week", "GDP_Change"]],
+                                on = ["Country", "Week"], how = "left",
+                                suffixes = ("", "_stored"))
+    new_change = df_merged["GDP_Change"]
+    old_change = df_merged["GDP_Change_stored"]
+    same = (new_change == old_change) | (new_change.isna() & old_change.isna())
+
+    return df_merged.loc[~same.to_numpy(), df_weekly.columns].reset_index(drop = True)
+
+# Every stored row of `regions`, to be estimated again with new coefficients.
+
+def stored_rows(weekly_cube, regions):
+    if not regions:
+        return None
+    df_cube = weekly_cube.to_frame()
+    df_cube = df_cube[df_cube["Country"].isin(regions).to_numpy()]
+    return df_cube[["Country", "Week", "GDP_Change"]].reset_index(drop = True)
+
+### Dynamic Prediction
+
+# The time-varying elasticities of `Elasticity_Model.py` are used
+#     when they have been built, and the static ones otherwise.
+
+def read_elasticities(results_dir):
+    import pandas as pd
+    from Elasticity_Model import elasticity_path
+
+    if not os.path.exists(elasticity_path(results_dir)):
+        return None
+    return pd.read_parquet(elasticity_path(results_dir))
+
+def estimate_weekly(df_weekly, results_dir):
+    import pandas as pd
+    from Weekly_Estimator import (gh_gases,
+                                  estimate_weekly_emission_batch,
+                                  estimate_weekly_emission_dated)
+
+    df_estimate = pd.read_parquet(os.path.join(results_dir, "df_estimate.parquet"))
+    df_elasticity = read_elasticities(results_dir)
+
+    if df_elasticity is not None and not df_weekly.empty:
+        return estimate_weekly_emission_dated(df_estimate, df_elasticity, df_weekly, gh_gases)
+    return estimate_weekly_emission_batch(df_estimate, df_weekly, gh_gases)
+
+# Appends the weeks that are not in the results yet,
+#     as new partitions of the weekly dataset and to the weekly cube.
+#     Only the new weeks are written, whatever the length of the history.
+#     Returns the appended rows, which may be empty.
+
+def append_weekly(df_weekly, results_dir, weekly_cube = None):
+    from Results_Dataset import open_weekly_dataset
+    from Weekly_Cube import open_weekly_cube
+
+    if weekly_cube is None:
+        weekly_cube = open_weekly_cube(results_dir)
+
+    most_recent_week_in_df = weekly_cube.latest_week()
+    df_update = df_weekly[(df_weekly["Week"] > most_recent_week_in_df).to_numpy()
+                          if most_recent_week_in_df is not None else slice(None)].copy()
+
+    if not df_update.empty:
+        open_weekly_dataset(results_dir).append(df_update)
+        weekly_cube.append(df_update)
+
+    return df_update
+
+# Rewrites weeks already in the results with the re-estimated rows
+#     of `df_revised`. A partition holds a whole week, so the other rows
+#     of those weeks are taken from the stored partitions, which also
+#     keep the rows without any estimate that the cube does not list.
+
+def revise_weekly(df_revised, results_dir, weekly_cube):
+    import pandas as pd
+    from Results_Dataset import open_weekly_dataset
+
+    if df_revised.empty:
+        return df_revised
+
+    dataset = open_weekly_dataset(results_dir)
+    weeks = sorted(df_revised["Week"].unique())
+    df_weeks = dataset.read(weeks[0], weeks[-1])
+    df_weeks = df_weeks[df_weeks["Week"].isin(weeks).to_numpy()]
+    df_weeks = pd.concat([df_weeks, df_revised[df_weeks.columns]], ignore_index = True)
+    df_weeks = df_weeks.drop_duplicates(["Country", "Week"], keep = "last")
+
+    dataset.append(df_weeks.sort_values(["Country", "Week"], ignore_index = True))
+    weekly_cube.update(df_revised)
+
+    return df_revised
+
+# The web app reloads its in-memory results whenever the content
+#     of `results/VERSION` changes, so the marker is written last,
+#     atomically, and only after the results files are complete.
+
+def write_results_version(results_dir):
+    version = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S.%f")
+    marker_path = os.path.join(results_dir, "VERSION")
+    with open(f"{marker_path}.tmp", "w") as marker:
+        marker.write(version)
+    os.replace(f"{marker_path}.tmp", marker_path)
+    return version
+
+# The dashboard figures of the new results are rendered once, by a
+#     background process that outlives this run, into the disk cache
+#     shared by the web workers (`results/figures/`). With an `export_dir`,
+#     the same process then writes the static site of the new results there.
+
+def start_figure_precompute(results_dir, data_dir = default_data_dir, export_dir = None):
+    import subprocess
+    import sys
+
+    log_path = os.path.join(os.path.dirname(run_log_path(data_dir)), "figure_precompute.log")
+    os.makedirs(os.path.dirname(log_path), exist_ok = True)
+    command = [sys.executable,
+               os.path.join(repo_dir, "figure_precompute.py"),
+               "--results-dir", os.path.abspath(results_dir)]
+    if export_dir is not None:
+        command += ["--export", os.path.abspath(export_dir)]
+    with open(log_path, "a") as log_file:
+        return subprocess.Popen(command,
+                                cwd = repo_dir,
+                                stdout = log_file,
+                                stderr = subprocess.STDOUT,
+                                start_new_session = True)
+
+### Pipeline
+
+# Runs every stage in order. Each stage is measured by a `RunProfiler`,
+#     and the run is appended to the run log in `data/logs/`.
+#
+# The run stops after the "check" stage when its input fingerprint is the
+#     one of the previous run. Otherwise the new weeks are appended, and the
+#     weeks already in the results are only rewritten for the rows whose
+#     GDP change was revised, or whose region has new coefficients.
+
+def run_update(data_dir = default_data_dir,
+               results_dir = default_results_dir,
+               source = dynamic_data_link,
+               n_sundays = 5,
+               verbose = True,
+               profile_path = None,
+               offline = False,
+               precompute = True,
+               export_dir = default_export_dir):
+    import pandas as pd
+    from Pipeline_Profiler import RunProfiler, frame_rows
+
+    log = print if verbose else (lambda *args: None)
+    profiler = RunProfiler(log_path = run_log_path(data_dir),
+                           profile_path = profile_path,
+                           verbose = verbose)
+
+    with profiler.stage("download") as stage:
+        mirror_path, mirror_entry = fetch_tracker(source, data_dir, offline)
+        stage["bytes"] = mirror_entry["size"]
+        stage["status"] = mirror_entry["status"]
+
+    with profiler.stage("check") as stage:
+        weeks_list = get_past_n_sundays(n_sundays = n_sundays)
+        previous = read_fingerprint(data_dir)
+        fingerprint = input_fingerprint(mirror_entry["sha256"],
+                                        estimate_row_hashes(results_dir),
+                                        weeks_list)
+        unchanged = inputs_unchanged(fingerprint, previous)
+        stage["unchanged"] = unchanged
+    if unchanged:
+        log('inputs unchanged')
+        profiler.finish(mode = "update", skipped = True, rows_updated = 0)
+        log('all done')
+        return pd.DataFrame()
+
+    with profiler.stage("read_excel") as stage:
+        with open(mirror_path, "rb") as mirror_file:
+            tracker_changed = convert_tracker(mirror_file.read(), data_dir)
+        stage["tracker_changed"] = tracker_changed
+    log('tracker_changed')
+    log(tracker_changed)
+
+    with profiler.stage("open_cube") as stage:
+        from Weekly_Cube import open_weekly_cube
+
+        weekly_cube = open_weekly_cube(results_dir)
+        most_recent_week_in_df = weekly_cube.latest_week()
+    log('most_recent_week_in_df')
+    log(most_recent_week_in_df)
+
+    # The target weeks are read, not only the new ones,
+    #     so that revised weeks can be detected.
+    with profiler.stage("read_tracker") as stage:
+        since = (pd.Timestamp(min(weeks_list)) - pd.Timedelta(days = 1)).strftime("%Y-%m-%d")
+        df_weekly_raw = read_new_tracker_rows(data_dir, since = since)
+        stage["rows_out"] = frame_rows(df_weekly_raw)
+
+    with profiler.stage("filter", rows_in = frame_rows(df_weekly_raw)) as stage:
+        df_weekly = dynamic_data_filter(df_weekly_raw, n_sundays = n_sundays)
+        stage["rows_out"] = frame_rows(df_weekly)
+    log(df_weekly.tail(8))
+
+    with profiler.stage("snapshot", rows_in = frame_rows(df_weekly)) as stage:
+        snapshot_entry = store_snapshot(df_weekly, data_dir)
+        stage["rows_out"] = None if snapshot_entry is None else snapshot_entry["new_rows"]
+    if snapshot_entry is not None:
+        log(f"{snapshot_entry['new_rows']} new rows of {snapshot_entry['rows']}")
+
+    with profiler.stage("detect", rows_in = frame_rows(df_weekly)) as stage:
+        regions = changed_regions(fingerprint, previous)
+        df_changed = pd.concat([stored_rows(weekly_cube, regions),
+                                revised_rows(df_weekly, weekly_cube)],
+                               ignore_index = True)
+        df_changed = df_changed.drop_duplicates(["Country", "Week"], keep = "last")
+        df_new = df_weekly[(df_weekly["Week"] > most_recent_week_in_df).to_numpy()
+                           if most_recent_week_in_df is not None else slice(None)]
+        stage["regions"] = regions
+        stage["rows_out"] = frame_rows(df_new) + frame_rows(df_changed)
+    log('changed regions')
+    log(regions)
+
+    with profiler.stage("estimate", rows_in = frame_rows(df_new)) as stage:
+        df_new = estimate_weekly(df_new, results_dir)
+        df_changed = estimate_weekly(df_changed, results_dir)
+        stage["rows_out"] = frame_rows(df_new) + frame_rows(df_changed)
+    log('df_weekly.tail(8)')
+    log(df_new.tail(8))
+
+    with profiler.stage("append", rows_in = frame_rows(df_new)) as stage:
+        df_update = append_weekly(df_new, results_dir, weekly_cube)
+        stage["rows_out"] = frame_rows(df_update)
+    log('df_update')
+    log(df_update)
+
+    with profiler.stage("revise", rows_in = frame_rows(df_changed)) as stage:
+        df_revised = revise_weekly(df_changed, results_dir, weekly_cube)
+        stage["rows_out"] = frame_rows(df_revised)
+    log(f"{len(df_revised)} rows revised")
+
+    if not (df_update.empty and df_revised.empty):
+        # Every Arrow copy is refreshed, not only `df_weekly`, so results
+        #     rewritten outside the pipeline are served from the map again
+        with profiler.stage("arrow"):
+            from Results_Arrow import publish_arrow_results
+
+            publish_arrow_results(results_dir)
+        with profiler.stage("version"):
+            version = write_results_version(results_dir)
+        log('results version')
+        log(version)
+        if precompute:
+            start_figure_precompute(results_dir, data_dir, export_dir)
+
+        # Only a run that wrote its results may let the next ones skip
+        write_fingerprint(data_dir, fingerprint)
+
+    profiler.finish(mode = "update",
+                    rows_updated = frame_rows(df_update),
+                    rows_revised = frame_rows(df_revised))
+    log('all done')
+
+    return df_update
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description = "Weekly greenhouse gas estimation update")
+    parser.add_argument("--data-dir", default = default_data_dir)
+    parser.add_argument("--results-dir", default = default_results_dir)
+    parser.add_argument("--source", default = dynamic_data_link,
+                        help = "URL or path of the OECD weekly tracker workbook")
+    parser.add_argument("--offline", action = "store_true",
+                        help = "use the mirror copy of the workbook without any request")
+    parser.add_argument("--n-sundays", type = int, default = 5)
+    parser.add_argument("--stream", action = "store_true",
+                        help = "process the tracker in bounded-size batches, "
+                               "for every region with coefficients")
+    parser.add_argument("--since", default = None,
+                        help = "with --stream, recompute every week after this date "
+                               "(default: the latest week in the results)")
+    parser.add_argument("--batch-rows", type = int, default = 65536)
+    parser.add_argument("--profile", default = None, metavar = "PATH",
+                        help = "write a cProfile dump of the run to PATH")
+    parser.add_argument("--no-precompute", action = "store_true",
+                        help = "do not prepare the dashboard figures after the update")
+    parser.add_argument("--export-dir", default = default_export_dir,
+                        help = "write the static site of the new results to this directory")
+    parser.add_argument("--no-export", action = "store_true",
+                        help = "do not write the static site after the update")
+    parser.add_argument("--quiet", action = "store_true")
+    return parser.parse_args(argv)
+
+def main(argv = None):
+    args = parse_args(argv)
+
+    if args.stream:
+        from Stream_Update import run_streaming_update
+
+        run_streaming_update(data_dir = args.data_dir,
+                             results_dir = args.results_dir,
+                             source = args.source,
+                             since = args.since,
+                             batch_rows = args.batch_rows,
+                             verbose = not args.quiet,
+                             profile_path = args.profile,
+                             offline = args.offline,
+                             precompute = not args.no_precompute,
+                             export_dir = None if args.no_export else args.export_dir)
+        return
+
+    run_update(data_dir = args.data_dir,
+               results_dir = args.results_dir,
+               source = args.source,
+               n_sundays = args.n_sundays,
+               verbose = not args.quiet,
+               profile_path = args.profile,
+               offline = args.offline,
+               precompute = not args.no_precompute,
+               export_dir = None if args.no_export else args.export_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+## Time-Varying Elasticities
+
+# The static model fits one GDP elasticity per (country, gas) on 2015-2019.
+#     This model keeps elasticities that follow the annual inventories,
+#     fitted either on a rolling window of the last `window` years or with
+#     exponentially decaying weights of the given `halflife` in years.
+#
+# Each (country, gas) fit is kept as weighted sufficient statistics
+#     (sum w, sum wx, sum wy, sum wxx, sum wxy), with x = log(gas) and
+#     y = log(GDP) as in the static model, so a new annual inventory is
+#     an O(1) update per pair, vectorized over all pairs:
+#       - rolling: add the new year and subtract the year leaving the
+#         window, kept in a ring buffer of the last `window` years,
+#       - ewm: multiply the statistics by the decay and add the new year.
+#     x and y are taken relative to the first valid observation of the
+#     pair, kept fixed afterwards, so the sums stay small and the centered
+#     sums keep their precision over long histories, as in `Static_Fit.py`.
+#
+# After each inventory year Y the coefficients are recorded in
+#     `df_elasticity`, one row per (Country, Year). A week uses the
+#     coefficients of the latest year before its own year, or of the
+#     earliest year for weeks before that (see `Weekly_Estimator.py`).
+#     The model state is saved next to it, so the next inventory
+#     is applied without refitting the history.
+#
+# Usage, from the `src` directory:
+#     python Elasticity_Model.py build [--mode rolling --window 5 | --mode ewm --halflife 3]
+#     python Elasticity_Model.py update --inventory new_year.parquet
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from Weekly_Estimator import gh_gases
+
+n_statistics = 5
+
+class ElasticityModel:
+    """
+    Rolling-window or exponentially weighted log-log fits per (country, gas)
+    """
+
+    def __init__(self, gases = gh_gases, mode = "rolling", window = 5, halflife = 3.0):
+        if mode not in ("rolling", "ewm"):
+            raise ValueError(f"Unknown mode {mode}")
+
+        self.gases = list(gases)
+        self.mode = mode
+        self.window = int(window)
+        self.halflife = float(halflife)
+
+        self.countries = []
+        self.country_position = {}
+        self.years = []
+
+        n_gases = len(self.gases)
+        self.statistics = np.zeros((0, n_gases, n_statistics))
+        # (country, slot, gas, statistic) observations still in the window
+        self.ring = np.zeros((0, self.window, n_gases, n_statistics))
+        self.n_updates = np.zeros(0, dtype = np.int64)
+        # (country, gas, [x, y]) reference values, NaN until the first observation
+        self.reference = np.full((0, n_gases, 2), np.nan)
+
+    @property
+    def decay(self):
+        return 0.5**(1/self.halflife)
+
+    def _add_countries(self, countries):
+        new = [each for each in countries if each not in self.country_position]
+        if not new:
+            return
+        n_gases = len(self.gases)
+        self.statistics = np.concatenate([self.statistics,
+                                          np.zeros((len(new), n_gases, n_statistics))])
+        self.ring = np.concatenate([self.ring,
+                                    np.zeros((len(new), self.window, n_gases, n_statistics))])
+        self.n_updates = np.concatenate([self.n_updates, np.zeros(len(new), dtype = np.int64)])
+        self.reference = np.concatenate([self.reference, np.full((len(new), n_gases, 2), np.nan)])
+        for each in new:
+            self.country_position[each] = len(self.countries)
+            self.countries.append(each)
+
+    ### Updates
+
+    def update(self, df_year):
+        """
+        Adds one annual inventory, with one row per country holding
+        `GDP` and the gas amounts of that year. Missing or non-positive
+        amounts do not contribute to the fit.
+        """
+        self._add_countries(df_year["Country"].tolist())
+        rows = df_year["Country"].map(self.country_position).to_numpy()
+
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            x = np.log(df_year[self.gases].to_numpy(dtype = np.float64))
+            y = np.log(df_year["GDP"].to_numpy(dtype = np.float64))[:, np.newaxis]
+        y = np.broadcast_to(y, x.shape)
+        valid = np.isfinite(x) & np.isfinite(y)
+
+        reference = self.reference[rows]
+        first = valid & np.isnan(reference[..., 0])
+        reference[first] = np.stack([x[first], y[first]], axis = -1)
+        self.reference[rows] = reference
+
+        w = valid.astype(np.float64)
+        x = np.where(valid, x - reference[..., 0], 0.0)
+        y = np.where(valid, y - reference[..., 1], 0.0)
+
+        observation = np.stack([w, w*x, w*y, w*x*x, w*x*y], axis = -1)
+
+        if self.mode == "ewm":
+            self.statistics[rows] = self.decay*self.statistics[rows] + observation
+        else:
+            slots = self.n_updates[rows] % self.window
+            self.statistics[rows] += observation - self.ring[rows, slots]
+            self.ring[rows, slots] = observation
+        self.n_updates[rows] += 1
+
+    def coefficients(self):
+        """
+        Returns the current (country, gas) elasticities, NaN where a fit
+        has fewer than two observations
+        """
+        s_w, s_x, s_y, s_xx, s_xy = np.moveaxis(self.statistics, -1, 0)
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            s_xx_centered = s_xx - s_x*s_x/s_w
+            coef = (s_xy - s_x*s_y/s_w)/s_xx_centered
+        return np.where((s_w >= 2) & (s_xx_centered > 0), coef, np.nan)
+
+    def coefficient_frame(self, year):
+        df_coef = pd.DataFrame(self.coefficients(),
+                               columns = [f"{each_gas}_coef" for each_gas in self.gases])
+        df_coef.insert(0, "Year", int(year))
+        df_coef.insert(0, "Country", self.countries)
+        return df_coef
+
+    # Applies the inventories of `df_inventory` year by year.
+    #     Returns the coefficient rows of each new year.
+
+    def update_years(self, df_inventory):
+        frames = []
+        for year, df_year in df_inventory.groupby("Year", sort = True):
+            if self.years and year <= self.years[-1]:
+                raise ValueError(f"Year {year} is not newer than {self.years[-1]}")
+            self.update(df_year)
+            self.years.append(int(year))
+            frames.append(self.coefficient_frame(year))
+        if not frames:
+            return pd.DataFrame(columns = ["Country", "Year"] +
+                                          [f"{each_gas}_coef" for each_gas in self.gases])
+        return pd.concat(frames, ignore_index = True)
+
+    ### Persistence
+
+    def save(self, path):
+        meta = {"gases": self.gases, "mode": self.mode, "window": self.window,
+                "halflife": self.halflife, "countries": self.countries,
+                "years": self.years}
+        with open(f"{path}.tmp", "wb") as state_file:
+            np.savez(state_file, statistics = self.statistics, ring = self.ring,
+                     n_updates = self.n_updates, reference = self.reference, meta = np.array(json.dumps(meta)))
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as state:
+            meta = json.loads(str(state["meta"]))
+            model = cls(meta["gases"], meta["mode"], meta["window"], meta["halflife"])
+            model.statistics = state["statistics"]
+            model.ring = state["ring"]
+            model.n_updates = state["n_updates"]
+            if "reference" not in state:
+                raise ValueError(f"{path} has no reference values; "
+                                 f"rebuild it with `python Elasticity_Model.py build`")
+            model.reference = state["reference"]
+        model.countries = meta["countries"]
+        model.country_position = {each: i for i, each in enumerate(model.countries)}
+        model.years = meta["years"]
+        return model
+
+def elasticity_path(results_dir):
+    return os.path.join(results_dir, "df_elasticity.parquet")
+
+def elasticity_state_path(results_dir):
+    return os.path.join(results_dir, "elasticity_state.npz")
+
+# Replays the static inventories of `df_static` into a new model.
+
+def build_elasticities(df_static, gases = gh_gases, mode = "rolling", window = 5, halflife = 3.0):
+    model = ElasticityModel(gases, mode, window, halflife)
+    df_elasticity = model.update_years(df_static)
+    return model, df_elasticity
+
+def write_elasticities(results_dir, model, df_elasticity):
+    df_elasticity.to_parquet(f"{elasticity_path(results_dir)}.tmp")
+    os.replace(f"{elasticity_path(results_dir)}.tmp", elasticity_path(results_dir))
+    model.save(elasticity_state_path(results_dir))
+
+# Applies new annual inventories to the saved model and appends their rows.
+
+def update_elasticities(results_dir, df_inventory):
+    model = ElasticityModel.load(elasticity_state_path(results_dir))
+    df_new = model.update_years(df_inventory)
+    df_elasticity = pd.concat([pd.read_parquet(elasticity_path(results_dir)), df_new],
+                              ignore_index = True)
+    write_elasticities(results_dir, model, df_elasticity)
+    return df_new
+
+def read_inventory(path):
+    if path.endswith(".csv"):
+        return pd.read_csv(path)
+    return pd.read_parquet(path)
+
+if __name__ == '__main__':
+    from Dynamic_Update import default_results_dir
+
+    parser = argparse.ArgumentParser(description = "Time-varying GDP elasticities")
+    parser.add_argument("command", choices = ["build", "update"])
+    parser.add_argument("--results-dir", default = default_results_dir)
+    parser.add_argument("--mode", choices = ["rolling", "ewm"], default = "rolling")
+    parser.add_argument("--window", type = int, default = 5)
+    parser.add_argument("--halflife", type = float, default = 3.0)
+    parser.add_argument("--inventory", default = None,
+                        help = "with update, a parquet or csv file with Country, Year, "
+                               "GDP and the gas columns")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        df_static = pd.read_parquet(os.path.join(args.results_dir, "df_static.parquet"))
+        model, df_elasticity = build_elasticities(df_static, mode = args.mode,
+                                                  window = args.window,
+                                                  halflife = args.halflife)
+        write_elasticities(args.results_dir, model, df_elasticity)
+    else:
+        if args.inventory is None:
+            parser.error("update needs --inventory")
+        df_elasticity = update_elasticities(args.results_dir, read_inventory(args.inventory))
+
+    print(df_elasticity)
@@ -0,0 +1,189 @@
+## Pipeline Instrumentation
+
+# Every stage of the daily update records its wall time, CPU time,
+#     the peak resident memory of the process so far, and its rows in/out.
+#     Each run is appended as one JSON line to the run log, and the whole
+#     run can optionally be profiled with cProfile.
+#
+# Usage, from the `src` directory:
+#     python Dynamic_Update.py --profile /tmp/update.prof
+#     python Pipeline_Profiler.py summary [--log PATH] [--runs 10] [--threshold 1.5]
+
+import argparse
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import statistics
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of this process in MB, if available
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak/1024/1024 if sys.platform == "darwin" else peak/1024
+
+def frame_rows(value):
+    try:
+        return int(len(value))
+    except TypeError:
+        return None
+
+class RunProfiler:
+    """
+    Collects per-stage measurements of one pipeline run
+    """
+
+    def __init__(self, log_path = None, profile_path = None, verbose = False):
+        self.log_path = log_path
+        self.profile_path = profile_path
+        self.verbose = verbose
+
+        self.started = datetime.datetime.now().isoformat(timespec = "seconds")
+        self.stages = []
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+        self._profile = None
+        if profile_path is not None:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in = None):
+        """
+        Measures the body of the `with` block as the stage `name`.
+        The yielded dict can be updated with `rows_out` and other fields.
+        """
+        record = {"stage": name, "rows_in": rows_in}
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_s"] = round(time.perf_counter() - wall_start, 6)
+            record["cpu_s"] = round(time.process_time() - cpu_start, 6)
+            record["peak_rss_mb"] = peak_rss_mb()
+            self.stages.append(record)
+            if self.verbose:
+                print(f"[{name}] wall {record['wall_s']:.3f}s "
+                      f"cpu {record['cpu_s']:.3f}s "
+                      f"rows {record.get('rows_in')} -> {record.get('rows_out')}")
+
+    def finish(self, **fields):
+        """
+        Stops profiling and appends the run to the run log.
+        Returns the run record.
+        """
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.profile_path)
+
+        run = {"started": self.started,
+               "wall_s": round(time.perf_counter() - self._wall_start, 6),
+               "cpu_s": round(time.process_time() - self._cpu_start, 6),
+               "peak_rss_mb": peak_rss_mb(),
+               "stages": self.stages,
+               **fields}
+
+        if self.log_path is not None:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok = True)
+            with open(self.log_path, "a") as log_file:
+                log_file.write(json.dumps(run) + "\n")
+
+        return run
+
+### Run log summary
+
+def read_runs(log_path):
+    runs = []
+    with open(log_path) as log_file:
+        for line in log_file:
+            line = line.strip()
+            if line:
+                runs.append(json.loads(line))
+    return runs
+
+# Whether two runs did the same kind of work: the same mode, and both
+#     skipped, or both not, as runs that stop after the "check" stage.
+
+def comparable_runs(run, other):
+    return (run.get("mode") == other.get("mode") and
+            bool(run.get("skipped")) == bool(other.get("skipped")))
+
+# Compares the latest run against the median of the `n_runs` comparable
+#     runs before it, so a full update is not measured against stream runs
+#     or skipped runs.
+#     A stage is flagged when its wall time is more than `threshold` times
+#     the median and slower by at least `min_seconds`.
+#     Returns a list of (stage, latest, median, ratio, flagged) tuples.
+
+def compare_runs(runs, n_runs = 10, threshold = 1.5, min_seconds = 0.05):
+    if not runs:
+        return []
+
+    latest = runs[-1]
+    previous = [run for run in runs[:-1] if comparable_runs(run, latest)][-n_runs:]
+
+    rows = []
+    for each_stage in latest["stages"] + [{"stage": "total", "wall_s": latest["wall_s"]}]:
+        name = each_stage["stage"]
+        if name == "total":
+            history = [run["wall_s"] for run in previous]
+        else:
+            history = [stage["wall_s"]
+                       for run in previous
+                       for stage in run["stages"]
+                       if stage["stage"] == name]
+
+        if not history:
+            rows.append((name, each_stage["wall_s"], None, None, False))
+            continue
+
+        median = statistics.median(history)
+        ratio = each_stage["wall_s"]/median if median > 0 else None
+        flagged = (ratio is not None and ratio > threshold and
+                   each_stage["wall_s"] - median >= min_seconds)
+        rows.append((name, each_stage["wall_s"], median, ratio, flagged))
+
+    return rows
+
+def print_summary(runs, n_runs = 10, threshold = 1.5):
+    recent = runs[-n_runs:]
+    print(f"{'started':<20} {'wall (s)':>9} {'cpu (s)':>9} {'peak MB':>9}  updated rows")
+    for run in recent:
+        peak = run.get("peak_rss_mb")
+        print(f"{run['started']:<20} {run['wall_s']:>9.3f} {run['cpu_s']:>9.3f} "
+              f"{peak if peak is not None else float('nan'):>9.1f}  {run.get('rows_updated')}")
+
+    print()
+    print(f"latest run vs median of the previous {n_runs} runs of the same kind")
+    print(f"{'stage':<16} {'latest':>9} {'median':>9} {'ratio':>7}")
+    for name, latest, median, ratio, flagged in compare_runs(runs, n_runs, threshold):
+        median_text = f"{median:>9.3f}" if median is not None else f"{'-':>9}"
+        ratio_text = f"{ratio:>7.2f}" if ratio is not None else f"{'-':>7}"
+        print(f"{name:<16} {latest:>9.3f} {median_text} {ratio_text}"
+              f"{'  REGRESSION' if flagged else ''}")
+
+if __name__ == '__main__':
+    from Dynamic_Update import default_data_dir, run_log_path
+
+    parser = argparse.ArgumentParser(description = "Summarize the pipeline run log")
+    parser.add_argument("command", choices = ["summary"])
+    parser.add_argument("--log", default = run_log_path(default_data_dir))
+    parser.add_argument("--runs", type = int, default = 10)
+    parser.add_argument("--threshold", type = float, default = 1.5)
+    args = parser.parse_args()
+
+    print_summary(read_runs(args.log), n_runs = args.runs, threshold = args.threshold)
@@ -0,0 +1,111 @@
+## Arrow IPC Results for the Web Tier
+
+# Next to the parquet results, the pipeline publishes `df_static`,
+#     `df_weekly` and `df_estimate` as uncompressed Arrow IPC files
+#     (Feather v2) in `results/arrow/`. The web tier memory-maps them:
+#     the numeric columns of the frames it builds point straight into the
+#     mapped file, so every worker shares the same page cache pages and
+#     loading does no decompression or decoding of those columns.
+#     String columns are still materialized by each worker.
+#     `df_weekly` is first streamed one weekly partition at a time, so the
+#     publish never holds the weekly frames of the whole history, then
+#     rewritten as a single record batch like the other files.
+#
+# Each file is written next to its final path and renamed into place,
+#     before the results VERSION marker is written.
+#
+# Usage, from the `src` directory:
+#     python Results_Arrow.py [--results-dir DIR]
+
+import argparse
+import os
+
+import pandas as pd
+import pyarrow as pa
+
+arrow_results = ["df_static", "df_weekly", "df_estimate"]
+
+def arrow_dir_for(results_dir):
+    return os.path.join(results_dir, "arrow")
+
+def arrow_path(results_dir, name):
+    return os.path.join(arrow_dir_for(results_dir), f"{name}.arrow")
+
+# The frame is written as a single record batch, whatever the chunks
+#     of its columns, so a reader maps each column as one contiguous array.
+
+def write_arrow(df, path):
+    table = pa.Table.from_pandas(df).combine_chunks()
+    with pa.OSFile(f"{path}.tmp", "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(f"{path}.tmp", path)
+
+# Columns without nulls are not copied by `to_pandas` when every column
+#     is its own block, so they stay views of the memory map.
+
+def read_arrow(path):
+    source = pa.memory_map(path, "r")
+    table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks = True)
+
+def read_results_frame(results_dir, name):
+    return pd.read_parquet(os.path.join(results_dir, f"{name}.parquet"))
+
+# Writes the weekly dataset partition by partition, each as its own
+#     record batch cast to the schema of the first one, to `{path}.parts`.
+#     The batches are then read back from a memory map and joined into the
+#     single batch of the final file, so the only copy in memory is the
+#     Arrow table itself.
+
+def write_arrow_partitions(partitions, path):
+    writer = None
+    with pa.OSFile(f"{path}.parts", "wb") as sink:
+        for each_df in partitions:
+            if writer is None:
+                table = pa.Table.from_pandas(each_df, preserve_index = False)
+                schema = table.schema
+                writer = pa.ipc.new_file(sink, schema)
+            else:
+                table = pa.Table.from_pandas(each_df, schema = schema, preserve_index = False)
+            writer.write_table(table.combine_chunks())
+        if writer is None:
+            return False
+        writer.close()
+
+    with pa.memory_map(f"{path}.parts", "r") as source:
+        table = pa.ipc.open_file(source).read_all().combine_chunks()
+        with pa.OSFile(f"{path}.tmp", "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        del table
+    os.remove(f"{path}.parts")
+    os.replace(f"{path}.tmp", path)
+    return True
+
+# Writes the Arrow copies of `names` from the current parquet results.
+
+def publish_arrow_results(results_dir, names = arrow_results):
+    os.makedirs(arrow_dir_for(results_dir), exist_ok = True)
+    for each_name in names:
+        path = arrow_path(results_dir, each_name)
+        if each_name == "df_weekly":
+            from Results_Dataset import open_weekly_dataset
+
+            dataset = open_weekly_dataset(results_dir)
+            if not write_arrow_partitions(dataset.iter_partitions(), path):
+                write_arrow(dataset.read(), path)
+        else:
+            write_arrow(read_results_frame(results_dir, each_name), path)
+
+if __name__ == '__main__':
+    from Dynamic_Update import default_results_dir
+
+    parser = argparse.ArgumentParser(description = "Publish the results as Arrow IPC files")
+    parser.add_argument("--results-dir", default = default_results_dir)
+    args = parser.parse_args()
+
+    publish_arrow_results(args.results_dir)
+    for each_name in arrow_results:
+        path = arrow_path(args.results_dir, each_name)
+        print(f"{each_name:<12} {os.path.getsize(path):>10} bytes")
@@ -0,0 +1,149 @@
+## Week-Partitioned Weekly Results
+
+# The weekly results are stored as one parquet file per week in
+#     `results/df_weekly/`, listed in `results/df_weekly/manifest.json`.
+#     An update writes only the partitions of its new weeks, each to a
+#     temporary file renamed into place, and then replaces the manifest,
+#     so the write cost does not grow with the history and readers,
+#     which only open the files listed in the manifest, never see a
+#     partially written file.
+#
+# Rewriting a week writes a new file under a new name; the old file is
+#     only deleted by the next write, so a reader holding the previous
+#     manifest can still open it.
+#
+# The dataset is created from the legacy `results/df_weekly.parquet`
+#     the first time it is opened.
+#
+# Usage, from the `src` directory:
+#     python Results_Dataset.py migrate [--results-dir DIR]
+
+import argparse
+import json
+import os
+import uuid
+
+import pandas as pd
+
+class WeeklyDataset:
+    """
+    Append-only, week-partitioned parquet dataset with a manifest
+    """
+
+    def __init__(self, dataset_dir):
+        self.dataset_dir = dataset_dir
+        self.manifest_path = os.path.join(dataset_dir, "manifest.json")
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    def manifest(self):
+        if not self.exists():
+            return {"version": 0, "partitions": {}, "garbage": []}
+        with open(self.manifest_path) as manifest_file:
+            return json.load(manifest_file)
+
+    def weeks(self):
+        """
+        Returns the stored weeks, oldest first
+        """
+        return sorted(self.manifest()["partitions"])
+
+    def latest_week(self):
+        weeks = self.weeks()
+        return weeks[-1] if weeks else None
+
+    ### Writing
+
+    def append(self, df_update):
+        """
+        Writes one partition per week of `df_update`, replacing those weeks
+        if they already exist. Returns the list of weeks written.
+        """
+        if df_update.empty:
+            return []
+
+        manifest = self.manifest()
+        os.makedirs(self.dataset_dir, exist_ok = True)
+
+        for each_file in manifest["garbage"]:
+            try:
+                os.remove(os.path.join(self.dataset_dir, each_file))
+            except FileNotFoundError:
+                pass
+        manifest["garbage"] = []
+
+        written = []
+        for week, df_week in df_update.groupby("Week", sort = True):
+            filename = f"week={week}-{uuid.uuid4().hex[:8]}.parquet"
+            path = os.path.join(self.dataset_dir, filename)
+            df_week.reset_index(drop = True).to_parquet(f"{path}.tmp", index = False)
+            os.replace(f"{path}.tmp", path)
+
+            previous = manifest["partitions"].get(week)
+            if previous is not None:
+                manifest["garbage"].append(previous["file"])
+            manifest["partitions"][week] = {"file": filename, "rows": int(len(df_week))}
+            written.append(week)
+
+        manifest["version"] += 1
+        with open(f"{self.manifest_path}.tmp", "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent = 2, sort_keys = True)
+        os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+
+        return written
+
+    ### Reading
+
+    def partition_files(self, start = None, end = None, last_n = None):
+        """
+        Returns the partition paths for start <= week <= end,
+        or for the `last_n` latest weeks, oldest first
+        """
+        partitions = self.manifest()["partitions"]
+        weeks = sorted(week for week in partitions
+                       if (start is None or week >= start) and
+                          (end is None or week <= end))
+        if last_n is not None:
+            weeks = weeks[-last_n:] if last_n > 0 else []
+        return [os.path.join(self.dataset_dir, partitions[week]["file"])
+                for week in weeks]
+
+    def iter_partitions(self, start = None, end = None, last_n = None):
+        for each_path in self.partition_files(start, end, last_n):
+            yield pd.read_parquet(each_path)
+
+    def read(self, start = None, end = None, last_n = None, columns = None):
+        """
+        Returns the weekly results for the selected weeks as a single frame
+        """
+        files = self.partition_files(start, end, last_n)
+        if not files:
+            return pd.DataFrame(columns = columns)
+        return pd.concat([pd.read_parquet(each_path, columns = columns)
+                          for each_path in files],
+                         ignore_index = True)
+
+def weekly_dataset_dir(results_dir):
+    return os.path.join(results_dir, "df_weekly")
+
+# Opens the weekly dataset of `results_dir`,
+#     creating it from `df_weekly.parquet` the first time.
+
+def open_weekly_dataset(results_dir):
+    dataset = WeeklyDataset(weekly_dataset_dir(results_dir))
+    if not dataset.exists():
+        df_weekly = pd.read_parquet(os.path.join(results_dir, "df_weekly.parquet"))
+        dataset.append(df_weekly)
+    return dataset
+
+if __name__ == '__main__':
+    from Dynamic_Update import default_results_dir
+
+    parser = argparse.ArgumentParser(description = "Week-partitioned weekly results")
+    parser.add_argument("command", choices = ["migrate"])
+    parser.add_argument("--results-dir", default = default_results_dir)
+    args = parser.parse_args()
+
+    dataset = open_weekly_dataset(args.results_dir)
+    print(f"{len(dataset.weeks())} weeks, latest {dataset.latest_week()}")
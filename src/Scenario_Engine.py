@@ -0,0 +1,307 @@
+## Scenario Estimation
+
+# What-if versions of the weekly estimate for every region with coefficients:
+#     shocked GDP paths, coefficients shifted by a number of standard errors,
+#     and Monte Carlo draws of the coefficients from the standard errors of
+#     the static regressions (`df_fit`). For each scenario, region, week and
+#     gas the weekly amount is summarized by its mean and quantiles.
+#
+# The inputs are packed once into a few NumPy arrays in shared memory:
+#     the GDP changes of every (region, week) row sorted by region, the row
+#     offsets of each region, and the (region, gas) coefficients, standard
+#     errors and baselines. Workers of a process pool attach to them once,
+#     so a task is only (scenario, block of region codes) and nothing large
+#     is pickled either way; each task returns the summaries of its block.
+#
+# The draws of a (scenario, region) pair come from a generator seeded with
+#     (seed, scenario, region), so results do not depend on the sharding.
+#
+# Usage, from the `src` directory:
+#     python Scenario_Engine.py [--draws 1000] [--shock -2 -5] [--workers 8]
+#                               [--output ../results/df_scenarios.parquet]
+
+import argparse
+import collections
+import concurrent.futures
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from Weekly_Estimator import gh_gases
+
+default_quantiles = (0.05, 0.5, 0.95)
+
+# `gdp_shift` is added to, and `gdp_scale` multiplies, the GDP change in
+#     percentage points. `coef_shift` moves every coefficient by that many
+#     standard errors. With `draws` > 0 the coefficients are also drawn
+#     from a normal distribution around the shifted coefficients.
+
+Scenario = collections.namedtuple("Scenario",
+                                  ["name", "gdp_shift", "gdp_scale", "coef_shift", "draws"],
+                                  defaults = [0.0, 1.0, 0.0, 0])
+
+def default_scenarios(draws = 1000, shocks = ()):
+    scenarios = [Scenario("baseline"),
+                 Scenario("coef_low", coef_shift = -1.96),
+                 Scenario("coef_high", coef_shift = 1.96)]
+    if draws > 0:
+        scenarios.append(Scenario("monte_carlo", draws = draws))
+        for each_shock in shocks:
+            scenarios.append(Scenario(f"gdp_{each_shock:+g}_monte_carlo",
+                                      gdp_shift = each_shock, draws = draws))
+    else:
+        for each_shock in shocks:
+            scenarios.append(Scenario(f"gdp_{each_shock:+g}", gdp_shift = each_shock))
+    return scenarios
+
+def quantile_column(quantile):
+    return f"p{quantile*100:g}"
+
+### Shared memory
+
+class SharedArrays:
+    """
+    NumPy arrays copied into named shared memory blocks
+
+    `spec` describes the blocks and is all a worker needs to attach
+    to them with `attach_shared_arrays`. The blocks are released by
+    `close`, or at the end of a `with` block.
+    """
+
+    def __init__(self, arrays):
+        self._blocks = []
+        self.spec = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+            self._blocks.append(block)
+            np.ndarray(array.shape, array.dtype, buffer = block.buf)[...] = array
+            self.spec[name] = (block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# The arrays attached in a worker process, kept for the life of the process.
+_worker_blocks = []
+_worker_arrays = {}
+
+def attach_shared_arrays(spec):
+    for name, (block_name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name = block_name)
+        _worker_blocks.append(block)
+        _worker_arrays[name] = np.ndarray(shape, np.dtype(dtype), buffer = block.buf)
+
+### Inputs
+
+# Standard errors of the coefficients, as a (region, gas) frame aligned
+#     with `df_estimate`. They are read from `df_fit.parquet` when it exists
+#     and fitted again from `df_static.parquet` otherwise.
+
+def read_standard_errors(results_dir, df_estimate, gases = gh_gases):
+    fit_path = os.path.join(results_dir, "df_fit.parquet")
+    if os.path.exists(fit_path):
+        df_fit = pd.read_parquet(fit_path)
+    else:
+        from Static_Fit import fit_static_model
+
+        df_fit = fit_static_model(pd.read_parquet(os.path.join(results_dir, "df_static.parquet")),
+                                  gases)[1]
+
+    df_std_err = df_fit.pivot(index = "Country", columns = "POL", values = "std_err")
+    return df_std_err.reindex(index = df_estimate.index, columns = gases)
+
+# The (Country, Week, GDP_Change) rows to run the scenarios on: every region
+#     of the tracker cache with coefficients when the cache exists,
+#     and the weekly results otherwise.
+
+def read_weekly_changes(data_dir, results_dir, countries, start_week = None):
+    import Dynamic_Update
+
+    cache_path = Dynamic_Update.tracker_cache_path(data_dir)
+    if os.path.exists(cache_path):
+        from Tracker_Ingest import read_tracker
+
+        return Dynamic_Update.select_tracker_rows(read_tracker(cache_path),
+                                                  countries,
+                                                  start_week = start_week)
+
+    from Results_Dataset import open_weekly_dataset
+
+    df_weekly = open_weekly_dataset(results_dir).read(start = start_week,
+                                                      columns = ["Country", "Week", "GDP_Change"])
+    return df_weekly[df_weekly["Country"].isin(countries).to_numpy()].reset_index(drop = True)
+
+# Packs the inputs into the arrays shared with the workers.
+#     Rows are sorted by region, so the rows of region `c` are
+#     `offsets[c]:offsets[c + 1]`.
+
+def pack_inputs(df_estimate, df_std_err, df_weekly, gases = gh_gases):
+    countries = df_estimate.index
+    codes = countries.get_indexer(df_weekly["Country"])
+    if (codes < 0).any():
+        missing = sorted(df_weekly["Country"][codes < 0].unique())
+        raise KeyError(f"No estimate for {missing}")
+
+    order = np.argsort(codes, kind = "stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength = len(countries)))])
+
+    arrays = {
+        "change": df_weekly["GDP_Change"].to_numpy(dtype = np.float64)[order],
+        "offsets": offsets.astype(np.int64),
+        "coef": df_estimate[[f"{each_gas}_coef" for each_gas in gases]].to_numpy(dtype = np.float64),
+        "std_err": np.nan_to_num(df_std_err.to_numpy(dtype = np.float64)),
+        "baseline": df_estimate[gases].to_numpy(dtype = np.float64),
+    }
+    return arrays, order
+
+### Workers
+
+# Summarizes one scenario for a block of regions. The arithmetic is the
+#     one of `estimate_weekly_emission`, broadcast over (row, draw, gas).
+#     Returns (scenario index, region codes, means, quantiles) where the
+#     means are (rows, gas) and the quantiles (quantile, rows, gas) for the
+#     rows of the block, in order.
+
+def run_scenario_block(scenario_index, scenario, region_codes, quantiles, seed,
+                       arrays = None):
+    arrays = _worker_arrays if arrays is None else arrays
+    offsets = arrays["offsets"]
+
+    means = []
+    bands = []
+    for each_code in region_codes:
+        change = arrays["change"][offsets[each_code]:offsets[each_code + 1]]
+        change = change*scenario.gdp_scale + scenario.gdp_shift
+
+        coef = arrays["coef"][each_code]
+        std_err = arrays["std_err"][each_code]
+        shift = np.full((1, len(coef)), scenario.coef_shift)
+        if scenario.draws > 0:
+            generator = np.random.default_rng([seed, scenario_index, int(each_code)])
+            shift = shift + generator.standard_normal((scenario.draws, len(coef)))
+        coef_draws = coef + shift*std_err
+
+        amount_week = arrays["baseline"][each_code]*7/365
+        change_gh = change[:, np.newaxis, np.newaxis]*coef_draws
+        weekly = amount_week*(1 + change_gh/100)
+
+        means.append(weekly.mean(axis = 1))
+        bands.append(np.quantile(weekly, quantiles, axis = 1))
+
+    n_gases = arrays["coef"].shape[1]
+    if not means:
+        return (scenario_index, region_codes,
+                np.empty((0, n_gases)), np.empty((len(quantiles), 0, n_gases)))
+    return (scenario_index, region_codes,
+            np.concatenate(means), np.concatenate(bands, axis = 1))
+
+### Engine
+
+def run_scenarios(df_estimate, df_std_err, df_weekly, scenarios,
+                  gases = gh_gases,
+                  quantiles = default_quantiles,
+                  seed = 0,
+                  n_workers = None,
+                  regions_per_task = 8):
+    """
+    Runs every scenario over every region of `df_weekly`.
+
+    Returns a long frame with one row per (Scenario, Country, Week, POL)
+    holding the mean and the quantiles of the weekly amount.
+    With `n_workers` = 1 everything runs in this process.
+    """
+    arrays, order = pack_inputs(df_estimate, df_std_err, df_weekly, gases)
+    n_regions = len(df_estimate.index)
+    blocks = [np.arange(start, min(start + regions_per_task, n_regions))
+              for start in range(0, n_regions, regions_per_task)]
+    tasks = [(scenario_index, scenario, block, quantiles, seed)
+             for scenario_index, scenario in enumerate(scenarios)
+             for block in blocks]
+
+    if n_workers == 1:
+        results = [run_scenario_block(*task, arrays = arrays) for task in tasks]
+    else:
+        with SharedArrays(arrays) as shared:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers = n_workers,
+                    initializer = attach_shared_arrays,
+                    initargs = (shared.spec,)) as executor:
+                futures = [executor.submit(run_scenario_block, *task) for task in tasks]
+                results = [future.result() for future in futures]
+
+    # Every scenario covers the rows of all blocks in region order,
+    #     i.e. the packed row order.
+    means = np.empty((len(scenarios), len(order), len(gases)))
+    bands = np.empty((len(scenarios), len(quantiles), len(order), len(gases)))
+    offsets = arrays["offsets"]
+    for scenario_index, region_codes, block_means, block_bands in results:
+        if len(region_codes) == 0:
+            continue
+        start, end = offsets[region_codes[0]], offsets[region_codes[-1] + 1]
+        means[scenario_index, start:end] = block_means
+        bands[scenario_index, :, start:end] = block_bands
+
+    df_rows = df_weekly[["Country", "Week"]].iloc[order].reset_index(drop = True)
+    n_rows = len(df_rows)
+
+    df_result = pd.DataFrame({
+        "Scenario": np.repeat([each.name for each in scenarios], n_rows*len(gases)),
+        "Country": np.tile(np.repeat(df_rows["Country"].to_numpy(), len(gases)), len(scenarios)),
+        "Week": np.tile(np.repeat(df_rows["Week"].to_numpy(), len(gases)), len(scenarios)),
+        "POL": np.tile(gases, len(scenarios)*n_rows),
+        "mean": means.ravel(),
+        **{quantile_column(each_quantile): bands[:, k].ravel()
+           for k, each_quantile in enumerate(quantiles)},
+    })
+    return df_result
+
+if __name__ == '__main__':
+    import time
+
+    from Dynamic_Update import default_data_dir, default_results_dir
+
+    parser = argparse.ArgumentParser(description = "Scenario and Monte Carlo weekly estimates")
+    parser.add_argument("--data-dir", default = default_data_dir)
+    parser.add_argument("--results-dir", default = default_results_dir)
+    parser.add_argument("--since", default = None,
+                        help = "only the weeks after this date")
+    parser.add_argument("--draws", type = int, default = 1000)
+    parser.add_argument("--shock", type = float, nargs = "*", default = [],
+                        help = "GDP shocks in percentage points, e.g. -2 -5")
+    parser.add_argument("--quantiles", type = float, nargs = "+", default = list(default_quantiles))
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--workers", type = int, default = None)
+    parser.add_argument("--regions-per-task", type = int, default = 8)
+    parser.add_argument("--output", default = None,
+                        help = "write the scenario frame to this parquet file")
+    args = parser.parse_args()
+
+    df_estimate = pd.read_parquet(os.path.join(args.results_dir, "df_estimate.parquet"))
+    df_std_err = read_standard_errors(args.results_dir, df_estimate)
+    df_weekly = read_weekly_changes(args.data_dir, args.results_dir,
+                                    df_estimate.index.tolist(), args.since)
+
+    start = time.perf_counter()
+    df_scenarios = run_scenarios(df_estimate, df_std_err, df_weekly,
+                                 default_scenarios(args.draws, args.shock),
+                                 quantiles = args.quantiles,
+                                 seed = args.seed,
+                                 n_workers = args.workers,
+                                 regions_per_task = args.regions_per_task)
+    print(f"{len(df_weekly)} weekly rows, {len(df_scenarios)} scenario rows "
+          f"in {time.perf_counter() - start:.2f}s")
+    print(df_scenarios)
+
+    if args.output is not None:
+        df_scenarios.to_parquet(args.output)
@@ -0,0 +1,363 @@
+## Deduplicated Storage of the Raw Tracker Snapshots
+
+# Consecutive weekly dumps of the OECD tracker cover almost the same
+#     (region, date) rows, but every dump revises the yoy columns of
+#     every row, so whole rows are rarely repeated while most cells are.
+#     Each snapshot is therefore stored as a delta against the previous one,
+#     keyed on (region, date):
+#       - an order file of (source, start, length) runs that lists, in order,
+#         whether every row comes from the previous snapshot (source 0)
+#         or is a row whose key is new (source 1), and at which position,
+#       - a cells file with, for every column that changed, the new values
+#         of the changed cells and a `changed:{column}` mask of them.
+#         Every cell of a new row counts as changed.
+#     Unchanged cells are null in the cells file, which parquet stores as
+#     a few bits. Rows that disappeared are simply not referenced.
+#
+# The tracker re-estimates its whole history every week, so in practice
+#     every non-missing number is revised and only the keys, `ISO3` and the
+#     missing cells are shared between dumps. The numbers themselves are
+#     saved by the encoding: the store writes float columns with the
+#     BYTE_STREAM_SPLIT encoding and zstd, which shrinks them by about a
+#     quarter compared with the plain parquet dumps.
+#
+# The first snapshot, and any snapshot whose columns, dtypes or key
+#     uniqueness differ from the previous one, or whose delta would not be
+#     smaller than the snapshot itself, is stored in full as a base.
+#     A snapshot is rebuilt exactly by replaying the deltas from its base.
+#     The latest snapshot is also kept in full as the head, so a new
+#     snapshot is compared against one file, whatever the history.
+#     When the latest snapshot is a base, its base file is the head.
+#     Otherwise the head is a `head-{name}.parquet` file written with the
+#     store encoding, and its bytes are counted as stored bytes of that
+#     snapshot. The head can always be rebuilt from the deltas.
+#     The base and delta files are never rewritten, so incremental backups
+#     only transfer the new ones.
+#
+# Usage, from the `src` directory:
+#     python Snapshot_Store.py import ../data/2021-11-14.parquet ../data/2021-11-21.parquet
+#     python Snapshot_Store.py report
+#     python Snapshot_Store.py restore 2021-11-21 /tmp/2021-11-21.parquet
+
+import argparse
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+key_columns = ["region", "date"]
+
+order_columns = ["source", "start", "length"]
+
+def parquet_size(df):
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index = False)
+    return buffer.tell()
+
+# Writes a frame or an Arrow table with the store encoding.
+
+def write_parquet(data, path):
+    table = data if isinstance(data, pa.Table) else pa.Table.from_pandas(data, preserve_index = False)
+    float_columns = [field.name for field in table.schema
+                     if pa.types.is_floating(field.type)]
+    pq.write_table(table, path, compression = "zstd",
+                   use_dictionary = [each for each in table.column_names
+                                     if each not in float_columns],
+                   use_byte_stream_split = float_columns)
+
+# Collapses per-row (source, position) references into
+#     (source, start, length) runs of consecutive positions.
+
+def encode_runs(sources, positions):
+    if len(positions) == 0:
+        return pd.DataFrame({each: np.array([], dtype = np.int64)
+                             for each in order_columns})
+
+    breaks = np.flatnonzero((np.diff(sources) != 0) |
+                            (np.diff(positions) != 1)) + 1
+    starts = np.concatenate([[0], breaks])
+    lengths = np.diff(np.concatenate([starts, [len(positions)]]))
+
+    return pd.DataFrame({"source": sources[starts],
+                         "start": positions[starts],
+                         "length": lengths})
+
+# The row of every snapshot row in the concatenation of the sources,
+#     given the offset of each source in it.
+
+def decode_runs(df_order, source_offsets):
+    starts = (np.asarray(source_offsets, dtype = np.int64)[df_order["source"].to_numpy()] +
+              df_order["start"].to_numpy(dtype = np.int64))
+    lengths = df_order["length"].to_numpy(dtype = np.int64)
+    run_offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + np.arange(lengths.sum()) - run_offsets
+
+# The cells of `new` that differ from `old`, two aligned columns.
+#     Missing values on both sides are equal.
+
+def changed_cells(old, new):
+    same = old.eq(new).fillna(False).to_numpy(dtype = bool)
+    both_missing = (old.isna() & new.isna()).to_numpy(dtype = bool)
+    return ~(same | both_missing)
+
+# The delta of `df_snapshot` against `df_parent`, as the order runs and
+#     the changed cells table, or None when the snapshot has to be stored
+#     as a base.
+
+def snapshot_delta(df_parent, df_snapshot):
+    if (list(df_parent.columns) != list(df_snapshot.columns) or
+            not df_parent.dtypes.equals(df_snapshot.dtypes) or
+            not set(key_columns) <= set(df_snapshot.columns)):
+        return None
+
+    parent_keys = pd.MultiIndex.from_frame(df_parent[key_columns])
+    snapshot_keys = pd.MultiIndex.from_frame(df_snapshot[key_columns])
+    if not (parent_keys.is_unique and snapshot_keys.is_unique):
+        return None
+
+    parent_rows = parent_keys.get_indexer(snapshot_keys)
+    added = parent_rows < 0
+    positions = np.where(added, np.cumsum(added) - 1, parent_rows)
+    df_order = encode_runs(added.astype(np.int64), positions)
+
+    matched = np.flatnonzero(~added)
+    cells = {}
+    for each_column in df_snapshot.columns:
+        changed = added.copy()
+        if each_column not in key_columns:
+            old = df_parent[each_column].iloc[parent_rows[matched]].reset_index(drop = True)
+            new = df_snapshot[each_column].iloc[matched].reset_index(drop = True)
+            changed[matched[changed_cells(old, new)]] = True
+        if not changed.any():
+            continue
+        cells[each_column] = pa.array(df_snapshot[each_column].to_numpy(), mask = ~changed,
+                                      from_pandas = True)
+        cells[f"changed:{each_column}"] = pa.array(changed)
+
+    return df_order, int(added.sum()), pa.table(cells)
+
+# Rebuilds a snapshot from its parent and its delta.
+#     The new rows are read from the cells table, where all their cells are set.
+
+def apply_delta(df_parent, df_order, table_cells):
+    take = decode_runs(df_order, [0, len(df_parent)])
+    added = take >= len(df_parent)
+
+    df_added = pd.DataFrame({each_column: table_cells.column(each_column).filter(
+                                              pa.array(added)).to_pandas()
+                             for each_column in df_parent.columns} if added.any() else
+                            {each_column: [] for each_column in df_parent.columns})
+    df_added = df_added.astype(df_parent.dtypes.to_dict())
+
+    df_snapshot = pd.concat([df_parent, df_added], ignore_index = True)
+    df_snapshot = df_snapshot.iloc[take].reset_index(drop = True)
+
+    for each_column in table_cells.column_names:
+        if each_column.startswith("changed:"):
+            continue
+        changed = table_cells.column(f"changed:{each_column}").to_numpy() & ~added
+        values = table_cells.column(each_column).filter(pa.array(changed)).to_pandas()
+        column = df_snapshot[each_column].copy()
+        column.iloc[np.flatnonzero(changed)] = values.to_numpy()
+        df_snapshot[each_column] = column
+
+    return df_snapshot
+
+class SnapshotStore:
+    """
+    Store of tracker snapshots as cell-level deltas between consecutive snapshots
+    """
+
+    def __init__(self, store_dir = "../data/snapshots"):
+        self.store_dir = store_dir
+        self.manifest_path = os.path.join(store_dir, "manifest.json")
+
+    def names(self):
+        """
+        Returns the snapshot names, oldest first
+        """
+        return list(self._manifest()["snapshots"])
+
+    def has(self, name):
+        return name in self._manifest()["snapshots"]
+
+    def put(self, name, df_snapshot):
+        """
+        Stores `df_snapshot` under `name`, as a delta against the latest snapshot
+        """
+        manifest = self._manifest()
+        if name in manifest["snapshots"]:
+            raise ValueError(f"Snapshot {name} already exists")
+
+        df_snapshot = df_snapshot.reset_index(drop = True)
+        df_snapshot.columns = [str(each) for each in df_snapshot.columns]
+        parent = manifest["head"]
+        delta = None if parent is None else snapshot_delta(self._read_head(manifest),
+                                                           df_snapshot)
+
+        snapshot_dir = os.path.join("snapshots", name)
+        os.makedirs(self._path(snapshot_dir), exist_ok = True)
+        base_file = os.path.join(snapshot_dir, "base.parquet")
+        write_parquet(df_snapshot, self._path(base_file))
+        files = {"base": base_file}
+        entry = {"parent": None, "new_rows": int(len(df_snapshot)),
+                 "stored_cells": int(df_snapshot.size)}
+
+        if delta is not None:
+            df_order, new_rows, table_cells = delta
+            delta_files = {each: os.path.join(snapshot_dir, f"{each}.parquet")
+                           for each in ("order", "cells")}
+            write_parquet(df_order, self._path(delta_files["order"]))
+            write_parquet(table_cells, self._path(delta_files["cells"]))
+
+            delta_bytes = sum(os.path.getsize(self._path(each))
+                              for each in delta_files.values())
+            kept = delta_files if delta_bytes < os.path.getsize(self._path(base_file)) else files
+            for each in set(delta_files.values()) | {base_file}:
+                if each not in kept.values():
+                    os.remove(self._path(each))
+            if kept is delta_files:
+                files = delta_files
+                entry = {"parent": parent, "new_rows": new_rows,
+                         "stored_cells": int(sum(table_cells.column(each).to_numpy().sum()
+                                                  for each in table_cells.column_names
+                                                  if each.startswith("changed:")))}
+
+        entry.update({"files": files,
+                      "columns": list(df_snapshot.columns),
+                      "rows": int(len(df_snapshot)),
+                      "full_bytes": parquet_size(df_snapshot)})
+
+        manifest["snapshots"][name] = entry
+        manifest["head"] = name
+        head_file = self._head_file(manifest)
+        if head_file != files.get("base"):
+            write_parquet(df_snapshot, self._path(head_file))
+        self._write_manifest(manifest)
+        self._remove_old_heads(head_file)
+
+        return entry
+
+    def get(self, name):
+        """
+        Rebuilds the snapshot `name` exactly as it was stored
+        """
+        manifest = self._manifest()
+        if name == manifest["head"] and os.path.exists(self._path(self._head_file(manifest))):
+            return pd.read_parquet(self._path(self._head_file(manifest)))
+
+        chain = [name]
+        while manifest["snapshots"][chain[-1]]["parent"] is not None:
+            chain.append(manifest["snapshots"][chain[-1]]["parent"])
+
+        df_snapshot = pd.read_parquet(
+            self._path(manifest["snapshots"][chain[-1]]["files"]["base"]))
+        for each_name in reversed(chain[:-1]):
+            files = manifest["snapshots"][each_name]["files"]
+            df_snapshot = apply_delta(df_snapshot,
+                                      pd.read_parquet(self._path(files["order"])),
+                                      pq.read_table(self._path(files["cells"])))
+        return df_snapshot
+
+    def report(self):
+        """
+        Returns a frame with the stored and the full size of every snapshot,
+        the head file counting as stored bytes of the latest one
+        """
+        manifest = self._manifest()
+        records = []
+        for name, entry in manifest["snapshots"].items():
+            stored_files = set(entry["files"].values())
+            if name == manifest["head"]:
+                stored_files.add(self._head_file(manifest))
+            stored_bytes = sum(os.path.getsize(self._path(each))
+                               for each in stored_files
+                               if os.path.exists(self._path(each)))
+            records.append({"snapshot": name,
+                            "kind": "base" if entry["parent"] is None else "delta",
+                            "rows": entry["rows"],
+                            "new_rows": entry["new_rows"],
+                            "stored_cells": entry["stored_cells"],
+                            "full_bytes": entry["full_bytes"],
+                            "stored_bytes": stored_bytes})
+
+        df_report = pd.DataFrame(records, columns = ["snapshot", "kind", "rows", "new_rows",
+                                                     "stored_cells", "full_bytes",
+                                                     "stored_bytes"])
+        df_report["saved_bytes"] = df_report["full_bytes"] - df_report["stored_bytes"]
+        return df_report
+
+    # The file holding the latest snapshot in full: its base file when it
+    #     is a base, its own head file otherwise.
+
+    def _head_file(self, manifest):
+        name = manifest["head"]
+        entry = manifest["snapshots"][name]
+        if entry["parent"] is None:
+            return entry["files"]["base"]
+        return f"head-{name}.parquet"
+
+    # The latest snapshot, from the head file, or rebuilt when it is missing.
+
+    def _read_head(self, manifest):
+        head_path = self._path(self._head_file(manifest))
+        if os.path.exists(head_path):
+            return pd.read_parquet(head_path)
+        return self.get(manifest["head"])
+
+    def _remove_old_heads(self, head_file):
+        for each in os.listdir(self.store_dir):
+            if each.startswith("head-") and each != head_file:
+                os.remove(self._path(each))
+
+    def _path(self, relative_path):
+        return os.path.join(self.store_dir, relative_path)
+
+    def _manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {"head": None, "snapshots": {}}
+        with open(self.manifest_path) as manifest_file:
+            return json.load(manifest_file)
+
+    def _write_manifest(self, manifest):
+        with open(f"{self.manifest_path}.tmp", "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent = 2)
+        os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Deduplicated tracker snapshot store")
+    parser.add_argument("--store-dir", default = "../data/snapshots")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    import_parser = commands.add_parser("import", help = "store full parquet dumps")
+    import_parser.add_argument("paths", nargs = "+")
+
+    commands.add_parser("report", help = "show the storage saved")
+
+    restore_parser = commands.add_parser("restore", help = "rebuild a snapshot")
+    restore_parser.add_argument("name")
+    restore_parser.add_argument("output")
+
+    args = parser.parse_args()
+    store = SnapshotStore(args.store_dir)
+
+    if args.command == "import":
+        for each_path in sorted(args.paths):
+            name = os.path.splitext(os.path.basename(each_path))[0]
+            if store.has(name):
+                print(f"{name}: already stored")
+                continue
+            entry = store.put(name, pd.read_parquet(each_path))
+            print(f"{name}: {entry['new_rows']} new rows and {entry['stored_cells']} "
+                  f"stored cells of {entry['rows']} rows")
+    elif args.command == "report":
+        df_report = store.report()
+        print(df_report.to_string(index = False))
+        print(f"total saved: {df_report['saved_bytes'].sum()} of "
+              f"{df_report['full_bytes'].sum()} bytes")
+    elif args.command == "restore":
+        store.get(args.name).to_parquet(args.output)
@@ -0,0 +1,217 @@
+## Fetching of the Upstream Sources
+
+# Every upstream file is kept in a local mirror, `data/mirror/`, described
+#     by `data/mirror/mirror.json` with the URL, ETag, Last-Modified,
+#     size and SHA-256 of each file.
+#
+# A fetch sends If-None-Match / If-Modified-Since from the mirror entry,
+#     so an unchanged file costs one round trip and a 304 response.
+#     A changed file is streamed in chunks to a temporary file next to the
+#     mirror copy, hashed on the way, and renamed into place.
+#     The sources are fetched concurrently with asyncio; the requests
+#     themselves are plain urllib calls run in the default thread pool,
+#     which keeps the dependencies unchanged.
+#
+# With `offline = True` nothing is requested: the mirror copies are
+#     checked against their recorded checksums and used as they are.
+#
+# Usage, from the `src` directory:
+#     python Source_Fetch.py [--offline] [--only tracker] [--source NAME=URL]
+
+import argparse
+import asyncio
+import datetime
+import email.utils
+import hashlib
+import json
+import os
+import urllib.error
+import urllib.request
+
+# The OECD weekly tracker used by the daily update, and the OECD AIR_GHG
+#     emissions table used by the Static Model notebook.
+#     Any of them can be pointed at another URL or a local path.
+#     The IMF GDP table of the notebook is the checked-in DataMapper
+#     export (`data/imf-dm-export-*.xls`), which has no download URL.
+
+upstream_sources = {
+    "tracker": ("https://github.com/NicolasWoloszko" +
+                "/OECD-Weekly-Tracker/raw/main/Data/weekly_tracker.xlsx",
+                "weekly_tracker.xlsx"),
+    "air_ghg": ("https://stats.oecd.org/SDMX-JSON/data/AIR_GHG/all/all?contentType=csv",
+                "AIR_GHG.csv"),
+}
+
+chunk_size = 1 << 20
+request_timeout = 60
+
+def mirror_dir_for(data_dir):
+    return os.path.join(data_dir, "mirror")
+
+def read_mirror_manifest(mirror_dir):
+    try:
+        with open(os.path.join(mirror_dir, "mirror.json")) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {}
+
+def write_mirror_manifest(mirror_dir, manifest):
+    manifest_path = os.path.join(mirror_dir, "mirror.json")
+    with open(f"{manifest_path}.tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent = 2, sort_keys = True)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as each_file:
+        for chunk in iter(lambda: each_file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# True when the mirror copy of `entry` exists and matches its checksum.
+
+def mirror_is_valid(mirror_dir, entry):
+    if not entry:
+        return False
+    path = os.path.join(mirror_dir, entry["file"])
+    return os.path.exists(path) and file_sha256(path) == entry["sha256"]
+
+def now_text():
+    return datetime.datetime.now().isoformat(timespec = "seconds")
+
+# Fetches one source into the mirror, conditionally on the previous entry.
+#     Returns the new mirror entry, whose "status" is "updated" when the
+#     file changed and "unchanged" otherwise. Local paths are copied,
+#     which lets the pipeline and the checks run against local files.
+
+def fetch_source(url, filename, mirror_dir, entry = None):
+    path = os.path.join(mirror_dir, filename)
+    valid = mirror_is_valid(mirror_dir, entry) and entry["url"] == url
+
+    headers = {}
+    if valid and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if valid and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+
+    if "://" in url:
+        request = urllib.request.Request(url, headers = headers)
+        try:
+            response = urllib.request.urlopen(request, timeout = request_timeout)
+        except urllib.error.HTTPError as error:
+            if error.code == 304 and valid:
+                return {**entry, "status": "unchanged", "checked_at": now_text()}
+            raise
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+    else:
+        response = open(url, "rb")
+        stat = os.fstat(response.fileno())
+        etag = None
+        last_modified = email.utils.formatdate(stat.st_mtime, usegmt = True)
+
+    digest = hashlib.sha256()
+    size = 0
+    with response, open(f"{path}.tmp", "wb") as mirror_file:
+        for chunk in iter(lambda: response.read(chunk_size), b""):
+            digest.update(chunk)
+            mirror_file.write(chunk)
+            size += len(chunk)
+    sha256 = digest.hexdigest()
+
+    # A server without validators, or a local file with a new mtime,
+    #     may send the same content again.
+    if valid and sha256 == entry["sha256"]:
+        os.remove(f"{path}.tmp")
+        status = "unchanged"
+    else:
+        os.replace(f"{path}.tmp", path)
+        status = "updated"
+
+    return {"url": url,
+            "file": filename,
+            "etag": etag,
+            "last_modified": last_modified,
+            "size": size,
+            "sha256": sha256,
+            "fetched_at": now_text() if status == "updated" else entry["fetched_at"],
+            "checked_at": now_text(),
+            "status": status}
+
+async def fetch_all_async(sources, mirror_dir, offline = False):
+    manifest = read_mirror_manifest(mirror_dir)
+
+    if offline:
+        entries = {}
+        for name in sources:
+            entry = manifest.get(name)
+            if not mirror_is_valid(mirror_dir, entry):
+                raise FileNotFoundError(f"No valid mirror copy of '{name}' in {mirror_dir}")
+            entries[name] = {**entry, "status": "offline"}
+        return entries
+
+    os.makedirs(mirror_dir, exist_ok = True)
+    loop = asyncio.get_running_loop()
+    names = list(sources)
+    results = await asyncio.gather(
+        *[loop.run_in_executor(None, fetch_source,
+                               sources[name][0], sources[name][1],
+                               mirror_dir, manifest.get(name))
+          for name in names],
+        return_exceptions = True)
+
+    entries = {}
+    errors = {}
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            errors[name] = result
+        else:
+            entries[name] = result
+            manifest[name] = {key: value for key, value in result.items()
+                              if key != "status"}
+    write_mirror_manifest(mirror_dir, manifest)
+
+    if errors:
+        name, error = next(iter(errors.items()))
+        raise RuntimeError(f"Fetching '{name}' failed: {error}") from error
+
+    return entries
+
+def fetch_all(sources = upstream_sources, mirror_dir = None, offline = False):
+    """
+    Fetches `sources`, a dict of name -> (url, filename), into the mirror.
+    Returns a dict of name -> mirror entry, with the "status" of each fetch.
+    """
+    if mirror_dir is None:
+        from Dynamic_Update import default_data_dir
+
+        mirror_dir = mirror_dir_for(default_data_dir)
+    return asyncio.run(fetch_all_async(sources, mirror_dir, offline))
+
+# Fetches a single source and returns the path of its mirror copy.
+
+def fetch_to_mirror(name, url, mirror_dir, offline = False):
+    filename = upstream_sources[name][1] if name in upstream_sources else name
+    entries = fetch_all({name: (url, filename)}, mirror_dir, offline)
+    return os.path.join(mirror_dir, entries[name]["file"]), entries[name]
+
+if __name__ == '__main__':
+    from Dynamic_Update import default_data_dir
+
+    parser = argparse.ArgumentParser(description = "Fetch the upstream sources into the local mirror")
+    parser.add_argument("--data-dir", default = default_data_dir)
+    parser.add_argument("--only", nargs = "+", choices = list(upstream_sources), default = None)
+    parser.add_argument("--source", nargs = "*", default = [], metavar = "NAME=URL",
+                        help = "override the URL or path of a source")
+    parser.add_argument("--offline", action = "store_true")
+    args = parser.parse_args()
+
+    sources = dict(upstream_sources)
+    for each_override in args.source:
+        name, url = each_override.split("=", 1)
+        sources[name] = (url, sources[name][1])
+    if args.only is not None:
+        sources = {name: sources[name] for name in args.only}
+
+    for name, entry in fetch_all(sources, mirror_dir_for(args.data_dir), args.offline).items():
+        print(f"{name:<10} {entry['status']:<10} {entry['size']:>12} bytes  {entry['sha256'][:12]}")
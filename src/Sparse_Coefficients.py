@@ -0,0 +1,298 @@
+## Sparse Region × Sector × Gas Coefficients
+
+# `df_estimate` keeps one dense row per country with a `{gas}_coef` and a
+#     `{gas}` baseline column for every gas. Crossing every region of the
+#     OECD tracker with the IPCC sectors leaves most (region, sector, gas)
+#     cells empty, so this store keeps only the populated cells.
+#
+# Regions, sectors and gases are integer coded by sorted dictionaries, and
+#     the cells are stored CSR-style, with one row per region:
+#       - `indptr[r]:indptr[r + 1]` are the cells of region r,
+#       - `cell_keys` holds sector*n_gases + gas of each cell, sorted
+#         within each region,
+#       - `coef` and `baseline` hold the elasticity and the annual
+#         baseline amount of each cell.
+#     Memory is O(regions + cells), and a lookup is one `searchsorted`
+#     over the populated cells. A cell is stored only when it has both a
+#     finite coefficient and a baseline amount.
+#
+# The estimators index the arrays directly, with the arithmetic of
+#     `estimate_weekly_emission` in the same order, so a store built from
+#     `df_estimate` gives bit-identical estimates.
+#
+# Usage, from the `src` directory:
+#     python Sparse_Coefficients.py build [--inventory inventory.parquet]
+#     python Sparse_Coefficients.py estimate
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from Elasticity_Model import read_inventory
+from Static_Fit import baseline_year, fit_grouped_ols
+from Weekly_Estimator import gh_gases
+
+# The sector of the national totals of `df_static` and `df_estimate`
+total_sector = "Total"
+
+class CoefficientStore:
+    """
+    Coefficients and baselines of the populated (region, sector, gas) cells
+    """
+
+    def __init__(self, regions, sectors, gases, indptr, cell_keys, coef, baseline):
+        self.regions = list(regions)
+        self.sectors = list(sectors)
+        self.gases = list(gases)
+        self.region_index = pd.Index(self.regions)
+        self.sector_position = {each: i for i, each in enumerate(self.sectors)}
+        self.gas_position = {each: i for i, each in enumerate(self.gases)}
+
+        self.indptr = np.asarray(indptr, dtype = np.int64)
+        self.cell_keys = np.asarray(cell_keys, dtype = np.int32)
+        self.coef = np.asarray(coef, dtype = np.float64)
+        self.baseline = np.asarray(baseline, dtype = np.float64)
+
+        # Region-major keys of every cell, sorted, for the lookups
+        cell_regions = np.repeat(np.arange(len(self.regions), dtype = np.int64),
+                                 np.diff(self.indptr))
+        self.keys = cell_regions*self.n_local + self.cell_keys
+
+    @property
+    def n_local(self):
+        return len(self.sectors)*len(self.gases)
+
+    @property
+    def n_cells(self):
+        return len(self.coef)
+
+    @property
+    def nbytes(self):
+        return sum(each.nbytes for each in (self.indptr, self.cell_keys, self.coef,
+                                            self.baseline, self.keys))
+
+    ### Construction
+
+    @classmethod
+    def from_cells(cls, df_cells):
+        """
+        Builds the store from a long frame with one row per cell and the
+        `Region`, `Sector`, `Gas`, `coef` and `baseline` columns
+        """
+        keep = np.isfinite(df_cells["coef"].to_numpy(dtype = np.float64)) & \
+               np.isfinite(df_cells["baseline"].to_numpy(dtype = np.float64))
+        df_cells = df_cells[keep]
+
+        region_codes, regions = pd.factorize(df_cells["Region"], sort = True)
+        sector_codes, sectors = pd.factorize(df_cells["Sector"], sort = True)
+        gas_codes, gases = pd.factorize(df_cells["Gas"], sort = True)
+
+        cell_keys = sector_codes.astype(np.int64)*len(gases) + gas_codes
+        order = np.lexsort((cell_keys, region_codes))
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(region_codes,
+                                                            minlength = len(regions)))])
+
+        return cls(regions, sectors, gases, indptr, cell_keys[order],
+                   df_cells["coef"].to_numpy(dtype = np.float64)[order],
+                   df_cells["baseline"].to_numpy(dtype = np.float64)[order])
+
+    @classmethod
+    def from_estimate(cls, df_estimate, gases = gh_gases, sector = total_sector):
+        """
+        Builds the store of the national totals of `df_estimate`
+        """
+        df_cells = pd.DataFrame({
+            "Region": np.repeat(df_estimate.index.to_numpy(dtype = object), len(gases)),
+            "Sector": sector,
+            "Gas": np.tile(np.asarray(gases, dtype = object), len(df_estimate)),
+            "coef": df_estimate[[f"{each_gas}_coef" for each_gas in gases]].to_numpy(
+                        dtype = np.float64).ravel(),
+            "baseline": df_estimate[gases].to_numpy(dtype = np.float64).ravel(),
+        })
+        return cls.from_cells(df_cells)
+
+    def to_frame(self):
+        sector_codes, gas_codes = np.divmod(self.cell_keys, len(self.gases))
+        return pd.DataFrame({
+            "Region": pd.Categorical.from_codes(
+                np.repeat(np.arange(len(self.regions)), np.diff(self.indptr)), self.regions),
+            "Sector": pd.Categorical.from_codes(sector_codes, self.sectors),
+            "Gas": pd.Categorical.from_codes(gas_codes, self.gases),
+            "coef": self.coef,
+            "baseline": self.baseline,
+        })
+
+    ### Lookups
+
+    def region_codes(self, regions):
+        """
+        Returns the code of each region name, -1 for regions without cells
+        """
+        return self.region_index.get_indexer(regions).astype(np.int64, copy = False)
+
+    def cell_index(self, region_codes, sector, gas):
+        """
+        Returns the cell of (region, sector, gas) for each region code,
+        -1 where the cell is not populated
+        """
+        if sector not in self.sector_position or gas not in self.gas_position:
+            return np.full(len(region_codes), -1, dtype = np.int64)
+
+        local_key = self.sector_position[sector]*len(self.gases) + self.gas_position[gas]
+        wanted = np.asarray(region_codes, dtype = np.int64)*self.n_local + local_key
+
+        cells = np.searchsorted(self.keys, wanted)
+        found = (np.asarray(region_codes) >= 0) & (cells < self.n_cells)
+        found[found] = self.keys[cells[found]] == wanted[found]
+        return np.where(found, cells, -1)
+
+    ### Persistence
+
+    def save(self, path):
+        meta = {"regions": self.regions, "sectors": self.sectors, "gases": self.gases}
+        with open(f"{path}.tmp", "wb") as store_file:
+            np.savez(store_file, indptr = self.indptr, cell_keys = self.cell_keys,
+                     coef = self.coef, baseline = self.baseline,
+                     meta = np.array(json.dumps(meta)))
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            meta = json.loads(str(arrays["meta"]))
+            return cls(meta["regions"], meta["sectors"], meta["gases"],
+                       arrays["indptr"], arrays["cell_keys"],
+                       arrays["coef"], arrays["baseline"])
+
+def coefficients_path(results_dir):
+    return os.path.join(results_dir, "coefficients.npz")
+
+### Fitting
+
+# The long inventory of the national totals of `df_static`.
+
+def static_inventory(df_static, gases = gh_gases, sector = total_sector):
+    df_inventory = df_static.melt(id_vars = ["Country", "Year", "GDP"], value_vars = gases,
+                                  var_name = "Gas", value_name = "Amount")
+    return df_inventory.rename(columns = {"Country": "Region"}).assign(Sector = sector)
+
+# Fits the log-log model of `Static_Fit.py` for every populated cell of a
+#     long inventory with the `Region`, `Sector`, `Gas`, `Year`, `Amount`
+#     and `GDP` columns, and keeps the `baseline_year` amounts as baselines.
+#     Rows without a positive amount are empty cells and are dropped first,
+#     so the fit only ever groups by the populated cells.
+
+def fit_sparse_coefficients(df_inventory, baseline_year = baseline_year):
+    amount = df_inventory["Amount"].to_numpy(dtype = np.float64)
+    gdp = df_inventory["GDP"].to_numpy(dtype = np.float64)
+    df_inventory = df_inventory[(amount > 0) & (gdp > 0)]
+
+    df_cells = df_inventory[["Region", "Sector", "Gas"]].drop_duplicates(ignore_index = True)
+    codes = pd.MultiIndex.from_frame(df_cells).get_indexer(
+        pd.MultiIndex.from_frame(df_inventory[["Region", "Sector", "Gas"]]))
+
+    x = np.log(df_inventory["Amount"].to_numpy(dtype = np.float64))[:, np.newaxis]
+    y = np.log(df_inventory["GDP"].to_numpy(dtype = np.float64))
+    fit = fit_grouped_ols(codes, x, y, len(df_cells))
+
+    in_baseline = (df_inventory["Year"] == baseline_year).to_numpy()
+    baseline = np.full(len(df_cells), np.nan)
+    baseline[codes[in_baseline]] = df_inventory["Amount"].to_numpy(dtype = np.float64)[in_baseline]
+
+    return CoefficientStore.from_cells(df_cells.assign(coef = fit["coef"][:, 0],
+                                                       baseline = baseline))
+
+### Estimators
+
+# The estimates of every populated cell of the region of each row of
+#     `df_weekly`, as a long frame with one row per (week row, cell).
+#     Rows of regions without cells give no estimate. The output size is
+#     the number of populated cells of the rows, and the cells of each row
+#     are gathered straight from the CSR ranges of its region.
+
+def estimate_weekly_cells(store, df_weekly):
+    codes = store.region_codes(df_weekly["Country"])
+    known = codes >= 0
+    starts = np.where(known, store.indptr[np.maximum(codes, 0)], 0)
+    counts = np.where(known, store.indptr[np.maximum(codes, 0) + 1] - starts, 0)
+
+    rows = np.repeat(np.arange(len(df_weekly)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cells = np.repeat(starts, counts) + offsets
+
+    change = df_weekly["GDP_Change"].to_numpy(dtype = np.float64)[rows]
+    amount_week = store.baseline[cells]*7/365
+    change_gh = change*store.coef[cells]
+    amount_week = amount_week*(1 + change_gh/100)
+
+    sector_codes, gas_codes = np.divmod(store.cell_keys[cells], len(store.gases))
+    return pd.DataFrame({
+        "Country": df_weekly["Country"].to_numpy()[rows],
+        "Week": df_weekly["Week"].to_numpy()[rows],
+        "Sector": pd.Categorical.from_codes(sector_codes, store.sectors),
+        "POL": pd.Categorical.from_codes(gas_codes, store.gases),
+        "GDP_Change": change,
+        "weekly": amount_week,
+        "change": change_gh,
+    })
+
+# The `{gas}_weekly` / `{gas}_change` columns of
+#     `estimate_weekly_emission_batch` for one sector. Cells that are not
+#     populated give NaN, and regions without any cell raise a KeyError.
+
+def estimate_weekly_sector(store, df_weekly, gases = gh_gases, sector = total_sector):
+    codes = store.region_codes(df_weekly["Country"])
+    if (codes < 0).any():
+        missing = df_weekly["Country"][codes < 0]
+        raise KeyError(f"No coefficients for {sorted(missing.unique())}")
+
+    change = df_weekly["GDP_Change"].to_numpy(dtype = np.float64)
+
+    df_result = df_weekly.copy()
+    for each_gas in gases:
+        cells = store.cell_index(codes, sector, each_gas)
+        found = cells >= 0
+        amount = np.where(found, store.baseline[np.maximum(cells, 0)], np.nan)
+        coef = np.where(found, store.coef[np.maximum(cells, 0)], np.nan)
+
+        amount_week = amount*7/365
+        change_gh = change*coef
+        amount_week = amount_week*(1 + change_gh/100)
+
+        df_result[f"{each_gas}_weekly"] = amount_week
+        df_result[f"{each_gas}_change"] = change_gh
+
+    return df_result
+
+if __name__ == '__main__':
+    from Dynamic_Update import default_results_dir
+
+    parser = argparse.ArgumentParser(description = "Sparse region, sector and gas coefficients")
+    parser.add_argument("command", choices = ["build", "estimate"])
+    parser.add_argument("--results-dir", default = default_results_dir)
+    parser.add_argument("--inventory", default = None,
+                        help = "with build, a parquet or csv file with Region, Sector, Gas, "
+                               "Year, Amount and GDP columns (default: the national totals "
+                               "of df_static)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if args.inventory is None:
+            df_inventory = static_inventory(
+                pd.read_parquet(os.path.join(args.results_dir, "df_static.parquet")))
+        else:
+            df_inventory = read_inventory(args.inventory)
+        store = fit_sparse_coefficients(df_inventory)
+        store.save(coefficients_path(args.results_dir))
+        print(store.to_frame())
+        print(f"{store.n_cells} cells of {len(store.regions)*store.n_local}, "
+              f"{store.nbytes} bytes")
+    else:
+        from Results_Dataset import open_weekly_dataset
+
+        store = CoefficientStore.load(coefficients_path(args.results_dir))
+        df_weekly = open_weekly_dataset(args.results_dir).read()
+        print(estimate_weekly_cells(store, df_weekly[["Country", "Week", "GDP_Change"]]))
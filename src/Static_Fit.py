@@ -0,0 +1,122 @@
+## Static Model Fitting
+
+# Batched closed-form log-log regressions for every (country, gas) pair,
+#     replacing the per-pair `LinearRegression` loop of the Static Model notebook.
+#
+# As in the notebook, the regression for each gas is
+#     log(GDP) = intercept + coef * log(gas)
+# fitted separately for every country over the static years,
+#     and the 2019 emissions are kept as the baseline amounts.
+#
+# Every slope is computed at once from grouped sums of centered values:
+#     coef = Sxy / Sxx,   with Sxy = sum((x - x_mean)(y - y_mean)) per group,
+#     so the fit is a handful of `np.bincount` calls whatever the number
+#     of groups and gases, and sklearn is not needed.
+#
+# Usage, from the `src` directory:
+#     python Static_Fit.py [--results-dir DIR]
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from Weekly_Estimator import gh_gases
+
+baseline_year = 2019
+
+# Grouped sums of the columns of `values` (n_rows, n_cols) by integer group codes.
+
+def grouped_sum(codes, values, n_groups):
+    return np.column_stack([np.bincount(codes, weights = values[:, each],
+                                        minlength = n_groups)
+                            for each in range(values.shape[1])])
+
+# Fits y = intercept + coef * x for every group and every column of `x`.
+#     `codes` holds the group code of each row, `x` is (n_rows, n_cols)
+#     and `y` is (n_rows,). Returns a dict of (n_groups, n_cols) arrays.
+
+def fit_grouped_ols(codes, x, y, n_groups):
+    y = np.broadcast_to(y[:, np.newaxis], x.shape)
+    ones = np.ones((len(codes), 1))
+
+    n = grouped_sum(codes, ones, n_groups)
+    x_mean = grouped_sum(codes, x, n_groups)/n
+    y_mean = grouped_sum(codes, y, n_groups)/n
+
+    x_centered = x - x_mean[codes]
+    y_centered = y - y_mean[codes]
+
+    s_xx = grouped_sum(codes, x_centered*x_centered, n_groups)
+    s_xy = grouped_sum(codes, x_centered*y_centered, n_groups)
+    s_yy = grouped_sum(codes, y_centered*y_centered, n_groups)
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        coef = s_xy/s_xx
+        intercept = y_mean - coef*x_mean
+        rss = np.maximum(s_yy - coef*s_xy, 0)
+        std_err = np.sqrt(rss/(n - 2)/s_xx)
+        r2 = 1 - rss/s_yy
+
+    return {"n": np.broadcast_to(n, coef.shape),
+            "coef": coef,
+            "intercept": intercept,
+            "std_err": std_err,
+            "r2": r2}
+
+# Fits the static model on `df_static`.
+#     Returns `df_estimate`, indexed by country with the `{gas}_coef` columns
+#     followed by the baseline `{gas}` amounts, and `df_fit` with one row per
+#     (country, gas) holding the intercept, standard error and R² of each fit.
+
+def fit_static_model(df_static, gases = gh_gases):
+    codes, countries = pd.factorize(df_static["Country"], sort = True)
+    x = np.log(df_static[gases].to_numpy(dtype = np.float64))
+    y = np.log(df_static["GDP"].to_numpy(dtype = np.float64))
+
+    fit = fit_grouped_ols(codes, x, y, len(countries))
+
+    df_fit = pd.DataFrame({
+        "Country": np.repeat(np.asarray(countries), len(gases)),
+        "POL": np.tile(gases, len(countries)),
+        **{name: values.ravel() for name, values in fit.items()},
+    })
+    df_fit["n"] = df_fit["n"].astype(int)
+
+    df_coef = pd.DataFrame(fit["coef"],
+                           index = pd.Index(countries, name = "Country"),
+                           columns = [f"{each_gas}_coef" for each_gas in gases])
+    df_coef = df_coef[sorted(df_coef.columns)]
+
+    df_prepandemic = df_static[df_static["Year"] == baseline_year]
+    df_prepandemic = df_prepandemic.set_index("Country")[gases]
+
+    df_estimate = df_coef.join(df_prepandemic, how = "inner")
+
+    return df_estimate, df_fit
+
+def write_static_model(results_dir):
+    df_static = pd.read_parquet(os.path.join(results_dir, "df_static.parquet"))
+    df_estimate, df_fit = fit_static_model(df_static)
+
+    df_estimate.to_parquet(os.path.join(results_dir, "df_estimate.parquet"))
+    df_fit.to_parquet(os.path.join(results_dir, "df_fit.parquet"))
+
+    return df_estimate, df_fit
+
+if __name__ == '__main__':
+    from Dynamic_Update import default_results_dir, write_results_version
+
+    parser = argparse.ArgumentParser(description = "Fit the static log-log model")
+    parser.add_argument("--results-dir", default = default_results_dir)
+    args = parser.parse_args()
+
+    from Results_Arrow import publish_arrow_results
+
+    df_estimate, df_fit = write_static_model(args.results_dir)
+    publish_arrow_results(args.results_dir, ["df_estimate"])
+    print(df_estimate)
+    print(df_fit)
+    print('results version')
+    print(write_results_version(args.results_dir))
@@ -0,0 +1,154 @@
+## Streaming Update
+
+# A chunked version of the daily update for long histories and many regions.
+#     The tracker cache is read in batches of bounded size, and every batch
+#     goes through filter -> estimate -> append before the next one is read,
+#     so peak memory depends on the batch size, not on the history length.
+#
+# Every region with coefficients in `df_estimate` is estimated, for every
+#     week after `since`. The weekly partitions up to `since` are kept; the
+#     weeks after it are recomputed and written as new partitions, chunk by
+#     chunk. The weekly cube is rebuilt in a temporary directory and swapped
+#     in at the end.
+#
+# Usage, from the `src` directory:
+#     python Dynamic_Update.py --stream --since 2019-12-31
+
+import os
+import shutil
+
+import pandas as pd
+
+import Dynamic_Update
+from Results_Dataset import open_weekly_dataset
+from Tracker_Ingest import iter_tracker_batches
+from Weekly_Cube import WeeklyCube, cube_dir_for, open_weekly_cube
+from Weekly_Estimator import (gh_gases,
+                              estimate_weekly_emission_batch,
+                              estimate_weekly_emission_dated)
+
+# Rows of the same week may be split across two batches.
+#     This generator holds back the rows of the latest week of each batch
+#     until the next batch, so every yielded frame has complete weeks only.
+
+def iter_complete_weeks(frames):
+    held = None
+    for df_frame in frames:
+        if held is not None:
+            df_frame = pd.concat([held, df_frame], ignore_index = True)
+        if df_frame.empty:
+            held = None
+            continue
+
+        latest = df_frame["Week"].max()
+        is_latest = (df_frame["Week"] == latest).to_numpy()
+        held = df_frame[is_latest]
+        if not is_latest.all():
+            yield df_frame[~is_latest].sort_values("Week", kind = "stable",
+                                                   ignore_index = True)
+
+    if held is not None and not held.empty:
+        yield held.reset_index(drop = True)
+
+# The filter -> estimate stages for one batch of tracker rows.
+
+def estimate_batch(df_batch, df_estimate, countries_list, start_week, df_elasticity = None):
+    df_weekly = Dynamic_Update.select_tracker_rows(df_batch, countries_list,
+                                                   start_week = start_week)
+    if df_weekly.empty:
+        return df_weekly
+    if df_elasticity is not None:
+        return estimate_weekly_emission_dated(df_estimate, df_elasticity, df_weekly, gh_gases)
+    return estimate_weekly_emission_batch(df_estimate, df_weekly, gh_gases)
+
+def run_streaming_update(data_dir = Dynamic_Update.default_data_dir,
+                         results_dir = Dynamic_Update.default_results_dir,
+                         source = Dynamic_Update.dynamic_data_link,
+                         since = None,
+                         batch_rows = 65536,
+                         verbose = True,
+                         profile_path = None,
+                         offline = False,
+                         precompute = True,
+                         export_dir = Dynamic_Update.default_export_dir):
+    from Pipeline_Profiler import RunProfiler
+
+    log = print if verbose else (lambda *args: None)
+    profiler = RunProfiler(log_path = Dynamic_Update.run_log_path(data_dir),
+                           profile_path = profile_path,
+                           verbose = verbose)
+
+    with profiler.stage("download") as stage:
+        workbook_bytes = Dynamic_Update.download_tracker(source, data_dir, offline)
+        stage["bytes"] = len(workbook_bytes)
+
+    with profiler.stage("read_excel") as stage:
+        tracker_changed = Dynamic_Update.convert_tracker(workbook_bytes, data_dir)
+        stage["tracker_changed"] = tracker_changed
+    log('tracker_changed')
+    log(tracker_changed)
+
+    df_estimate = pd.read_parquet(os.path.join(results_dir, "df_estimate.parquet"))
+    countries_list = df_estimate.index.tolist()
+    df_elasticity = Dynamic_Update.read_elasticities(results_dir)
+
+    weekly_cube = open_weekly_cube(results_dir)
+    if since is None:
+        since = weekly_cube.latest_week()
+    log('since')
+    log(since)
+
+    weekly_dataset = open_weekly_dataset(results_dir)
+
+    cube_dir = cube_dir_for(results_dir)
+    new_cube_dir = f"{cube_dir}.tmp"
+    shutil.rmtree(new_cube_dir, ignore_errors = True)
+    new_cube = WeeklyCube.build(pd.DataFrame(columns = ["Country", "Week"]),
+                                new_cube_dir,
+                                countries = weekly_cube.countries + countries_list)
+
+    with profiler.stage("keep") as stage:
+        n_kept = 0
+        for df_partition in weekly_dataset.iter_partitions(end = since):
+            new_cube.append(df_partition)
+            n_kept += len(df_partition)
+        stage["rows_out"] = n_kept
+
+    tracker_batches = iter_tracker_batches(Dynamic_Update.tracker_cache_path(data_dir),
+                                           since = since, batch_rows = batch_rows)
+    new_frames = iter_complete_weeks(estimate_batch(df_batch, df_estimate,
+                                                    countries_list, since,
+                                                    df_elasticity)
+                                     for df_batch in tracker_batches)
+
+    # Reading, filtering, estimation and writing are interleaved batch by
+    #     batch here, so they are measured together as one stage.
+    with profiler.stage("stream") as stage:
+        n_new = 0
+        for df_frame in new_frames:
+            weekly_dataset.append(df_frame)
+            new_cube.append(df_frame)
+            n_new += len(df_frame)
+        stage["rows_out"] = n_new
+
+    with profiler.stage("swap_cube"):
+        shutil.rmtree(f"{cube_dir}.old", ignore_errors = True)
+        os.rename(cube_dir, f"{cube_dir}.old")
+        os.rename(new_cube_dir, cube_dir)
+        shutil.rmtree(f"{cube_dir}.old")
+
+    log(f"{n_kept} rows kept, {n_new} rows estimated")
+    if n_new:
+        with profiler.stage("arrow"):
+            from Results_Arrow import publish_arrow_results
+
+            publish_arrow_results(results_dir)
+        log('results version')
+        log(Dynamic_Update.write_results_version(results_dir))
+        if precompute:
+            Dynamic_Update.start_figure_precompute(results_dir, data_dir, export_dir)
+
+    profiler.finish(mode = "stream", since = since, rows_updated = n_new)
+    log('all done')
+
+    return n_new
@@ -0,0 +1,109 @@
+## Ingestion of the OECD Weekly Tracker
+
+# Parsing the tracker workbook with `pd.read_excel` is by far
+#     the slowest step of the daily update. The workbook is therefore
+#     converted once into a columnar parquet cache, sorted by date,
+#     and the pipeline only reads the columns and the weeks it needs
+#     from that cache. The workbook is parsed again only when its
+#     content hash differs from the one recorded in the cache.
+
+import hashlib
+import io
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+tracker_columns = ['region', 'date', 'Tracker (yo2y)']
+
+# Small row groups keep the date statistics selective,
+#     so reads of the recent weeks skip most of the file.
+tracker_row_group_size = 4096
+
+source_hash_key = b"ghg.source_sha256"
+
+# The content hash of the workbook the cache at `cache_path` was built from,
+#     or None when there is no cache yet.
+
+def cached_source_hash(cache_path):
+    if not os.path.exists(cache_path):
+        return None
+    metadata = pq.read_schema(cache_path).metadata or {}
+    value = metadata.get(source_hash_key)
+    return value.decode() if value is not None else None
+
+# Parses the workbook and writes it to `cache_path` as parquet,
+#     sorted by date and recording the content hash in the file metadata.
+#     The file is written next to the cache and renamed into place,
+#     so readers never see a partially written cache.
+
+def write_tracker_cache(workbook_bytes, cache_path, source_hash):
+    df_tracker = pd.read_excel(io.BytesIO(workbook_bytes))
+    df_tracker = df_tracker.sort_values(["date", "region"], kind = "stable")
+    df_tracker = df_tracker.reset_index(drop = True)
+
+    table = pa.Table.from_pandas(df_tracker, preserve_index = False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[source_hash_key] = source_hash.encode()
+    table = table.replace_schema_metadata(metadata)
+
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok = True)
+    pq.write_table(table, f"{cache_path}.tmp",
+                   row_group_size = tracker_row_group_size)
+    os.replace(f"{cache_path}.tmp", cache_path)
+
+# Makes sure the cache at `cache_path` reflects the workbook `workbook_bytes`.
+#     Returns True when the workbook changed and the cache was rebuilt.
+
+def refresh_tracker_cache(workbook_bytes, cache_path):
+    source_hash = hashlib.sha256(workbook_bytes).hexdigest()
+
+    if cached_source_hash(cache_path) == source_hash:
+        return False
+
+    write_tracker_cache(workbook_bytes, cache_path, source_hash)
+    return True
+
+# Reads the tracker cache, keeping only `columns`
+#     and the rows dated strictly after `since` (a "YYYY-MM-DD" string).
+#     Both restrictions are pushed down to the parquet reader.
+
+def read_tracker(cache_path, columns = tracker_columns, since = None):
+    filters = None
+    if since is not None:
+        filters = [("date", ">", pd.Timestamp(since))]
+    table = pq.read_table(cache_path, columns = columns, filters = filters)
+    return table.to_pandas()
+
+# Iterates over the tracker cache in batches of at most `batch_rows` rows,
+#     keeping only `columns` and the rows dated strictly after `since`.
+#     Row groups whose dates are all older than `since` are skipped using
+#     the parquet statistics, and the region column is read as a
+#     categorical, so memory stays bounded by the batch size.
+
+def iter_tracker_batches(cache_path, columns = tracker_columns, since = None,
+                         batch_rows = 65536):
+    parquet_file = pq.ParquetFile(cache_path, read_dictionary = ["region"])
+    since = None if since is None else pd.Timestamp(since)
+
+    date_column = parquet_file.schema_arrow.get_field_index("date")
+    row_groups = []
+    for i in range(parquet_file.metadata.num_row_groups):
+        statistics = parquet_file.metadata.row_group(i).column(date_column).statistics
+        if (since is not None and statistics is not None and statistics.has_min_max
+                and pd.Timestamp(statistics.max) <= since):
+            continue
+        row_groups.append(i)
+
+    if not row_groups:
+        return
+
+    for batch in parquet_file.iter_batches(batch_size = batch_rows,
+                                           row_groups = row_groups,
+                                           columns = columns):
+        df_batch = batch.to_pandas()
+        if since is not None:
+            df_batch = df_batch[df_batch["date"] > since]
+        if not df_batch.empty:
+            yield df_batch
@@ -1,10 +1,32 @@
+import argparse
 import time
-import os
+import traceback
 
-update_command = """python Dynamic_Update.py"""
+import Dynamic_Update
 
-for each_day in range(7):
-    os.system(update_command)
-    time.sleep(24*60*60)
-    
-    
\ No newline at end of file
+# Runs the daily update in this process, once a day for `n_days` days.
+#     The pipeline module is imported once, so each run skips the
+#     interpreter and pandas start-up that a fresh process would pay.
+
+def run_schedule(n_days = 7, interval = 24*60*60, **update_kwargs):
+    for each_day in range(n_days):
+        try:
+            Dynamic_Update.run_update(**update_kwargs)
+        except Exception:
+            traceback.print_exc()
+        if each_day < n_days - 1:
+            time.sleep(interval)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Run the daily update on a schedule")
+    parser.add_argument("--days", type = int, default = 7)
+    parser.add_argument("--interval", type = float, default = 24*60*60,
+                        help = "seconds between runs")
+    parser.add_argument("--data-dir", default = Dynamic_Update.default_data_dir)
+    parser.add_argument("--results-dir", default = Dynamic_Update.default_results_dir)
+    args = parser.parse_args()
+
+    run_schedule(n_days = args.days,
+                 interval = args.interval,
+                 data_dir = args.data_dir,
+                 results_dir = args.results_dir)
@@ -0,0 +1,292 @@
+## Weekly Results Cube
+
+# A dense, memory-mapped copy of the weekly results indexed by
+#     (week, country, gas, metric), stored next to them in
+#     `results/df_weekly_cube/`:
+#       - values.npy      float64 (week capacity, country, gas, metric)
+#       - gdp_change.npy  float64 (week capacity, country)
+#       - index.json      weeks, countries, gases, metrics and week count
+#
+# The week axis is allocated with spare capacity that doubles when full,
+#     so appending a week writes only that week's slice. Weeks are kept
+#     sorted and append-only, so the latest week and the position of any
+#     week are constant-time lookups, and time ranges are array slices.
+#     `index.json` is replaced last on every write, and readers only look
+#     at the first `n_weeks` rows, so a reader never sees a partial week.
+#     A whole cube, such as a rebuild for new countries, is written to
+#     `<cube dir>.tmp` and swapped in when complete, so a crash never
+#     leaves an empty or partial cube in place.
+#
+# Usage, from the `src` directory:
+#     python Weekly_Cube.py build [--results-dir DIR]
+
+import argparse
+import bisect
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from Results_Dataset import open_weekly_dataset
+from Weekly_Estimator import gh_gases
+
+metrics = ["weekly", "change"]
+
+initial_week_capacity = 64
+
+class WeeklyCube:
+    """
+    Dense (week, country, gas, metric) array of the weekly estimates
+    """
+
+    def __init__(self, cube_dir, mode = "r"):
+        self.cube_dir = cube_dir
+        self.mode = mode
+
+        with open(os.path.join(cube_dir, "index.json")) as index_file:
+            index = json.load(index_file)
+
+        self.weeks = index["weeks"]
+        self.countries = index["countries"]
+        self.gases = index["gases"]
+        self.metrics = index["metrics"]
+        self.n_weeks = len(self.weeks)
+
+        self.week_position = {week: i for i, week in enumerate(self.weeks)}
+        self.country_position = {country: i for i, country in enumerate(self.countries)}
+        self.gas_position = {gas: i for i, gas in enumerate(self.gases)}
+        self.metric_position = {metric: i for i, metric in enumerate(self.metrics)}
+
+        self._values = np.load(os.path.join(cube_dir, "values.npy"), mmap_mode = mode)
+        self._gdp_change = np.load(os.path.join(cube_dir, "gdp_change.npy"), mmap_mode = mode)
+
+    ### Building and appending
+
+    @classmethod
+    def build(cls, df_weekly, cube_dir, gases = gh_gases, countries = None):
+        """
+        Writes a new cube for `df_weekly` to `cube_dir` and opens it for appending.
+        `countries` reserves columns for countries that are not in `df_weekly` yet.
+        """
+        weeks = sorted(df_weekly["Week"].unique().tolist())
+        countries = sorted(set(df_weekly["Country"].tolist()) | set(countries or []))
+        capacity = max(initial_week_capacity, 2*len(weeks))
+
+        os.makedirs(cube_dir, exist_ok = True)
+        np.lib.format.open_memmap(os.path.join(cube_dir, "values.npy"), mode = "w+",
+                                  dtype = np.float64,
+                                  shape = (capacity, len(countries),
+                                           len(gases), len(metrics)))[:] = np.nan
+        np.lib.format.open_memmap(os.path.join(cube_dir, "gdp_change.npy"), mode = "w+",
+                                  dtype = np.float64,
+                                  shape = (capacity, len(countries)))[:] = np.nan
+        write_index(cube_dir, [], countries, gases, metrics)
+
+        cube = cls(cube_dir, mode = "r+")
+        cube.append(df_weekly)
+        return cube
+
+    def append(self, df_update):
+        """
+        Adds the rows of `df_update`, whose weeks must all be newer than the
+        latest week in the cube. Rebuilds the cube if new countries appear.
+        """
+        if df_update.empty:
+            return self
+
+        new_weeks = sorted(df_update["Week"].unique().tolist())
+        if self.n_weeks and new_weeks[0] <= self.latest_week():
+            raise ValueError(f"Week {new_weeks[0]} is not newer than {self.latest_week()}")
+
+        if not set(df_update["Country"]).issubset(self.country_position):
+            df_all = pd.concat([self.to_frame(), df_update], ignore_index = True)
+            self._rebuild(df_all)
+            return self
+
+        if self.n_weeks + len(new_weeks) > self._values.shape[0]:
+            self._grow(2*(self.n_weeks + len(new_weeks)))
+
+        week_rows = self.n_weeks + np.searchsorted(new_weeks, df_update["Week"].to_numpy())
+        self._write_rows(week_rows, df_update)
+
+        weeks = self.weeks + new_weeks
+        write_index(self.cube_dir, weeks, self.countries, self.gases, self.metrics)
+        self.weeks = weeks
+        self.n_weeks = len(weeks)
+        self.week_position.update({week: self.n_weeks - len(new_weeks) + i
+                                   for i, week in enumerate(new_weeks)})
+        return self
+
+    def update(self, df_rows):
+        """
+        Overwrites the rows of `df_rows` whose weeks are already in the cube,
+        and appends the rows of newer weeks.
+        """
+        stored = df_rows["Week"].isin(self.week_position).to_numpy()
+        df_stored = df_rows[stored]
+
+        if not df_stored.empty:
+            if not set(df_stored["Country"]).issubset(self.country_position):
+                df_all = pd.concat([self.to_frame(), df_stored], ignore_index = True)
+                df_all = df_all.drop_duplicates(["Country", "Week"], keep = "last")
+                self._rebuild(df_all)
+            else:
+                week_rows = df_stored["Week"].map(self.week_position).to_numpy()
+                self._write_rows(week_rows, df_stored)
+
+        return self.append(df_rows[~stored])
+
+    def _rebuild(self, df_all):
+        replace_cube(df_all, self.cube_dir, self.gases, self.countries)
+        self.__dict__.update(WeeklyCube(self.cube_dir, mode = "r+").__dict__)
+
+    def _write_rows(self, week_rows, df_rows):
+        country_columns = df_rows["Country"].map(self.country_position).to_numpy()
+
+        columns = [f"{each_gas}_{each_metric}"
+                   for each_gas in self.gases
+                   for each_metric in self.metrics]
+        values = df_rows[columns].to_numpy(dtype = np.float64)
+        values = values.reshape(len(df_rows), len(self.gases), len(self.metrics))
+
+        self._values[week_rows, country_columns] = values
+        self._gdp_change[week_rows, country_columns] = \
+            df_rows["GDP_Change"].to_numpy(dtype = np.float64)
+        self._values.flush()
+        self._gdp_change.flush()
+
+    def _grow(self, capacity):
+        for name, array in (("values.npy", self._values),
+                            ("gdp_change.npy", self._gdp_change)):
+            path = os.path.join(self.cube_dir, name)
+            grown = np.lib.format.open_memmap(f"{path}.tmp", mode = "w+",
+                                              dtype = np.float64,
+                                              shape = (capacity,) + array.shape[1:])
+            grown[:] = np.nan
+            grown[:self.n_weeks] = array[:self.n_weeks]
+            grown.flush()
+            del grown
+            os.replace(f"{path}.tmp", path)
+
+        self._values = np.load(os.path.join(self.cube_dir, "values.npy"), mmap_mode = "r+")
+        self._gdp_change = np.load(os.path.join(self.cube_dir, "gdp_change.npy"), mmap_mode = "r+")
+
+    ### Lookups
+
+    def latest_week(self):
+        return self.weeks[self.n_weeks - 1] if self.n_weeks else None
+
+    def lookup(self, week, country, gas, metric = "weekly"):
+        """
+        Returns a single estimate, e.g. lookup("2021-11-07", "Japan", "CO2")
+        """
+        return float(self._values[self.week_position[week],
+                                  self.country_position[country],
+                                  self.gas_position[gas],
+                                  self.metric_position[metric]])
+
+    def week_range(self, start = None, end = None):
+        """
+        Returns the slice of week positions with start <= week <= end
+        """
+        weeks = self.weeks
+        first = 0 if start is None else bisect.bisect_left(weeks, start)
+        last = self.n_weeks if end is None else bisect.bisect_right(weeks, end)
+        return slice(first, last)
+
+    def gas_view(self, gas, metric = "weekly", start = None, end = None):
+        """
+        Returns a (week, country) view of one gas and metric
+        """
+        return self._values[self.week_range(start, end), :,
+                            self.gas_position[gas], self.metric_position[metric]]
+
+    def time_slice(self, start = None, end = None):
+        """
+        Returns the (week, country, gas, metric) view for start <= week <= end
+        """
+        return self._values[self.week_range(start, end)]
+
+    def to_frame(self, start = None, end = None):
+        """
+        Returns the cube as a long frame with the columns of `df_weekly`
+        """
+        weeks_slice = self.week_range(start, end)
+        weeks = self.weeks[weeks_slice]
+        values = self._values[weeks_slice]
+        gdp_change = self._gdp_change[weeks_slice]
+
+        present = ~np.isnan(values).all(axis = (2, 3))
+        week_rows, country_columns = np.nonzero(present)
+
+        df_frame = pd.DataFrame({
+            "Country": np.asarray(self.countries, dtype = object)[country_columns],
+            "Week": np.asarray(weeks, dtype = object)[week_rows],
+            "GDP_Change": gdp_change[week_rows, country_columns],
+        })
+        for g, each_gas in enumerate(self.gases):
+            for m, each_metric in enumerate(self.metrics):
+                df_frame[f"{each_gas}_{each_metric}"] = \
+                    values[week_rows, country_columns, g, m]
+
+        return df_frame.sort_values(["Country", "Week"], kind = "stable",
+                                    ignore_index = True)
+
+    def iter_frames(self, start = None, end = None, weeks_per_chunk = 52):
+        """
+        Yields the long frame for start <= week <= end, `weeks_per_chunk` weeks at a time
+        """
+        weeks_slice = self.week_range(start, end)
+        for first in range(weeks_slice.start, weeks_slice.stop, weeks_per_chunk):
+            last = min(first + weeks_per_chunk, weeks_slice.stop) - 1
+            yield self.to_frame(self.weeks[first], self.weeks[last])
+
+def write_index(cube_dir, weeks, countries, gases, metrics):
+    index_path = os.path.join(cube_dir, "index.json")
+    with open(f"{index_path}.tmp", "w") as index_file:
+        json.dump({"weeks": weeks,
+                   "countries": countries,
+                   "gases": gases,
+                   "metrics": metrics}, index_file)
+    os.replace(f"{index_path}.tmp", index_path)
+
+def cube_dir_for(results_dir):
+    return os.path.join(results_dir, "df_weekly_cube")
+
+# Builds the cube of `df_weekly` next to `cube_dir` and swaps it into place.
+
+def replace_cube(df_weekly, cube_dir, gases = gh_gases, countries = None):
+    new_cube_dir = f"{cube_dir}.tmp"
+    shutil.rmtree(new_cube_dir, ignore_errors = True)
+    WeeklyCube.build(df_weekly, new_cube_dir, gases, countries)
+
+    shutil.rmtree(f"{cube_dir}.old", ignore_errors = True)
+    if os.path.exists(cube_dir):
+        os.rename(cube_dir, f"{cube_dir}.old")
+    os.rename(new_cube_dir, cube_dir)
+    shutil.rmtree(f"{cube_dir}.old", ignore_errors = True)
+
+# Opens the cube next to the weekly results,
+#     building it from the weekly dataset the first time.
+
+def open_weekly_cube(results_dir, mode = "r+"):
+    cube_dir = cube_dir_for(results_dir)
+    if not os.path.exists(os.path.join(cube_dir, "index.json")):
+        replace_cube(open_weekly_dataset(results_dir).read(), cube_dir)
+    return WeeklyCube(cube_dir, mode = mode)
+
+if __name__ == '__main__':
+    from Dynamic_Update import default_results_dir
+
+    parser = argparse.ArgumentParser(description = "Build the weekly results cube")
+    parser.add_argument("command", choices = ["build"])
+    parser.add_argument("--results-dir", default = default_results_dir)
+    args = parser.parse_args()
+
+    df_weekly = open_weekly_dataset(args.results_dir).read()
+    replace_cube(df_weekly, cube_dir_for(args.results_dir))
+    cube = WeeklyCube(cube_dir_for(args.results_dir))
+    print(f"{cube.n_weeks} weeks, {len(cube.countries)} countries, "
+          f"latest {cube.latest_week()}")
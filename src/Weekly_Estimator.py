@@ -0,0 +1,119 @@
+## Weekly Greenhouse Gas Estimators
+
+import numpy as np
+import pandas as pd
+
+gh_gases = ['GHG', 'CO2', 'CH4', 'N2O', 'HFC', 'PFC', 'SF6']
+
+# The estimate for a single (country, gas, GDP change) triple.
+#     `df_estimate` is indexed by country and holds the annual baseline
+#     amount in the `{gas}` column and the log-log GDP elasticity
+#     in the `{gas}_coef` column.
+
+def estimate_weekly_emission(df_estimate, country_name, gas_name, change):
+    amount = df_estimate.loc[country_name, gas_name]
+    amount_week = amount*7/365
+
+    coef = df_estimate.loc[country_name, f"{gas_name}_coef"]
+    change_gh = change*coef
+
+    amount_week = amount_week*(1 + change_gh/100)
+
+    return amount_week, change_gh
+
+# The same estimate for a whole weekly frame at once.
+#     The coefficients and the baselines are looked up once per row
+#     with a single reindex, and every `{gas}_weekly` / `{gas}_change`
+#     column is computed as a NumPy array operation.
+#     The arithmetic is performed in the same order as in
+#     `estimate_weekly_emission`, so the results are bit-identical.
+
+def estimate_weekly_emission_batch(df_estimate, df_weekly, gases = gh_gases,
+                                   df_coef = None):
+    countries = df_weekly["Country"]
+    missing = ~countries.isin(df_estimate.index)
+    if missing.any():
+        raise KeyError(f"No estimate for {sorted(countries[missing].unique())}")
+
+    df_lookup = df_estimate.reindex(countries)
+    if df_coef is None:
+        df_coef = df_lookup
+    change = df_weekly["GDP_Change"].to_numpy(dtype = np.float64)
+
+    df_result = df_weekly.copy()
+    for each_gas in gases:
+        amount = df_lookup[each_gas].to_numpy(dtype = np.float64)
+        coef = df_coef[f"{each_gas}_coef"].to_numpy(dtype = np.float64)
+
+        amount_week = amount*7/365
+        change_gh = change*coef
+        amount_week = amount_week*(1 + change_gh/100)
+
+        df_result[f"{each_gas}_weekly"] = amount_week
+        df_result[f"{each_gas}_change"] = change_gh
+
+    return df_result
+
+# The coefficients of each row of `df_weekly` from the time-varying
+#     elasticities of `Elasticity_Model.py`: a week uses the coefficients
+#     fitted through the latest inventory year before its own year, and
+#     weeks before the first fitted year use the first fit. Countries
+#     without time-varying coefficients, or a gas without a fit yet, keep
+#     the static coefficient of `df_estimate`. Returns a frame aligned
+#     with the rows of `df_weekly`.
+
+def dated_coefficients(df_estimate, df_elasticity, df_weekly, gases = gh_gases):
+    coef_columns = [f"{each_gas}_coef" for each_gas in gases]
+
+    df_rows = pd.DataFrame({
+        "row": np.arange(len(df_weekly)),
+        "Country": df_weekly["Country"].to_numpy(),
+        "Year": pd.to_datetime(df_weekly["Week"]).dt.year.to_numpy(dtype = np.int64) - 1,
+    }).astype({"Country": str}).sort_values("Year", kind = "stable")
+    df_fits = df_elasticity[["Country", "Year"] + coef_columns]
+    df_fits = df_fits.astype({"Country": str, "Year": np.int64}).sort_values("Year")
+    # A year without a fit yet takes the first later fit of its country
+    df_fits[coef_columns] = df_fits.groupby("Country")[coef_columns].bfill()
+
+    df_coef = pd.merge_asof(df_rows, df_fits, on = "Year", by = "Country",
+                            direction = "backward")
+    df_first = pd.merge_asof(df_rows, df_fits, on = "Year", by = "Country",
+                             direction = "forward")
+    df_coef = df_coef.set_index("row").sort_index()
+    df_first = df_first.set_index("row").sort_index()
+
+    df_static = df_estimate.reindex(df_weekly["Country"])[coef_columns].to_numpy(dtype = np.float64)
+    coef = df_coef[coef_columns].to_numpy(dtype = np.float64)
+    coef = np.where(np.isnan(coef), df_first[coef_columns].to_numpy(dtype = np.float64), coef)
+    coef = np.where(np.isnan(coef), df_static, coef)
+
+    return pd.DataFrame(coef, columns = coef_columns)
+
+# The batch estimate with the coefficients matching the date of each week.
+#     The 2019 baselines of `df_estimate` are kept, since the tracker
+#     changes are relative to the pre-pandemic year.
+
+def estimate_weekly_emission_dated(df_estimate, df_elasticity, df_weekly, gases = gh_gases):
+    df_coef = dated_coefficients(df_estimate, df_elasticity, df_weekly, gases)
+    return estimate_weekly_emission_batch(df_estimate, df_weekly, gases, df_coef = df_coef)
+
+# The row-by-row reference implementation used by the pipeline before
+#     the batch estimator. Kept for comparisons and benchmarks.
+
+def estimate_weekly_emission_loop(df_estimate, df_weekly, gases = gh_gases):
+    df_result = df_weekly.copy()
+
+    for each_gas in gases:
+        df_result[f"{each_gas}_weekly"] = 0.0
+        df_result[f"{each_gas}_change"] = 0.0
+
+    for each_gas in gases:
+        for index, row in df_result.iterrows():
+            amount_week, change_gh = estimate_weekly_emission(df_estimate,
+                                                              row["Country"],
+                                                              each_gas,
+                                                              row["GDP_Change"])
+            df_result.loc[index, f"{each_gas}_weekly"] = amount_week
+            df_result.loc[index, f"{each_gas}_change"] = change_gh
+
+    return df_result
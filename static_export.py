@@ -0,0 +1,251 @@
+import argparse
+import html
+import json
+import os
+import re
+import shutil
+import textwrap
+
+import plotly.offline
+
+from figure_cache import FigureDiskCache
+from figure_precompute import figure_kinds, figures_dir, precompute_figures
+from results_store import default_results_dir, gh_gases
+
+#####################################################################
+#
+# static export
+#
+#####################################################################
+
+# The dashboard as a static bundle that any static host or CDN can serve:
+#
+#     index.html            the page, rendered from `app.layout`
+#     assets/               the app assets
+#     figures/<kind>-<gas>.json
+#                           the prepared figures, fetched on first use
+#     plotly.min.js         unless the page loads plotly.js from its CDN
+#
+# The gas radio buttons switch figures in the browser. The date range and
+# resolution controls need the server, so they are not exported; the
+# weekly chart shows its default view.
+
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Parts of the layout that only work with the Dash server
+server_only_ids = {'weekly_query_controls'}
+
+figure_targets = {'static': 'static_fig', 'weekly': 'weekly_fig'}
+figure_inputs = {'static': 'static_ghg', 'weekly': 'weekly_ghg'}
+
+def css_style(style):
+    """
+    Returns a React style dict as a CSS declaration string
+    """
+    return '; '.join(f"{re.sub('([A-Z])', lambda m: '-' + m.group(1).lower(), key)}: {value}"
+                     for key, value in style.items())
+
+def local_url(url):
+    """
+    Returns asset URLs relative to the bundle root
+    """
+    return url.lstrip('/') if isinstance(url, str) and url.startswith('/assets/') else url
+
+def markdown_to_html(text):
+    """
+    Returns the HTML of the small markdown subset used by the page:
+    headings, paragraphs, bullet lists and links
+    """
+    def inline(line):
+        line = html.escape(line.strip())
+        return re.sub(r'\[([^\]]+)\]\(([^)]+)\)', r'<a href="\2">\1</a>', line)
+
+    blocks = re.split(r'\n\s*\n', textwrap.dedent(text).strip('\n'))
+    parts = []
+    for block in blocks:
+        lines = [each for each in block.split('\n') if each.strip()]
+        if not lines:
+            continue
+        heading = re.match(r'^(#{1,6})\s+(.*)$', lines[0].strip())
+        if heading and len(lines) == 1:
+            level = len(heading.group(1))
+            parts.append(f'<h{level}>{inline(heading.group(2))}</h{level}>')
+        elif all(each.strip().startswith('- ') for each in lines):
+            items = ''.join(f'<li>{inline(each.strip()[2:])}</li>' for each in lines)
+            parts.append(f'<ul>{items}</ul>')
+        else:
+            parts.append('<p>' + ' '.join(inline(each) for each in lines) + '</p>')
+    return '\n'.join(parts)
+
+def attributes(props, names = ('id', 'className', 'style', 'href', 'src')):
+    text = ''
+    for name in names:
+        if props.get(name) is None:
+            continue
+        value = props[name]
+        if name == 'style':
+            value = css_style(value)
+        elif name in ('href', 'src'):
+            value = local_url(value)
+        text += f' {"class" if name == "className" else name}="{html.escape(str(value))}"'
+    return text
+
+def render_component(component):
+    """
+    Returns the static HTML of a Dash component tree
+    """
+    if component is None:
+        return ''
+    if isinstance(component, (str, int, float)):
+        return html.escape(str(component))
+    if isinstance(component, (list, tuple)):
+        return ''.join(render_component(each) for each in component)
+
+    spec = component.to_plotly_json()
+    kind, namespace, props = spec['type'], spec['namespace'], spec['props']
+    if props.get('id') in server_only_ids:
+        return ''
+
+    if kind == 'Markdown':
+        return f'<div{attributes(props)}>{markdown_to_html(props.get("children", ""))}</div>'
+
+    if kind == 'RadioItems':
+        label_style = css_style(props.get('labelStyle') or {})
+        options = ''.join(
+            f'<label style="{html.escape(label_style)}">'
+            f'<input type="radio" name="{html.escape(props["id"])}" '
+            f'value="{html.escape(str(each["value"]))}"'
+            f'{" checked" if each["value"] == props.get("value") else ""}> '
+            f'{html.escape(str(each["label"]))}</label>'
+            for each in props['options'])
+        return f'<div{attributes(props)}>{options}</div>'
+
+    if namespace == 'dash_html_components':
+        tag = kind.lower()
+        if tag in ('img', 'hr', 'br'):
+            return f'<{tag}{attributes(props)}>'
+        return f'<{tag}{attributes(props)}>{render_component(props.get("children"))}</{tag}>'
+
+    raise ValueError(f'Cannot export the {namespace}.{kind} component')
+
+page_script = '''
+const inlineFigures = __INLINE__;
+const figureTargets = __TARGETS__;
+const figureInputs = __INPUTS__;
+const loaded = {};
+
+function loadFigure(name) {
+    if (inlineFigures !== null) {
+        return Promise.resolve(inlineFigures[name]);
+    }
+    if (!(name in loaded)) {
+        loaded[name] = fetch('figures/' + name + '.json').then(response => response.json());
+    }
+    return loaded[name];
+}
+
+function showFigure(kind, ghg) {
+    const target = document.getElementById(figureTargets[kind]);
+    if (!target.firstChild) {
+        target.innerHTML = '<div class="row"><div class="offset-by-one nine columns" ' +
+                           'style="padding-left: 5%"></div></div>';
+    }
+    const graph = target.querySelector('.columns');
+    loadFigure(kind + '-' + ghg).then(figure => {
+        Plotly.react(graph, figure.data, figure.layout, {responsive: true});
+    });
+}
+
+for (const kind in figureInputs) {
+    const inputs = document.querySelectorAll('input[name="' + figureInputs[kind] + '"]');
+    inputs.forEach(input => {
+        input.addEventListener('change', () => showFigure(kind, input.value));
+        if (input.checked) {
+            showFigure(kind, input.value);
+        }
+    });
+}
+'''
+
+def page_html(body, stylesheets, plotly_src, inline_figures):
+    script = (page_script
+              .replace('__INLINE__', 'null' if inline_figures is None
+                                     else '{' + ','.join(f'{json.dumps(name)}:{fig_json}'
+                                                         for name, fig_json in inline_figures.items()) + '}')
+              .replace('__TARGETS__', json.dumps(figure_targets))
+              .replace('__INPUTS__', json.dumps(figure_inputs)))
+    links = '\n'.join(f'<link rel="stylesheet" href="{html.escape(local_url(each))}">'
+                      for each in stylesheets)
+    return f'''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>Estimating Weekly Greenhouse Gas Emission</title>
+{links}
+<script src="{plotly_src}"></script>
+</head>
+<body>
+{body}
+<script>{script}</script>
+</body>
+</html>
+'''
+
+def export_site(output_dir, results_dir = default_results_dir, inline = False, plotly_cdn = False):
+    """
+    Writes the static bundle of the current results to `output_dir`.
+    The bundle is built next to it and swapped in when complete.
+    """
+    key, _ = precompute_figures(results_dir)
+    disk_cache = FigureDiskCache(figures_dir(results_dir))
+    figures = {f'{kind}-{ghg}': disk_cache.load(key, kind, ghg)
+               for kind in figure_kinds
+               for ghg in gh_gases}
+
+    import app
+
+    output_dir = os.path.abspath(output_dir)
+    build_dir = f'{output_dir}.tmp'
+    shutil.rmtree(build_dir, ignore_errors = True)
+    shutil.copytree(os.path.join(repo_dir, 'assets'), os.path.join(build_dir, 'assets'))
+
+    if plotly_cdn:
+        plotly_src = f'https://cdn.plot.ly/plotly-{plotly.offline.get_plotlyjs_version()}.min.js'
+    else:
+        plotly_src = 'plotly.min.js'
+        with open(os.path.join(build_dir, plotly_src), 'w') as plotly_file:
+            plotly_file.write(plotly.offline.get_plotlyjs())
+
+    if not inline:
+        os.makedirs(os.path.join(build_dir, 'figures'))
+        for name, fig_json in figures.items():
+            with open(os.path.join(build_dir, 'figures', f'{name}.json'), 'w') as fig_file:
+                fig_file.write(fig_json)
+
+    with open(os.path.join(build_dir, 'index.html'), 'w') as page_file:
+        page_file.write(page_html(render_component(app.app.layout),
+                                  app.external_stylesheets,
+                                  plotly_src,
+                                  figures if inline else None))
+
+    shutil.rmtree(f'{output_dir}.old', ignore_errors = True)
+    if os.path.exists(output_dir):
+        os.rename(output_dir, f'{output_dir}.old')
+    os.rename(build_dir, output_dir)
+    shutil.rmtree(f'{output_dir}.old', ignore_errors = True)
+
+    return key
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Export the dashboard as a static site')
+    parser.add_argument('output_dir')
+    parser.add_argument('--results-dir', default = default_results_dir)
+    parser.add_argument('--inline', action = 'store_true',
+                        help = 'inline the figures in index.html instead of separate files')
+    parser.add_argument('--plotly-cdn', action = 'store_true',
+                        help = 'load plotly.js from its CDN instead of the bundle')
+    args = parser.parse_args()
+
+    key = export_site(args.output_dir, args.results_dir, args.inline, args.plotly_cdn)
+    print(f'exported {key} to {args.output_dir}')
@@ -0,0 +1,25 @@
+## Importing app has no side effects
+
+# `static_export.py`, the benchmarks and the tests import `app`; the figure
+#     precompute only starts with the first request the server handles.
+
+import os
+import subprocess
+import sys
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+check_script = """
+import threading
+import app
+
+assert app.figure_precompute_thread is None
+assert 'figure-precompute' not in [each.name for each in threading.enumerate()]
+"""
+
+def test_import_starts_nothing_and_writes_nothing(tmp_path):
+    environment = dict(os.environ, PYTHONPATH = repo_dir)
+    subprocess.run([sys.executable, "-c", check_script],
+                   cwd = tmp_path, env = environment, check = True, timeout = 300)
+
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,58 @@
+## Dynamic_Update revisions of stored weeks
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from Dynamic_Update import revise_weekly
+from Results_Dataset import open_weekly_dataset
+from Weekly_Cube import open_weekly_cube
+from Weekly_Estimator import gh_gases
+
+estimate_columns = [f"{each_gas}_{each_metric}"
+                    for each_gas in gh_gases
+                    for each_metric in ["weekly", "change"]]
+
+def weekly_rows(country, week, gdp_change):
+    value = np.nan if np.isnan(gdp_change) else gdp_change
+    return dict({"Country": country, "Week": week, "GDP_Change": gdp_change},
+                **{each_column: value for each_column in estimate_columns})
+
+# Italy has no GDP change, so no estimate, in the week that is revised.
+
+@pytest.fixture
+def results_dir(tmp_path):
+    df_weekly = pd.DataFrame([
+        weekly_rows("Italy", "2021-09-26", 1.0),
+        weekly_rows("Japan", "2021-09-26", 2.0),
+        weekly_rows("Italy", "2021-10-03", np.nan),
+        weekly_rows("Japan", "2021-10-03", 3.0),
+    ])
+    df_weekly.to_parquet(tmp_path/"df_weekly.parquet")
+    return str(tmp_path)
+
+def test_revision_keeps_rows_without_estimates(results_dir):
+    weekly_cube = open_weekly_cube(results_dir)
+    df_revised = pd.DataFrame([weekly_rows("Japan", "2021-10-03", 4.0)])
+
+    revise_weekly(df_revised, results_dir, weekly_cube)
+
+    df_week = open_weekly_dataset(results_dir).read("2021-10-03", "2021-10-03")
+    assert df_week["Country"].tolist() == ["Italy", "Japan"]
+    assert np.isnan(df_week["GDP_Change"].iloc[0])
+    assert df_week["GDP_Change"].iloc[1] == 4.0
+    assert weekly_cube.lookup("2021-10-03", "Japan", "GHG") == 4.0
+
+def test_revision_leaves_other_weeks(results_dir):
+    weekly_cube = open_weekly_cube(results_dir)
+    df_revised = pd.DataFrame([weekly_rows("Japan", "2021-10-03", 4.0)])
+
+    revise_weekly(df_revised, results_dir, weekly_cube)
+
+    df_week = open_weekly_dataset(results_dir).read("2021-09-26", "2021-09-26")
+    assert df_week["GDP_Change"].tolist() == [1.0, 2.0]
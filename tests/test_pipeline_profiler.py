@@ -0,0 +1,48 @@
+## Pipeline_Profiler run comparisons
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from Pipeline_Profiler import compare_runs
+
+def run(wall_s, mode = "update", skipped = None):
+    fields = {"mode": mode} if skipped is None else {"mode": mode, "skipped": skipped}
+    stages = [{"stage": "download", "wall_s": 0.01}]
+    if not skipped:
+        stages.append({"stage": "read_excel", "wall_s": wall_s*0.9})
+    return dict({"wall_s": wall_s, "stages": stages}, **fields)
+
+def flagged_stages(rows):
+    return [name for name, _, _, _, flagged in rows if flagged]
+
+# Quiet days of skipped runs and a few stream runs between two full updates
+
+def mixed_history():
+    return ([run(2.0), run(2.1)] +
+            [run(0.09, skipped = True) for _ in range(8)] +
+            [run(0.5, mode = "stream") for _ in range(3)])
+
+def test_update_is_compared_to_updates_only():
+    rows = compare_runs(mixed_history() + [run(2.2)])
+
+    assert flagged_stages(rows) == []
+    medians = {name: median for name, _, median, _, _ in rows}
+    assert medians["total"] == 2.05
+
+def test_skipped_run_is_compared_to_skipped_runs():
+    rows = compare_runs(mixed_history() + [run(0.09, skipped = True)])
+
+    assert flagged_stages(rows) == []
+    assert [name for name, *_ in rows] == ["download", "total"]
+
+def test_regression_is_still_flagged():
+    rows = compare_runs(mixed_history() + [run(6.0)])
+
+    assert flagged_stages(rows) == ["read_excel", "total"]
+
+def test_first_run_of_a_mode_has_no_median():
+    rows = compare_runs(mixed_history()[:2] + [run(0.5, mode = "stream")])
+
+    assert all(median is None for _, _, median, _, _ in rows)
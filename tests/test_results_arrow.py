@@ -0,0 +1,77 @@
+## Results_Arrow memory maps
+
+# The numeric columns of the frames read by `read_arrow` must point into
+#     the memory-mapped file, not into a copy owned by the reader.
+#     The mapped ranges are taken from /proc/self/maps.
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from Results_Arrow import arrow_path, publish_arrow_results, read_arrow
+from Results_Dataset import open_weekly_dataset
+
+pytestmark = pytest.mark.skipif(not os.path.exists("/proc/self/maps"),
+                                reason = "needs /proc/self/maps")
+
+def mapped_ranges(path):
+    path = os.path.realpath(path)
+    ranges = []
+    with open("/proc/self/maps") as maps_file:
+        for line in maps_file:
+            if line.rstrip().endswith(path):
+                start, end = line.split()[0].split("-")
+                ranges.append((int(start, 16), int(end, 16)))
+    return ranges
+
+def unmapped_columns(df, path):
+    ranges = mapped_ranges(path)
+    unmapped = []
+    for each_column in df.columns:
+        if df[each_column].dtype.kind != "f":
+            continue
+        address = df[each_column].to_numpy().__array_interface__["data"][0]
+        if not any(start <= address < end for start, end in ranges):
+            unmapped.append(each_column)
+    return unmapped
+
+@pytest.fixture
+def results_dir(tmp_path):
+    weeks = [str(each.date()) for each in pd.date_range("2021-01-03", periods = 6, freq = "7D")]
+    countries = ["France", "Italy", "Japan"]
+    n_rows = len(weeks)*len(countries)
+    df_weekly = pd.DataFrame({
+        "Country": countries*len(weeks),
+        "Week": np.repeat(weeks, len(countries)),
+        "GDP_Change": np.linspace(-5, 5, n_rows),
+        "GHG_weekly": np.linspace(100, 200, n_rows),
+        "GHG_change": np.linspace(-1, 1, n_rows),
+    })
+    df_weekly.to_parquet(tmp_path/"df_weekly.parquet")
+    df_static = pd.DataFrame({"Country": countries, "Year": 2019, "GDP": [1.0, 2.0, 3.0]})
+    df_static.to_parquet(tmp_path/"df_static.parquet")
+    df_static.set_index("Country").to_parquet(tmp_path/"df_estimate.parquet")
+    return tmp_path
+
+def test_weekly_columns_point_into_the_map(results_dir):
+    publish_arrow_results(str(results_dir))
+    path = arrow_path(str(results_dir), "df_weekly")
+
+    df_weekly = read_arrow(path)
+
+    assert len(open_weekly_dataset(str(results_dir)).weeks()) == 6
+    pd.testing.assert_frame_equal(df_weekly, open_weekly_dataset(str(results_dir)).read(),
+                                  check_dtype = False)
+    assert unmapped_columns(df_weekly, path) == []
+    assert not os.path.exists(f"{path}.parts")
+
+def test_static_columns_point_into_the_map(results_dir):
+    publish_arrow_results(str(results_dir))
+    path = arrow_path(str(results_dir), "df_static")
+
+    assert unmapped_columns(read_arrow(path), path) == []
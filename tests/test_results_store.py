@@ -0,0 +1,52 @@
+## ResultsStore reloads
+
+import os
+import sys
+import time
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from results_store import ResultsStore, version_key
+
+@pytest.fixture
+def results_dir(tmp_path):
+    df_weekly = pd.DataFrame({"Country": ["Japan"], "Week": ["2021-10-03"], "GDP_Change": [1.0]})
+    df_weekly.to_parquet(tmp_path/"df_weekly.parquet")
+    pd.DataFrame({"Country": ["Japan"], "GDP": [1.0]}).to_parquet(tmp_path/"df_static.parquet")
+    pd.DataFrame({"GHG_coef": [1.0]}, index = ["Japan"]).to_parquet(tmp_path/"df_estimate.parquet")
+    (tmp_path/"VERSION").write_text("2021-10-04T00:00:00.000000")
+    return tmp_path
+
+# The notebook rewrites `df_static` without touching the VERSION marker.
+
+def test_rewrite_outside_the_pipeline_is_reloaded(results_dir):
+    store = ResultsStore(str(results_dir), check_interval = 0)
+    assert store.get("df_static")["GDP"].tolist() == [1.0]
+    key = version_key(store.version)
+
+    time.sleep(0.01)
+    pd.DataFrame({"Country": ["Japan"], "GDP": [2.0]}).to_parquet(results_dir/"df_static.parquet")
+
+    assert store.get("df_static")["GDP"].tolist() == [2.0]
+    assert store.reloads == 1
+    assert version_key(store.version) != key
+
+def test_new_marker_is_reloaded(results_dir):
+    store = ResultsStore(str(results_dir), check_interval = 0)
+    store.get("df_static")
+
+    (results_dir/"VERSION").write_text("2021-10-11T00:00:00.000000")
+
+    store.get("df_static")
+    assert store.reloads == 1
+
+def test_unchanged_results_are_not_reloaded(results_dir):
+    store = ResultsStore(str(results_dir), check_interval = 0)
+    store.get("df_static")
+    store.get("df_weekly")
+
+    assert store.reloads == 0
+    assert store.disk_reads == 3
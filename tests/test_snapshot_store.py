@@ -0,0 +1,54 @@
+## Snapshot_Store sizes and restores
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from Snapshot_Store import SnapshotStore
+
+def tracker_dump(n_regions = 40, n_dates = 50, seed = 0):
+    rng = np.random.default_rng(seed)
+    regions = np.repeat([f"R{i:02d}" for i in range(n_regions)], n_dates)
+    dates = np.tile(pd.date_range("2021-01-03", periods = n_dates, freq = "7D").strftime("%Y-%m-%d"),
+                    n_regions)
+    return pd.DataFrame({"region": regions,
+                         "date": dates,
+                         "yo2y": rng.normal(size = n_regions*n_dates)})
+
+def disk_bytes(store_dir):
+    return sum(os.path.getsize(os.path.join(each_dir, each_file))
+               for each_dir, _, files in os.walk(store_dir)
+               for each_file in files
+               if each_file != "manifest.json")
+
+def test_report_counts_every_stored_file(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    df_first = tracker_dump()
+    df_second = df_first.copy()
+    df_second.loc[:9, "yo2y"] += 1
+
+    store.put("first", df_first)
+    assert store.report()["stored_bytes"].sum() == disk_bytes(tmp_path)
+
+    store.put("second", df_second)
+    df_report = store.report()
+    assert df_report["kind"].tolist() == ["base", "delta"]
+    assert df_report["stored_bytes"].sum() == disk_bytes(tmp_path)
+
+def test_snapshots_are_restored_exactly(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    df_first = tracker_dump()
+    df_second = df_first.copy()
+    df_second.loc[:9, "yo2y"] += 1
+
+    store.put("first", df_first)
+    store.put("second", df_second)
+
+    pd.testing.assert_frame_equal(store.get("first"), df_first)
+    pd.testing.assert_frame_equal(store.get("second"), df_second)
+    os.remove(os.path.join(str(tmp_path), "head-second.parquet"))
+    pd.testing.assert_frame_equal(store.get("second"), df_second)
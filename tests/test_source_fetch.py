@@ -0,0 +1,116 @@
+## Source_Fetch against a local HTTP stand-in
+
+# The upstream sources are replaced by files served from a temporary
+#     directory by `http.server` on localhost, so the tests make no
+#     request outside the machine.
+
+import functools
+import hashlib
+import http.server
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from Source_Fetch import fetch_all, read_mirror_manifest
+
+workbook_bytes = b"weekly tracker workbook\n"*1000
+
+# The stock handler answers If-Modified-Since with a 304.
+#     With `etag = True` it also sends an ETag and answers If-None-Match.
+#     Every request and its status code are recorded.
+
+class StandInHandler(http.server.SimpleHTTPRequestHandler):
+    etag = False
+    requests = []
+
+    def send_head(self):
+        if self.etag:
+            path = self.translate_path(self.path)
+            with open(path, "rb") as served_file:
+                tag = f'"{hashlib.sha256(served_file.read()).hexdigest()[:16]}"'
+            if self.headers.get("If-None-Match") == tag:
+                self.send_response(304)
+                self.send_header("ETag", tag)
+                self.end_headers()
+                return None
+            self._etag = tag
+        return super().send_head()
+
+    def end_headers(self):
+        if getattr(self, "_etag", None):
+            self.send_header("ETag", self._etag)
+        super().end_headers()
+
+    def send_response(self, code, message = None):
+        self.requests.append((self.path, code, self.headers.get("If-None-Match"),
+                              self.headers.get("If-Modified-Since")))
+        super().send_response(code, message)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture(params = [True, False], ids = ["etag", "if-modified-since"])
+def stand_in(request, tmp_path):
+    served_dir = tmp_path/"served"
+    served_dir.mkdir()
+    (served_dir/"weekly_tracker.xlsx").write_bytes(workbook_bytes)
+
+    handler = type("Handler", (StandInHandler,), {"etag": request.param, "requests": []})
+    server = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(handler, directory = str(served_dir)))
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+
+    url = f"http://127.0.0.1:{server.server_address[1]}/weekly_tracker.xlsx"
+    yield url, handler.requests, tmp_path/"mirror"
+
+    server.shutdown()
+    server.server_close()
+
+def tracker_source(url):
+    return {"tracker": (url, "weekly_tracker.xlsx")}
+
+def test_first_fetch_is_updated(stand_in):
+    url, requests, mirror_dir = stand_in
+
+    entries = fetch_all(tracker_source(url), str(mirror_dir))
+
+    assert entries["tracker"]["status"] == "updated"
+    assert (mirror_dir/"weekly_tracker.xlsx").read_bytes() == workbook_bytes
+    assert entries["tracker"]["sha256"] == hashlib.sha256(workbook_bytes).hexdigest()
+    assert read_mirror_manifest(str(mirror_dir))["tracker"]["size"] == len(workbook_bytes)
+    assert [code for _, code, _, _ in requests] == [200]
+
+def test_second_fetch_is_unchanged(stand_in):
+    url, requests, mirror_dir = stand_in
+
+    fetch_all(tracker_source(url), str(mirror_dir))
+    entries = fetch_all(tracker_source(url), str(mirror_dir))
+
+    assert entries["tracker"]["status"] == "unchanged"
+    assert [code for _, code, _, _ in requests] == [200, 304]
+    _, _, if_none_match, if_modified_since = requests[-1]
+    assert if_none_match is not None or if_modified_since is not None
+
+def test_offline_makes_no_request(stand_in):
+    url, requests, mirror_dir = stand_in
+
+    fetch_all(tracker_source(url), str(mirror_dir))
+    entries = fetch_all(tracker_source(url), str(mirror_dir), offline = True)
+
+    assert entries["tracker"]["status"] == "offline"
+    assert len(requests) == 1
+
+def test_offline_fails_on_checksum_mismatch(stand_in):
+    url, requests, mirror_dir = stand_in
+
+    fetch_all(tracker_source(url), str(mirror_dir))
+    (mirror_dir/"weekly_tracker.xlsx").write_bytes(b"truncated")
+
+    with pytest.raises(FileNotFoundError):
+        fetch_all(tracker_source(url), str(mirror_dir), offline = True)
+    assert len(requests) == 1
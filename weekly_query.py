@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+#####################################################################
+#
+# weekly query layer
+#
+#####################################################################
+
+# Coarsest last. 'auto' picks the first one that fits `max_points`.
+resolutions = ['week', 'month', 'quarter', 'year']
+
+period_codes = {'month': 'M', 'quarter': 'Q'}
+
+default_max_points = 104
+
+def period_labels(weeks, resolution):
+    """
+    Returns the period label of each 'YYYY-MM-DD' week at `resolution`,
+    e.g. '2021-11' for a month and '2021Q4' for a quarter
+    """
+    if resolution == 'week':
+        return np.asarray(weeks, dtype = object)
+    if resolution == 'year':
+        return np.asarray([each[:4] for each in weeks], dtype = object)
+    periods = pd.to_datetime(pd.Series(weeks)).dt.to_period(period_codes[resolution])
+    return periods.astype(str).to_numpy(dtype = object)
+
+def select_weeks(df_weekly, start = None, end = None):
+    """
+    Returns the rows with start <= Week <= end. Weeks are ISO date strings,
+    so they compare in date order.
+    """
+    keep = np.ones(len(df_weekly), dtype = bool)
+    weeks = df_weekly['Week'].to_numpy(dtype = object)
+    if start:
+        keep &= weeks >= str(start)[:10]
+    if end:
+        keep &= weeks <= str(end)[:10]
+    return df_weekly[keep]
+
+def choose_resolution(df_window, max_points):
+    """
+    Returns the finest resolution with at most `max_points` periods per country
+    """
+    weeks = np.unique(df_window['Week'].to_numpy(dtype = object))
+    for resolution in resolutions:
+        if len(np.unique(period_labels(weeks, resolution))) <= max_points:
+            return resolution
+    return resolutions[-1]
+
+def cap_points(df_query, max_points):
+    """
+    Merges neighbouring periods of each country into `max_points` even
+    buckets, labelled by their first period, when there are more periods
+    """
+    periods = np.unique(df_query['Week'].to_numpy(dtype = object))
+    if len(periods) <= max_points:
+        return df_query
+
+    bucket = (np.arange(len(periods))*max_points)//len(periods)
+    first_period = {}
+    for period, each_bucket in zip(periods, bucket):
+        first_period.setdefault(each_bucket, period)
+    labels = {period: first_period[each_bucket]
+              for period, each_bucket in zip(periods, bucket)}
+
+    df_query = df_query.assign(Week = df_query['Week'].map(labels))
+    return df_query.groupby(['Country', 'Week'], as_index = False, sort = True).mean()
+
+def query_weekly(df_weekly, ghg, start = None, end = None,
+                 resolution = 'auto', max_points = default_max_points):
+    """
+    Returns the weekly estimates of `ghg` for start <= Week <= end,
+    aggregated to `resolution` with at most `max_points` periods per country.
+
+    The result has the `Country`, `Week` and `{ghg}_weekly` columns of
+    `df_weekly`, so it can be passed to the figure builders as it is.
+    `Week` holds the period label, and `{ghg}_weekly` is the mean weekly
+    amount over the weeks of the period, so every resolution keeps the
+    same unit.
+    """
+    column = f'{ghg}_weekly'
+    df_window = select_weeks(df_weekly, start, end)[['Country', 'Week', column]]
+    if df_window.empty:
+        return df_window.reset_index(drop = True)
+
+    if resolution == 'auto':
+        resolution = choose_resolution(df_window, max_points)
+
+    if resolution != 'week':
+        df_window = df_window.assign(Week = period_labels(df_window['Week'].tolist(),
+                                                          resolution))
+        df_window = df_window.groupby(['Country', 'Week'], as_index = False,
+                                      sort = True).mean()
+    else:
+        df_window = df_window.sort_values(['Country', 'Week'], kind = 'stable')
+
+    return cap_points(df_window, max_points).reset_index(drop = True)